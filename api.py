@@ -0,0 +1,93 @@
+import hashlib
+import numpy as np
+from flask import Blueprint, abort, jsonify, request
+
+import data_store
+from constants import PATIENTS, TIMESTAMPS
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+ICP_ORGANS = ["prostate", "bladder", "rectum"]
+CENTRING_ORGANS = ["bones", "bladder", "rectum"]
+ORGAN_REGISTRATION_ORGANS = ["prostate", "bladder", "rectum"]
+
+
+def _values(array):
+    """Converts the array into lists with None instead of the values which were not computed."""
+    return np.where(np.isnan(array), None, array).tolist()
+
+
+def _fraction(dataset, i, j):
+    """Results of the patient with index i in the timestamp with index j."""
+    registration = dataset["registrations"].get((PATIENTS[i], str(TIMESTAMPS[j])))
+
+    return dict(timestamp=TIMESTAMPS[j],
+                distances=dict(icp=dict(zip(ICP_ORGANS, _values(dataset["distances_icp"][i, :, j]))),
+                               centring=dict(zip(CENTRING_ORGANS, _values(dataset["distances_center"][i, :, j]))),
+                               organ_registration=dict(zip(ORGAN_REGISTRATION_ORGANS,
+                                                           _values(dataset["distances_organ"][i, :, j])))),
+                rotation=dict(zip("xyz", _values(dataset["rotations"][i, :, j]))),
+                matrix=None if registration is None else np.asarray(registration.matrix).tolist(),
+                registration_error=None if registration is None else registration.error,
+                iterations=None if registration is None else registration.iterations)
+
+
+def _patient(dataset, patient):
+    """Every result of the patient."""
+    if patient not in PATIENTS:
+        abort(404, "Unknown patient {}".format(patient))
+    i = PATIENTS.index(patient)
+
+    return dict(patient=patient,
+                averages=dict(icp=dict(zip(ICP_ORGANS, _values(dataset["averages_icp"][i]))),
+                              centring=dict(zip(CENTRING_ORGANS, _values(dataset["averages_center"][i]))),
+                              organ_registration=dict(zip(ORGAN_REGISTRATION_ORGANS,
+                                                          _values(dataset["averages_organ"][i])))),
+                fractions=[_fraction(dataset, i, j) for j in range(len(TIMESTAMPS))])
+
+
+def _respond(dataset, payload):
+    """
+    Creates the json response with an ETag derived from the data version and the request, so the clients can
+    revalidate their copies and receive 304 Not Modified until the data change.
+    """
+    response = jsonify(payload)
+    response.set_etag(hashlib.sha1((dataset["version"] + request.full_path).encode()).hexdigest())
+    response.headers["Cache-Control"] = "no-cache"
+
+    return response.make_conditional(request)
+
+
+@api.route("/patients")
+def patients():
+    """Ids of all patients and the timestamps."""
+    dataset = data_store.current()
+    return _respond(dataset, dict(patients=PATIENTS, timestamps=TIMESTAMPS, version=dataset["version"]))
+
+
+@api.route("/patients/<patient>")
+def patient_results(patient):
+    """Distances, averages, rotations and transformation matrices of one patient."""
+    dataset = data_store.current()
+    return _respond(dataset, _patient(dataset, patient))
+
+
+@api.route("/patients/<patient>/fractions/<int:timestamp>")
+def fraction_results(patient, timestamp):
+    """Results of one patient in one timestamp."""
+    dataset = data_store.current()
+    if patient not in PATIENTS or timestamp not in TIMESTAMPS:
+        abort(404, "Unknown patient {} or timestamp {}".format(patient, timestamp))
+
+    return _respond(dataset, _fraction(dataset, PATIENTS.index(patient), TIMESTAMPS.index(timestamp)))
+
+
+@api.route("/bulk")
+def bulk_results():
+    """Results of several patients at once, e.g. /api/bulk?patients=137,146, all patients without the parameter."""
+    dataset = data_store.current()
+    selected = request.args.get("patients")
+    selected = selected.split(",") if selected else PATIENTS
+
+    return _respond(dataset, dict(version=dataset["version"],
+                                  patients=[_patient(dataset, patient.strip()) for patient in selected]))
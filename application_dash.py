@@ -1,19 +1,26 @@
-import json
-import trimesh
 import logging
 import numpy as np
 import plotly.graph_objects as go
 import constants
-import registration_methods
 import application_html
-from copy import deepcopy
+import mesh_cache
+import registration_methods
+import data_store
+import figure_cache
+import cohort_statistics
+import serving
+from api import api
 from plotly.subplots import make_subplots
 from dash import Dash, Output, Input, callback_context, ctx
-from constants import FILEPATH, PATIENTS, TIMESTAMPS
+from constants import PATIENTS, TIMESTAMPS
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
-app = Dash(__name__, external_stylesheets=external_stylesheets)
+app = Dash(__name__, external_stylesheets=external_stylesheets,
+           compress=constants.COMPRESS_RESPONSES and serving.compression_available())
 app.layout = application_html.layout
+server = app.server
+server.register_blueprint(api)
+serving.enable(app)
 
 # enable only console writing errors
 # log = logging.getLogger('werkzeug')
@@ -24,25 +31,11 @@ patient_id = "137"
 timestamp_i = 0  # one lower than actual timestamp because used as index
 organ = "Prostate"
 
-# loading of the computed distances used for the graphs
-with open("computations_files/icp_distances_c.txt", "r") as icp_dist, \
-        open("computations_files/icp_averages_c.txt", "r") as icp_avrg:
-    all_distances_icp = json.load(icp_dist)
-    lines = icp_avrg.read().splitlines()
-    avrg_prostate_icp = list(map(float, lines[::3]))
-    avrg_bladder_icp = list(map(float, lines[1::3]))
-    avrg_rectum_icp = list(map(float, lines[2::3]))
-
-with open("computations_files/center_distances_c.txt", "r") as center_dist, \
-        open("computations_files/center_averages_c.txt", "r") as center_avrg:
-    all_distances_center = json.load(center_dist)
-    lines = center_avrg.read().splitlines()
-    avrg_bones_center = list(map(float, lines[::3]))
-    avrg_bladder_center = list(map(float, lines[1::3]))
-    avrg_rectum_center = list(map(float, lines[2::3]))
-
-with open("computations_files/rotation_icp.txt", "r") as rotations_icp:
-    rotations = json.load(rotations_icp)
+# the computed results used for the graphs are read from data_store.current(), which is swapped when the
+# computations files change, so every callback takes the dataset once and uses it for the whole figure
+data_store.current()
+if constants.RELOAD_INTERVAL:
+    data_store.watch(constants.RELOAD_INTERVAL)
 
 
 def create_meshes_from_objs(objects, color):
@@ -54,8 +47,8 @@ def create_meshes_from_objs(objects, color):
     """
     meshes = []
     for elem in objects:
-        x, y, z = np.array(elem[0]).T
-        i, j, k = np.array(elem[1]).T
+        x, y, z = np.asarray(elem[0], dtype=np.float32).T
+        i, j, k = np.asarray(elem[1], dtype=np.int32).T
         pl_mesh = go.Mesh3d(x=x, y=y, z=z, color=color, flatshading=True, i=i, j=j, k=k, showscale=False)
         meshes.append(pl_mesh)
     return meshes
@@ -88,10 +81,18 @@ def order_slice_vertices(vertices, indices):
 def options_visibility(mode):
     """
     Changes the 3D graph options visibility according to the chosen mode
-    :param mode: either Two timestamps or Plan organs mode
+    :param mode: Two timestamps, All timestamps or Plan organs mode
     :return: display style
     """
-    if mode == "Two timestamps":
+    if mode == "All timestamps":
+        return {'display': 'inline-block', "padding": "0px 50px 0px 45px"}, \
+               {'display': 'inline-block', "font-size": "18px", "padding": "0px 100px 0px 12px"}, \
+               {'display': 'none'}, {'display': 'none'}, {'display': 'none'}, \
+               {"padding": "20px 0px 0px 45x", "display": "inline-block",
+                "margin": "20px 0px 10px 45px", "height": "600px"}, {"padding": "137px 0px 0px 0px"}, \
+               {"padding": "99px 0px 0px 0px"}
+
+    elif mode == "Two timestamps":
         return {'display': 'inline-block', "padding": "0px 50px 0px 45px"}, \
                {'display': 'inline-block', "font-size": "18px", "padding": "0px 100px 0px 12px"}, \
                {'display': 'inline-block', "padding": "0px 20px 0px 45px"}, \
@@ -110,6 +111,17 @@ def options_visibility(mode):
                {"padding": "50px 0px 0px 0px"}, {"padding": "12px 0px 0px 0px"}
 
 
+def heatmap_row(data):
+    """
+    Row of the patient of a heatmap click. The binned cells of a large cohort carry the row of the patient with their
+    maximum, the other cells are in the row of their patient.
+    :param data: point of the clickData of a heatmap
+    :return: index of the patient in PATIENTS
+    """
+    custom_data = data.get("customdata")
+    return int(custom_data[1]) if isinstance(custom_data, list) else int(round(data["y"]))
+
+
 def decide_organs_highlights(click_data, click_id, icp):
     """
     Computes what to highlight in the organ_distances graph according to clickData from other graphs.
@@ -128,7 +140,7 @@ def decide_organs_highlights(click_data, click_id, icp):
     data = click_data["points"][0]
 
     if "heatmap" in click_id:
-        patient_id = PATIENTS[data["y"]]
+        patient_id = PATIENTS[heatmap_row(data)]
         timestamp_i = int(data["x"]) // 4
         organ = data["text"]
         if data["text"] == "Bladder":
@@ -149,8 +161,8 @@ def decide_organs_highlights(click_data, click_id, icp):
         elif trace == 2:
             organ = "Rectum"
             colors[2], sizes[2] = ["white"] * 13, [4] * 13
-        elif (data["curveNumber"] == 0 and icp) or (data["curveNumber"] == 4 and not icp):
-            organ = "Prostate" if data["curveNumber"] == 0 else "Bones"
+        elif (data["curveNumber"] in (0, 7) and icp) or (data["curveNumber"] == 4 and not icp):
+            organ = "Bones" if data["curveNumber"] == 4 else "Prostate"
             colors[0], sizes[0] = ["white"] * 13, [4] * 13
 
     elif "organ" in click_id:
@@ -192,10 +204,11 @@ def decide_organs_highlights(click_data, click_id, icp):
     Input("average-distances", "clickData"),
     Input("heatmap-icp", "clickData"),
     Input("heatmap-center", "clickData"),
+    Input("heatmap-organ", "clickData"),
     Input("rotations-graph", "clickData"),
     Input("scale-organs", "value"))
-def create_organ_distances(click_data, differences, average_distances, heatmap_icp, heatmap_center, rotations_graph,
-                           scale):
+def create_organ_distances(click_data, differences, average_distances, heatmap_icp, heatmap_center, heatmap_organ,
+                           rotations_graph, scale):
     """
     Creates the organ_distances graph which shows how patient's organs moved in the 13 timestamps after RM aligning.
     :param click_data: clickData from this graph
@@ -203,15 +216,17 @@ def create_organ_distances(click_data, differences, average_distances, heatmap_i
     :param average_distances: clickData from the average_distances graph
     :param heatmap_icp: clickData from the heatmap_icp graph
     :param heatmap_center: clickData from the heatmap_center graph
+    :param heatmap_organ: clickData from the heatmap_organ graph
     :param rotations_graph: clickData from the rotations graph
     :param scale: changes axis range, can be uniform or individual
     :return: organ_distances figure
     """
     global patient_id
 
-    all_click_data = [click_data, differences, average_distances, heatmap_icp, heatmap_center, rotations_graph]
+    all_click_data = [click_data, differences, average_distances, heatmap_icp, heatmap_center, heatmap_organ,
+                      rotations_graph]
     all_ids = ["organ-distances", "alignment-differences", "average-distances", "heatmap-icp", "heatmap-center",
-               "rotations-graph"]
+               "heatmap-organ", "rotations-graph"]
     click_data, click_id = resolve_click_data(all_click_data, all_ids)
     colors_icp, colors_center = [[constants.BLUE1] * 13, [constants.BLUE3] * 13, [constants.BLUE4] * 13], \
                                 [[constants.BLUE2] * 13, [constants.BLUE3] * 13, [constants.BLUE4] * 13]
@@ -223,6 +238,16 @@ def create_organ_distances(click_data, differences, average_distances, heatmap_i
 
     fig = make_organ_distances_figure(colors_icp, sizes_icp, colors_center, sizes_center)
 
+    return finish_organ_distances_figure(fig, scale)
+
+
+def finish_organ_distances_figure(fig, scale):
+    """
+    Sets the axes and the layout of the organ distances graph.
+    :param fig: organ distances figure
+    :param scale: changes axis range, can be uniform or individual
+    :return: organ_distances figure
+    """
     fig.update_xaxes(title_text="Timestamp", tick0=0, dtick=1, zerolinewidth=1.2, gridcolor=constants.GREY, gridwidth=2)
     fig.update_yaxes(title_text="Distance [mm]", zerolinewidth=1.2, gridcolor=constants.GREY, gridwidth=1.2)
 
@@ -248,8 +273,9 @@ def make_organ_distances_figure(colors_icp, sizes_icp, colors_center, sizes_cent
     :param sizes_center: sizes of the prostate centring traces
     :return: organ distances figure
     """
-    prostate, bladder_icp, rectum_icp = all_distances_icp[PATIENTS.index(patient_id)]
-    bones, bladder_center, rectum_center = all_distances_center[PATIENTS.index(patient_id)]
+    dataset = data_store.current()
+    prostate, bladder_icp, rectum_icp = dataset["distances_icp"][PATIENTS.index(patient_id)]
+    bones, bladder_center, rectum_center = dataset["distances_center"][PATIENTS.index(patient_id)]
 
     fig = make_subplots(rows=1, cols=2, horizontal_spacing=0.1, subplot_titles=(
         "Distances of ICP aligned organs and the plan organs of patient {}".format(patient_id),
@@ -328,9 +354,10 @@ def decide_differences_highlights(click_data, click_id):
     Input("average-distances", "clickData"),
     Input("heatmap-icp", "clickData"),
     Input("heatmap-center", "clickData"),
+    Input("heatmap-organ", "clickData"),
     Input("rotations-graph", "clickData"))
 def create_distances_between_alignments(differences, organ_distances, average_distances, heatmap_icp, heatmap_center,
-                                        rotations_graph):
+                                        heatmap_organ, rotations_graph):
     """
     Creates the differences graph which shows the distinctions between the RM.
     :param differences: clickData from this graph
@@ -338,19 +365,22 @@ def create_distances_between_alignments(differences, organ_distances, average_di
     :param average_distances: clickData from the average_distances graph
     :param heatmap_icp: clickData from the heatmap_icp graph
     :param heatmap_center: clickData from the heatmap_center graph
+    :param heatmap_organ: clickData from the heatmap_organ graph
     :param rotations_graph: clickData from the rotations graph
     :return: differences graph figure
     """
     global patient_id
-    dist_icp = all_distances_icp[PATIENTS.index(patient_id)]
-    dist_center = all_distances_center[PATIENTS.index(patient_id)]
+    dataset = data_store.current()
+    dist_icp = dataset["distances_icp"][PATIENTS.index(patient_id)]
+    dist_center = dataset["distances_center"][PATIENTS.index(patient_id)]
     distances = np.array(dist_icp) - np.array(dist_center)
     _, bladder, rectum = distances[0], distances[1], distances[2]
     colors = [[constants.BLUE3] * 13, [constants.BLUE4] * 13]
 
-    all_click_data = [differences, organ_distances, average_distances, heatmap_icp, heatmap_center, rotations_graph]
+    all_click_data = [differences, organ_distances, average_distances, heatmap_icp, heatmap_center, heatmap_organ,
+                      rotations_graph]
     all_ids = ["alignment-differences", "organ-distances", "average-distances", "heatmap-icp", "heatmap-center",
-               "rotations-graph"]
+               "heatmap-organ", "rotations-graph"]
     click_data, click_id = resolve_click_data(all_click_data, all_ids)
 
     if click_data:
@@ -372,20 +402,169 @@ def create_distances_between_alignments(differences, organ_distances, average_di
     return fig
 
 
+@app.callback(
+    Output("overlap-graph", "figure"),
+    Input("overlap-metric", "value"),
+    Input("organ-distances", "clickData"),
+    Input("average-distances", "clickData"),
+    Input("heatmap-icp", "clickData"),
+    Input("heatmap-center", "clickData"),
+    Input("heatmap-organ", "clickData"))
+def create_overlap_graph(metric, organ_distances, average_distances, heatmap_icp, heatmap_center, heatmap_organ):
+    """
+    Creates the overlap graph which shows the volumetric overlap of patient's organs with the plan organs after RMs.
+    :param metric: Dice or Jaccard coefficient
+    :param organ_distances: used for firing the callback and changing the patient
+    :param average_distances: used for firing the callback and changing the patient
+    :param heatmap_icp: used for firing the callback and changing the patient
+    :param heatmap_center: used for firing the callback and changing the patient
+    :param heatmap_organ: used for firing the callback and changing the patient
+    :return: overlap figure
+    """
+    overlaps = data_store.current()["overlaps"][PATIENTS.index(patient_id), :, constants.OVERLAP_METRICS.index(metric)]
+    colors = [constants.BLUE1, constants.BLUE3, constants.BLUE4]
+    symbols = ["x", "square", "diamond"]
+
+    fig = make_subplots(rows=1, cols=len(constants.METHODS), horizontal_spacing=0.07, shared_yaxes=True,
+                        subplot_titles=["{} coefficient after {}<br>of patient {}".format(
+                            metric, constants.METHOD_TITLES[method], patient_id) for method in constants.METHODS])
+
+    for m in range(len(constants.METHODS)):
+        for k, organ_name in enumerate(constants.OVERLAP_ORGANS):
+            fig.add_trace(go.Scattergl(x=np.array(range(1, 14)), y=overlaps[m][k], mode="lines+markers",
+                                       name=organ_name, showlegend=m == 0, legendgroup=organ_name,
+                                       marker=dict(color=colors[k], symbol=symbols[k], size=12)), row=1, col=m + 1)
+
+    fig.update_xaxes(title_text="Timestamp", tick0=0, dtick=1, zerolinewidth=1.2, gridcolor=constants.GREY, gridwidth=2)
+    fig.update_yaxes(title_text=metric, range=[0, 1.05], zerolinewidth=1.2, gridcolor=constants.GREY, gridwidth=1.2)
+    fig.update_layout(yaxis2_showticklabels=True, yaxis3_showticklabels=True, uirevision=patient_id,
+                      font=dict(size=17, color='darkgrey'), paper_bgcolor='rgba(50,50,50,1)',
+                      plot_bgcolor='rgba(70,70,70,1)', height=380,
+                      legend=dict(orientation="h", yanchor="top", y=1.17, xanchor='center', x=0.53),
+                      margin=dict(t=100, b=70, l=90))
+    fig.update_annotations(yshift=37, font=dict(size=18, color='lightgrey'))
+
+    return fig
+
+
+@app.callback(
+    Output("fraction-pairs", "figure"),
+    Input("pairs-method", "value"),
+    Input("pairs-organ", "value"),
+    Input("average-distances", "clickData"),
+    Input("heatmap-icp", "clickData"),
+    Input("heatmap-center", "clickData"),
+    Input("heatmap-organ", "clickData"))
+def create_fraction_pairs_graph(method, organ_name, average_distances, heatmap_icp, heatmap_center, heatmap_organ):
+    """
+    Creates the heatmap of the residual distances between every pair of the patient's timestamps.
+    :param method: ICP, prostate centring or organ registration
+    :param organ_name: organ whose centroids are compared
+    :param average_distances: used for firing the callback and changing the patient
+    :param heatmap_icp: used for firing the callback and changing the patient
+    :param heatmap_center: used for firing the callback and changing the patient
+    :param heatmap_organ: used for firing the callback and changing the patient
+    :return: fraction pairs figure
+    """
+    pairs = data_store.current()["fraction_pairs"][PATIENTS.index(patient_id), constants.METHODS.index(method),
+                                                   constants.ORGANS.index(organ_name)]
+
+    layout = go.Layout(font=dict(size=17, color='darkgrey'), paper_bgcolor='rgba(50,50,50,1)', height=520,
+                       margin=dict(t=80, b=70, l=90, r=40), plot_bgcolor='rgba(50,50,50,1)', uirevision=patient_id,
+                       title=dict(text="{} distances between the timestamps after {} of patient {}".format(
+                           organ_name, constants.METHOD_TITLES[method], patient_id),
+                           font=dict(size=20, color='lightgrey'), x=0.5))
+    fig = go.Figure(data=go.Heatmap(z=pairs, x=TIMESTAMPS, y=TIMESTAMPS, colorscale=constants.HEATMAP_CS,
+                                    colorbar=dict(title="Distance<br>[mm]"),
+                                    hovertemplate="Timestamps: %{x} and %{y}<br>Distance: %{z:.2f} mm<extra></extra>"),
+                    layout=layout)
+    fig.update_xaxes(title_text="Timestamp", tick0=1, dtick=1, zeroline=False, showgrid=False)
+    fig.update_yaxes(title_text="Timestamp", tick0=1, dtick=1, zeroline=False, showgrid=False, scaleanchor="x")
+
+    return fig
+
+
+@app.callback(
+    Output("trajectory-graph", "figure"),
+    Input("trajectory-method", "value"),
+    Input("organ-distances", "clickData"),
+    Input("average-distances", "clickData"),
+    Input("heatmap-icp", "clickData"),
+    Input("heatmap-center", "clickData"),
+    Input("heatmap-organ", "clickData"),
+    Input("rotations-graph", "clickData"))
+def create_trajectory_graph(method, organ_distances, average_distances, heatmap_icp, heatmap_center, heatmap_organ,
+                            rotations_graph):
+    """
+    Creates the 3D trajectory of the organ centroids during the treatment from the precomputed movement vectors.
+    :param method: ICP or prostate centring
+    :param organ_distances: used for firing the callback and changing the patient or the timestamp
+    :param average_distances: used for firing the callback and changing the patient
+    :param heatmap_icp: used for firing the callback and changing the patient or the timestamp
+    :param heatmap_center: used for firing the callback and changing the patient or the timestamp
+    :param heatmap_organ: used for firing the callback and changing the patient or the timestamp
+    :param rotations_graph: used for firing the callback and changing the timestamp
+    :return: trajectory figure
+    """
+    icp = "ICP" in method
+    movements = data_store.current()["movements_icp" if icp else "movements_center"][PATIENTS.index(patient_id)]
+    names = ["Prostate", "Bladder", "Rectum"] if icp else ["Bones", "Bladder", "Rectum"]
+    colors = [constants.BLUE1 if icp else constants.BLUE2, constants.BLUE3, constants.BLUE4]
+    symbols = ["x", "square", "diamond"] if icp else ["circle", "square", "diamond"]
+
+    camera = dict(up=dict(x=0, y=0, z=1), center=dict(x=0, y=0, z=0), eye=dict(x=1.2, y=-1.6, z=0.6))
+    layout = go.Layout(font=dict(size=15, color='darkgrey'), paper_bgcolor='rgba(50,50,50,1)', height=600,
+                       margin=dict(t=80, b=20, l=20, r=20), uirevision=patient_id + method,
+                       title=dict(text="Organ centroid trajectories after {} of patient {}".format(
+                           "ICP aligning" if icp else "prostate centring", patient_id),
+                           font=dict(size=20, color='lightgrey'), x=0.5),
+                       legend=dict(orientation="h", yanchor="top", y=1.05, xanchor='center', x=0.5))
+    fig = go.Figure(layout=layout)
+
+    fig.add_trace(go.Scatter3d(x=[0], y=[0], z=[0], mode="markers", name="Plan",
+                               marker=dict(color="white", size=5), hoverinfo="name"))
+    for k in range(3):
+        x, y, z = movements[k].T
+        sizes = [5] * len(TIMESTAMPS)
+        sizes[timestamp_i] = 10
+        fig.add_trace(go.Scatter3d(x=x, y=y, z=z, mode="lines+markers", name=names[k], legendgroup=names[k],
+                                   text=TIMESTAMPS, line=dict(color=colors[k], width=3),
+                                   marker=dict(color=colors[k], symbol=symbols[k], size=sizes),
+                                   hovertemplate="<b>" + names[k] + "</b><br>Timestamp: %{text}<br>x: %{x:.2f} mm"
+                                                 "<br>y: %{y:.2f} mm<br>z: %{z:.2f} mm<extra></extra>"))
+
+        # the quiver from every timestamp to the next one, the cone tips sit at the later positions
+        steps = np.diff(movements[k], axis=0)
+        fig.add_trace(go.Cone(x=x[1:], y=y[1:], z=z[1:], u=steps[:, 0], v=steps[:, 1], w=steps[:, 2],
+                              anchor="tip", sizemode="absolute", sizeref=1.5, showscale=False, legendgroup=names[k],
+                              colorscale=[[0, colors[k]], [1, colors[k]]], hoverinfo="skip"))
+
+    fig.update_layout(scene=dict(xaxis_title='x [mm]', yaxis_title='y [mm]', zaxis_title='z [mm]', aspectmode="data",
+                                 camera=camera,
+                                 xaxis=dict(backgroundcolor=constants.GREY2, gridcolor=constants.LIGHT_GREY2),
+                                 yaxis=dict(backgroundcolor=constants.GREY2, gridcolor=constants.LIGHT_GREY2),
+                                 zaxis=dict(backgroundcolor=constants.GREY2, gridcolor=constants.LIGHT_GREY2)))
+
+    return fig
+
+
 @app.callback(
     Output("rotations-graph", "figure"),
     Input("rotations-graph", "clickData"),
     Input("heatmap-icp", "clickData"),
     Input("heatmap-center", "clickData"),
+    Input("heatmap-organ", "clickData"),
     Input("organ-distances", "clickData"),
     Input("alignment-differences", "clickData"),
     Input("average-distances", "clickData"))
-def create_rotation_icp_graph(rotations_graph, heatmap_icp, heatmap_center, organ_distances, differences, avrg):
+def create_rotation_icp_graph(rotations_graph, heatmap_icp, heatmap_center, heatmap_organ, organ_distances, differences,
+                              avrg):
     """
     Creates the rotations graph which shows rotation after ICP RM.
     :param rotations_graph: clickData from this graph
     :param heatmap_icp: clickData from the heatmap_icp graph
     :param heatmap_center: clickData from the heatmap_center graph
+    :param heatmap_organ: clickData from the heatmap_organ graph
     :param organ_distances: clickData from the organ_distances graph
     :param differences: clickData from the differences graph
     :param avrg: clickData from the average graph, we do not use for highlighting
@@ -393,18 +572,32 @@ def create_rotation_icp_graph(rotations_graph, heatmap_icp, heatmap_center, orga
     :return: rotations figure
     """
     colors = [[constants.GREEN] * 13, [constants.YELLOW] * 13, [constants.ORANGE] * 13]
-    all_click_data = [rotations_graph, heatmap_icp, heatmap_center, organ_distances, differences]
-    all_ids = ["rotations-graph", "heatmap-icp", "heatmap-center", "organ-distances", "alignment-differences"]
+    all_click_data = [rotations_graph, heatmap_icp, heatmap_center, heatmap_organ, organ_distances, differences]
+    all_ids = ["rotations-graph", "heatmap-icp", "heatmap-center", "heatmap-organ", "organ-distances",
+               "alignment-differences"]
     click_data, click_id = resolve_click_data(all_click_data, all_ids)
 
+    highlight = None
     if click_data:
         if "rotations" not in click_id:
             colors[0][timestamp_i], colors[1][timestamp_i], colors[2][timestamp_i] = "white", "white", "white"
+            highlight = [timestamp_i]
         else:
             data = click_data["points"][0]
             colors[int(data["curveNumber"])][timestamp_i] = "white"
+            highlight = [timestamp_i, int(data["curveNumber"])]
+
+    return figure_cache.get_or_create("rotations-graph", [patient_id, highlight],
+                                      lambda: make_rotations_figure(colors))
 
-    rot_x, rot_y, rot_z = rotations[PATIENTS.index(patient_id)][0]
+
+def make_rotations_figure(colors):
+    """
+    Helper function for plotting of the rotations graph
+    :param colors: colors of the bars of the three axes
+    :return: rotations figure
+    """
+    rot_x, rot_y, rot_z = data_store.current()["rotations"][PATIENTS.index(patient_id)]
 
     layout = go.Layout(font=dict(size=12, color='darkgrey'), paper_bgcolor='rgba(50,50,50,1)',
                        margin=dict(t=80, b=70, l=90, r=40), plot_bgcolor='rgba(70,70,70,1)', height=350,
@@ -430,8 +623,8 @@ def decide_average_highlights(data, click_id, icp):
     :param icp: whether we highlight in the icp or prostate aligning version of the average graphs
     :return: colors and sizes of the traces in the average graph
     """
-    colors = [[constants.BLUE1] * 8, [constants.BLUE3] * 8, [constants.BLUE4] * 8]
-    sizes = [[0] * 8, [0] * 8, [0] * 8]
+    colors = [[constants.BLUE1] * len(PATIENTS), [constants.BLUE3] * len(PATIENTS), [constants.BLUE4] * len(PATIENTS)]
+    sizes = [[0] * len(PATIENTS), [0] * len(PATIENTS), [0] * len(PATIENTS)]
     pat = PATIENTS.index(patient_id)
     data = data["points"][0]
 
@@ -448,8 +641,9 @@ def decide_average_highlights(data, click_id, icp):
 
     elif "average" in click_id:
         trace = data["curveNumber"] if data["curveNumber"] < 3 else int((data["curveNumber"]) - 1) % 3
-        if data["curveNumber"] != 0 and data["curveNumber"] != 4 or \
-                (data["curveNumber"] == 0 and icp) or (data["curveNumber"] == 4 and not icp):
+        # the first trace is the prostate in the ICP and organ registration plots, but the bones in the centring plot
+        if data["curveNumber"] not in (0, 4, 7) or \
+                (data["curveNumber"] in (0, 7) and icp) or (data["curveNumber"] == 4 and not icp):
             colors[trace][pat] = "white"
             sizes[trace][pat] = 3
 
@@ -483,10 +677,11 @@ def decide_average_highlights(data, click_id, icp):
     Input("average-distances", "clickData"),
     Input("heatmap-icp", "clickData"),
     Input("heatmap-center", "clickData"),
+    Input("heatmap-organ", "clickData"),
     Input("rotations-graph", "clickData"),
     Input("scale-average", "value"))
-def create_average_distances(differences, organ_distances, click_data, heatmap_icp, heatmap_center, rotations_graph,
-                             scale):
+def create_average_distances(differences, organ_distances, click_data, heatmap_icp, heatmap_center, heatmap_organ,
+                             rotations_graph, scale):
     """
     Creates the average_distances graph which shows the average movements of patient's organs after RMs aligning.
     :param differences: clickData from the differences graph
@@ -494,24 +689,38 @@ def create_average_distances(differences, organ_distances, click_data, heatmap_i
     :param click_data: clickData from this graph
     :param heatmap_icp: clickData from the heatmap_icp graph
     :param heatmap_center: clickData from the heatmap_center graph
+    :param heatmap_organ: clickData from the heatmap_organ graph
     :param rotations_graph: clickData from the rotations graph
     :param scale: sets the axis range, can be uniform or individual
     :return: the average_distances figure
     """
-    all_click_data = [differences, organ_distances, click_data, heatmap_icp, heatmap_center, rotations_graph]
+    all_click_data = [differences, organ_distances, click_data, heatmap_icp, heatmap_center, heatmap_organ,
+                      rotations_graph]
     all_ids = ["alignment-differences", "organ-distances", "average-distances", "heatmap-icp", "heatmap-center",
-               "rotations-graph"]
+               "heatmap-organ", "rotations-graph"]
     click_data, click_id = resolve_click_data(all_click_data, all_ids)
     colors_icp, colors_center = [[constants.BLUE1] * 13, [constants.BLUE3] * 13, [constants.BLUE4] * 13], \
                                 [[constants.BLUE2] * 13, [constants.BLUE3] * 13, [constants.BLUE4] * 13]
     sizes_icp = sizes_center = [[0] * 13, [0] * 13, [0] * 13]
 
+    highlight = None
     if click_data:
         colors_icp, sizes_icp = decide_average_highlights(click_data, click_id, True)
         colors_center, sizes_center = decide_average_highlights(click_data, click_id, False)
+        highlight = [colors_icp, sizes_icp, colors_center, sizes_center]
 
-    fig = make_averages_figure(colors_icp, sizes_icp, colors_center, sizes_center)
+    # the organ registration has the same organs as ICP, so its traces are highlighted alike
+    return figure_cache.get_or_create("average-distances", [scale, highlight], lambda: finish_averages_figure(
+        make_averages_figure(colors_icp, sizes_icp, colors_center, sizes_center), scale))
 
+
+def finish_averages_figure(fig, scale):
+    """
+    Sets the axes and the layout of the average graph.
+    :param fig: averages figure
+    :param scale: sets the axis range, can be uniform or individual
+    :return: the average_distances figure
+    """
     fig.update_xaxes(title_text="Patient", zerolinewidth=1.2, gridcolor=constants.GREY, gridwidth=2)
     fig.update_yaxes(title_text="Average distance [mm]", zerolinewidth=1.2, gridcolor=constants.GREY, gridwidth=1.2)
 
@@ -519,8 +728,9 @@ def create_average_distances(differences, organ_distances, click_data, heatmap_i
         fig.update_xaxes(matches="x")
         fig.update_yaxes(matches="y")
 
-    fig.update_layout(yaxis2_showticklabels=True, xaxis2_showticklabels=True, font=dict(size=17, color='darkgrey'),
-                      paper_bgcolor='rgba(50,50,50,1)', margin=dict(t=80, b=70, l=90, r=81),
+    fig.update_layout(yaxis2_showticklabels=True, xaxis2_showticklabels=True, yaxis3_showticklabels=True,
+                      xaxis3_showticklabels=True, font=dict(size=17, color='darkgrey'),
+                      paper_bgcolor='rgba(50,50,50,1)', margin=dict(t=100, b=70, l=90, r=81),
                       legend=dict(orientation="h", entrywidth=130, yanchor="top", y=1.15, xanchor='center', x=0.53),
                       plot_bgcolor='rgba(70,70,70,1)', height=380, uirevision="foo")
     fig.update_annotations(yshift=35, font=dict(size=19, color='lightgrey'))
@@ -528,18 +738,25 @@ def create_average_distances(differences, organ_distances, click_data, heatmap_i
     return fig
 
 
-def make_averages_figure(colors_icp, sizes_icp, colors_center, sizes_center):
+def make_averages_figure(colors_icp, sizes_icp, colors_center, sizes_center, colors_organ=None, sizes_organ=None):
     """
     Helper function for plotting of the average graph
     :param colors_icp: colors for the icp traces
     :param sizes_icp: sizes of the icp traces
     :param colors_center: colors for the prostate centring traces
     :param sizes_center: sizes of the prostate centring traces
+    :param colors_organ: colors for the organ registration traces, the icp ones by default
+    :param sizes_organ: sizes of the organ registration traces, the icp ones by default
     :return: averages figure
     """
-    fig = make_subplots(rows=1, cols=2, horizontal_spacing=0.1,
-                        subplot_titles=("Average difference of patients' organs positions after ICP aligning",
-                                        "Average difference of patients' organs positions after prostate centring"))
+    colors_organ, sizes_organ = colors_organ or colors_icp, sizes_organ or sizes_icp
+    dataset = data_store.current()
+    avrg_prostate_icp, avrg_bladder_icp, avrg_rectum_icp = dataset["averages_icp"].T
+    avrg_bones_center, avrg_bladder_center, avrg_rectum_center = dataset["averages_center"].T
+    avrg_prostate_organ, avrg_bladder_organ, avrg_rectum_organ = dataset["averages_organ"].T
+    fig = make_subplots(rows=1, cols=len(constants.METHODS), horizontal_spacing=0.07, subplot_titles=[
+        "Average difference of patients' organs<br>positions after {}".format(constants.METHOD_TITLES[method])
+        for method in constants.METHODS])
 
     fig.add_trace(go.Scattergl(x=PATIENTS, y=avrg_prostate_icp, mode="markers", name="Prostate",
                                marker=dict(symbol="x", color=constants.BLUE1, size=13,
@@ -564,6 +781,88 @@ def make_averages_figure(colors_icp, sizes_icp, colors_center, sizes_center):
                                marker=dict(symbol="diamond", color=constants.BLUE4, size=12,
                                            line=dict(width=sizes_center[2], color=colors_center[2]))), row=1, col=2)
 
+    fig.add_trace(go.Scattergl(x=PATIENTS, y=avrg_prostate_organ, mode="markers", name="Prostate", showlegend=False,
+                               marker=dict(symbol="x", color=constants.BLUE1, size=13,
+                                           line=dict(width=sizes_organ[0], color=colors_organ[0]))), row=1, col=3)
+    fig.add_trace(go.Scattergl(x=PATIENTS, y=avrg_bladder_organ, mode="markers", name="Bladder", showlegend=False,
+                               marker=dict(symbol="square", color=constants.BLUE3, size=12,
+                                           line=dict(width=sizes_organ[1], color=colors_organ[1]))), row=1, col=3)
+    fig.add_trace(go.Scattergl(x=PATIENTS, y=avrg_rectum_organ, mode="markers", name="Rectum", showlegend=False,
+                               marker=dict(symbol="diamond", color=constants.BLUE4, size=12,
+                                           line=dict(width=sizes_organ[2], color=colors_organ[2]))), row=1, col=3)
+
+    return fig
+
+
+@app.callback(
+    Output("cohort-statistics", "figure"),
+    Input("statistics-organ", "value"))
+def create_cohort_statistics(organ_name):
+    """
+    Creates the cohort statistics graph: the median and the interquartile range of the organ distances of all
+    patients after every RM, and the paired differences of ICP and the prostate centring with the bootstrap confidence
+    interval of their mean.
+    :param organ_name: organ whose distances are shown
+    :return: cohort statistics figure
+    """
+    return figure_cache.get_or_create("cohort-statistics", [organ_name],
+                                      lambda: make_cohort_statistics_figure(organ_name))
+
+
+def make_cohort_statistics_figure(organ_name):
+    """
+    Helper function for plotting of the cohort statistics graph
+    :param organ_name: organ whose distances are shown
+    :return: cohort statistics figure
+    """
+    statistics = cohort_statistics.current()
+    k = constants.ORGANS.index(organ_name)
+    lower, upper = constants.STATISTICS_PERCENTILES.index(25), constants.STATISTICS_PERCENTILES.index(75)
+    confidence = int(constants.CONFIDENCE * 100)
+    colors = [constants.BLUE1, constants.BLUE2, constants.BLUE3]
+
+    fig = make_subplots(rows=1, cols=2, horizontal_spacing=0.1, subplot_titles=(
+        "Median and interquartile range of the {} distances".format(organ_name.lower()),
+        "ICP minus prostate centring: mean with its {}% confidence interval".format(confidence)))
+
+    for m, method in enumerate(constants.METHODS):
+        fig.add_trace(go.Scatter(x=TIMESTAMPS, y=statistics["percentiles"][upper, m, k], mode="lines",
+                                 line=dict(width=0), legendgroup=method, showlegend=False, hoverinfo="skip"),
+                      row=1, col=1)
+        fig.add_trace(go.Scatter(x=TIMESTAMPS, y=statistics["percentiles"][lower, m, k], mode="lines",
+                                 line=dict(width=0), fill="tonexty", fillcolor=colors[m] + "40", legendgroup=method,
+                                 showlegend=False, hoverinfo="skip"), row=1, col=1)
+        fig.add_trace(go.Scatter(x=TIMESTAMPS, y=statistics["median"][m, k], mode="lines+markers", name=method,
+                                 legendgroup=method, line=dict(color=colors[m], width=3),
+                                 hovertemplate=method + "<br>Timestamp: %{x}<br>Median: %{y:.2f} mm<extra></extra>"),
+                      row=1, col=1)
+
+    low, high = statistics["difference_interval"][:, k]
+    fig.add_trace(go.Scatter(x=TIMESTAMPS, y=high, mode="lines", line=dict(width=0), showlegend=False,
+                             hoverinfo="skip"), row=1, col=2)
+    fig.add_trace(go.Scatter(x=TIMESTAMPS, y=low, mode="lines", line=dict(width=0), fill="tonexty",
+                             fillcolor=constants.BLUE4 + "40", name="{}% confidence interval".format(confidence),
+                             hoverinfo="skip"), row=1, col=2)
+    fig.add_trace(go.Scatter(x=TIMESTAMPS, y=statistics["difference_mean"][k], mode="lines+markers",
+                             name="Mean difference", line=dict(color=constants.BLUE4, width=3),
+                             customdata=np.column_stack([low, high, statistics["patients"][k]]),
+                             hovertemplate="Timestamp: %{x}<br>Mean difference: %{y:.2f} mm<br>Interval: "
+                                           "%{customdata[0]:.2f} to %{customdata[1]:.2f} mm<br>Patients: "
+                                           "%{customdata[2]}<extra></extra>"), row=1, col=2)
+    fig.add_trace(go.Scatter(x=TIMESTAMPS, y=statistics["difference_median"][k], mode="markers",
+                             name="Median difference", marker=dict(color="white", symbol="x", size=9),
+                             hovertemplate="Timestamp: %{x}<br>Median difference: %{y:.2f} mm<extra></extra>"),
+                  row=1, col=2)
+    fig.add_hline(y=0, line_width=2, line_color=constants.GREY, row=1, col=2)
+
+    fig.update_xaxes(title_text="Timestamp", tick0=1, dtick=1, zerolinewidth=1.2, gridcolor=constants.GREY,
+                     gridwidth=2)
+    fig.update_yaxes(title_text="Distance [mm]", zerolinewidth=1.2, gridcolor=constants.GREY, gridwidth=1.2)
+    fig.update_layout(font=dict(size=17, color='darkgrey'), paper_bgcolor='rgba(50,50,50,1)',
+                      plot_bgcolor='rgba(70,70,70,1)', height=400, margin=dict(t=100, b=70, l=90, r=81),
+                      legend=dict(orientation="h", yanchor="top", y=1.2, xanchor='center', x=0.5))
+    fig.update_annotations(yshift=35, font=dict(size=18, color='lightgrey'))
+
     return fig
 
 
@@ -586,15 +885,18 @@ def create_lines_for_heatmaps(fig):
     Creates lines dividing timestamps and patients in the heatmaps
     :param fig: one of the heatmaps figure
     """
-    fig.add_shape(type="rect", x0=-0.48, y0=-0.5, x1=-0.48, y1=7.5, line_width=4.15, line_color=constants.GREY)
-    fig.add_shape(type="rect", x0=13 * 4 - 0.5, y0=-0.5, x1=13 * 4 - 0.5, y1=7.5, line_width=4.15,
+    rows = len(PATIENTS)
+    fig.add_shape(type="rect", x0=-0.48, y0=-0.5, x1=-0.48, y1=rows - 0.5, line_width=4.15, line_color=constants.GREY)
+    fig.add_shape(type="rect", x0=13 * 4 - 0.5, y0=-0.5, x1=13 * 4 - 0.5, y1=rows - 0.5, line_width=4.15,
                   line_color=constants.GREY)
 
     for i in range(1, 13):
-        fig.add_shape(type="rect", x0=4 * i - 0.5, y0=-0.5, x1=4 * i - 0.5, y1=7.5, line_width=4,
+        fig.add_shape(type="rect", x0=4 * i - 0.5, y0=-0.5, x1=4 * i - 0.5, y1=rows - 0.5, line_width=4,
                       line_color=constants.GREY)
-    for i in range(0, 9):
-        fig.add_hline(y=i - 0.5, line_width=4, line_color=constants.GREY)
+    # the rows of a large cohort are too thin to be divided
+    if rows <= constants.LARGE_COHORT:
+        for i in range(0, rows + 1):
+            fig.add_hline(y=i - 0.5, line_width=4, line_color=constants.GREY)
 
 
 @app.callback(
@@ -603,22 +905,26 @@ def create_lines_for_heatmaps(fig):
     Input("alignment-differences", "clickData"),
     Input("heatmap-icp", "clickData"),
     Input("heatmap-center", "clickData"),
+    Input("heatmap-organ", "clickData"),
     Input("average-distances", "clickData"),
     Input("rotations-graph", "clickData"),
     Input("scale-heatmap", "value"),
-    Input("heatmap-icp", "relayoutData"))
-def create_heatmap_icp(organ_distances, differences, click_data, center_click_data, average_distances, rotations_graph,
-                       scale, zoom):
+    Input("heatmap-icp", "relayoutData"),
+    Input("metric-heatmap", "value"))
+def create_heatmap_icp(organ_distances, differences, click_data, center_click_data, organ_click_data, average_distances,
+                       rotations_graph, scale, zoom, metric):
     """
     Creates the heatmap_icp graph which depicts every patient and their every organ movement after icp aligning.
     :param organ_distances: clickData from the organ_distances graph
     :param differences: clickData from the differences graph
     :param click_data: clickData from this graph
     :param center_click_data: clickData from the heatmap_center graph
+    :param organ_click_data: clickData from the heatmap_organ graph
     :param average_distances: clickData from the average_distances graph
     :param rotations_graph: clickData from the rotations graph
     :param scale: sets the axis range, can be uniform or individual
     :param zoom: indicates if the graph was zoomed to hide or show the organ legend
+    :param metric: centroid distance, one of the surface-distance metrics or the mean deformation
     :return: heatmap_icp figure
     """
     global patient_id
@@ -629,17 +935,18 @@ def create_heatmap_icp(organ_distances, differences, click_data, center_click_da
                                                         "aligning to the bones", font=dict(size=20, color='lightgrey')),
                        uirevision=scale)
 
-    fig = create_heatmap_fig(scale, layout, True)
+    fig = create_heatmap_fig(scale, layout, "ICP", metric, zoom)
     create_lines_for_heatmaps(fig)
 
-    all_click_data = [organ_distances, differences, average_distances, click_data, center_click_data, rotations_graph]
+    all_click_data = [organ_distances, differences, average_distances, click_data, center_click_data, organ_click_data,
+                      rotations_graph]
     all_ids = ["organ-distances", "alignment-differences", "average-distances", "heatmap-icp", "heatmap-center",
-               "rotations-graph"]
+               "heatmap-organ", "rotations-graph"]
     click_data, click_id = resolve_click_data(all_click_data, all_ids)
 
     if click_data:
         data = click_data["points"][0]
-        decide_heatmap_highlights(fig, data, click_id)
+        decide_heatmap_highlights(fig, data, click_id, zoom)
 
     # decide whether add organ legend according to zoom
     if not zoom or len(zoom) <= 1 or "xaxis.autorange" in zoom.keys():
@@ -647,7 +954,8 @@ def create_heatmap_icp(organ_distances, differences, click_data, center_click_da
 
     fig.update_xaxes(title_text="Timestamp", ticktext=TIMESTAMPS, tickmode="array", tickvals=np.arange(1.5, 52, 4),
                      zeroline=False, showgrid=False, range=[-0.55, 51.55], title_font={"size": 20}, tickfont_size=18)
-    fig.update_yaxes(title_text="Patient", ticktext=PATIENTS + ["info"], tickmode="array", tickvals=np.arange(0, 8, 1),
+    ticktext, tickvals = heatmap_row_labels(zoom)
+    fig.update_yaxes(title_text="Patient", ticktext=ticktext, tickmode="array", tickvals=tickvals,
                      zeroline=False, showgrid=False, title_font={"size": 20}, tickfont_size=18)
     fig.update_layout(title_x=0.5, title_y=0.90, legend={"x": 0.73, "y": 1.14, "orientation": "h", "xanchor": "left"})
 
@@ -658,25 +966,29 @@ def create_heatmap_icp(organ_distances, differences, click_data, center_click_da
     Output("heatmap-center", "figure"),
     Input("heatmap-center", "clickData"),
     Input("heatmap-icp", "clickData"),
+    Input("heatmap-organ", "clickData"),
     Input("alignment-differences", "clickData"),
     Input("average-distances", "clickData"),
     Input("organ-distances", "clickData"),
     Input("rotations-graph", "clickData"),
     Input("scale-heatmap", "value"),
-    Input("heatmap-center", "relayoutData"))
-def create_heatmap_centering(click_data, icp_click_data, differences, average_distances, organ_distances,
-                             rotations_graph, scale, zoom):
+    Input("heatmap-center", "relayoutData"),
+    Input("metric-heatmap", "value"))
+def create_heatmap_centering(click_data, icp_click_data, organ_click_data, differences, average_distances,
+                             organ_distances, rotations_graph, scale, zoom, metric):
     """
     Creates the heatmap_center graph which depicts every patient and their every organ movement after centering on
     the prostate.
     :param click_data: clickData from this graph
     :param icp_click_data: clickData from the heatmap_icp graph
+    :param organ_click_data: clickData from the heatmap_organ graph
     :param differences: clickData from the differences graph
     :param average_distances: clickData from the average_distances graph
     :param organ_distances: clickData from the organ_distances graph
     :param rotations_graph: clickData from the rotations graph
     :param scale: sets the axis range, can be uniform or individual
     :param zoom: indicates if the graph was zoomed to hide or show the organ legend
+    :param metric: centroid distance, one of the surface-distance metrics or the mean deformation
     :return: heatmap_center figure
     """
     global patient_id
@@ -687,17 +999,18 @@ def create_heatmap_centering(click_data, icp_click_data, differences, average_di
                                                         "centring", font=dict(size=20, color='lightgrey')),
                        uirevision=scale)
 
-    fig = create_heatmap_fig(scale, layout, False)
+    fig = create_heatmap_fig(scale, layout, "Prostate Centring", metric, zoom)
     create_lines_for_heatmaps(fig)
 
-    all_click_data = [organ_distances, differences, average_distances, icp_click_data, click_data, rotations_graph]
+    all_click_data = [organ_distances, differences, average_distances, icp_click_data, click_data, organ_click_data,
+                      rotations_graph]
     all_ids = ["organ-distances", "alignment-differences", "average-distances", "heatmap-icp", "heatmap-center",
-               "rotations-graph"]
+               "heatmap-organ", "rotations-graph"]
     click_data, click_id = resolve_click_data(all_click_data, all_ids)
 
     if click_data:
         data = click_data["points"][0]
-        decide_heatmap_highlights(fig, data, click_id)
+        decide_heatmap_highlights(fig, data, click_id, zoom)
 
     # same as in heatmap_icp
     if not zoom or len(zoom) <= 1 or "xaxis.autorange" in zoom.keys():
@@ -705,39 +1018,233 @@ def create_heatmap_centering(click_data, icp_click_data, differences, average_di
 
     fig.update_xaxes(title_text="Timestamp", ticktext=TIMESTAMPS, tickmode="array", tickvals=np.arange(1.5, 52, 4),
                      zeroline=False, showgrid=False, range=[-0.55, 51.55], title_font={"size": 20}, tickfont_size=18)
-    fig.update_yaxes(title_text="Patient", ticktext=PATIENTS, tickmode="array", tickvals=np.arange(0, 8, 1),
+    ticktext, tickvals = heatmap_row_labels(zoom)
+    fig.update_yaxes(title_text="Patient", ticktext=ticktext, tickmode="array", tickvals=tickvals,
                      zeroline=False, showgrid=False, title_font={"size": 20}, tickfont_size=18)
     fig.update_layout(title_x=0.5, font=dict(size=16), title_y=0.90, legend={"x": 0.73, "y": 1.14, "orientation": "h",
                                                                              "xanchor": "left"})
     return fig
 
 
-def create_heatmap_fig(scale, layout, icp):
+@app.callback(
+    Output("heatmap-organ", "figure"),
+    Input("heatmap-organ", "clickData"),
+    Input("heatmap-icp", "clickData"),
+    Input("heatmap-center", "clickData"),
+    Input("alignment-differences", "clickData"),
+    Input("average-distances", "clickData"),
+    Input("organ-distances", "clickData"),
+    Input("rotations-graph", "clickData"),
+    Input("scale-heatmap", "value"),
+    Input("heatmap-organ", "relayoutData"),
+    Input("metric-heatmap", "value"))
+def create_heatmap_organ(click_data, icp_click_data, center_click_data, differences, average_distances,
+                         organ_distances, rotations_graph, scale, zoom, metric):
+    """
+    Creates the heatmap_organ graph which depicts every patient and their every organ movement after registering each
+    organ to its plan organ.
+    :param click_data: clickData from this graph
+    :param icp_click_data: clickData from the heatmap_icp graph
+    :param center_click_data: clickData from the heatmap_center graph
+    :param differences: clickData from the differences graph
+    :param average_distances: clickData from the average_distances graph
+    :param organ_distances: clickData from the organ_distances graph
+    :param rotations_graph: clickData from the rotations graph
+    :param scale: sets the axis range, can be uniform or individual
+    :param zoom: indicates if the graph was zoomed to hide or show the organ legend
+    :param metric: centroid distance, one of the surface-distance metrics or the mean deformation
+    :return: heatmap_organ figure
+    """
+    layout = go.Layout(font=dict(size=15, color='darkgrey'), paper_bgcolor='rgba(50,50,50,1)',
+                       margin=dict(t=100, b=70, l=90, r=81), plot_bgcolor='rgba(50,50,50,1)', height=340,
+                       showlegend=True, title=dict(text="Difference of patients' organs positions after registering "
+                                                        "each organ", font=dict(size=20, color='lightgrey')),
+                       uirevision=scale)
+
+    fig = create_heatmap_fig(scale, layout, "Organ Registration", metric, zoom)
+    create_lines_for_heatmaps(fig)
+
+    all_click_data = [organ_distances, differences, average_distances, icp_click_data, center_click_data, click_data,
+                      rotations_graph]
+    all_ids = ["organ-distances", "alignment-differences", "average-distances", "heatmap-icp", "heatmap-center",
+               "heatmap-organ", "rotations-graph"]
+    click_data, click_id = resolve_click_data(all_click_data, all_ids)
+
+    if click_data:
+        data = click_data["points"][0]
+        decide_heatmap_highlights(fig, data, click_id, zoom)
+
+    # same as in heatmap_icp
+    if not zoom or len(zoom) <= 1 or "xaxis.autorange" in zoom.keys():
+        add_heatmap_annotations(fig)
+
+    fig.update_xaxes(title_text="Timestamp", ticktext=TIMESTAMPS, tickmode="array", tickvals=np.arange(1.5, 52, 4),
+                     zeroline=False, showgrid=False, range=[-0.55, 51.55], title_font={"size": 20}, tickfont_size=18)
+    ticktext, tickvals = heatmap_row_labels(zoom)
+    fig.update_yaxes(title_text="Patient", ticktext=ticktext, tickmode="array", tickvals=tickvals,
+                     zeroline=False, showgrid=False, title_font={"size": 20}, tickfont_size=18)
+    fig.update_layout(title_x=0.5, font=dict(size=16), title_y=0.90, legend={"x": 0.73, "y": 1.14, "orientation": "h",
+                                                                             "xanchor": "left"})
+    return fig
+
+
+def create_heatmap_fig(scale, layout, method, metric="Centroid distance", zoom=None):
     """
     Helper function to create heatmaps' figures.
     :param scale: selected scale
     :param layout: figure layout
-    :param icp: whether the graphs is icp or not
+    :param method: RM of the heatmap
+    :param metric: centroid distance, one of the surface-distance metrics or the mean deformation
+    :param zoom: relayoutData of the heatmap, it selects the rows of a large cohort
     :return:
     """
-    data, custom_data, hover_text = create_data_for_heatmap(icp)
+    if len(PATIENTS) > constants.LARGE_COHORT:
+        return create_large_heatmap_fig(scale, layout, method, metric, zoom)
 
-    # changing the colour scale with zmin, zmax
+    data, custom_data, hover_text = create_data_for_heatmap(method, metric)
+    hover_template = "<b>%{text}</b><br>Patient: %{y}<br>Timestamp: %{customdata}<br>" + metric + \
+                     ": %{z:.2f} mm<extra></extra>"
+
+    # changing the colour scale with zmin, zmax, the surface metrics and deformations share the maximum of all RMs
     if "uniform" in scale:
-        fig = go.Figure(data=go.Heatmap(z=data, zmin=0, zmax=85, text=hover_text, customdata=custom_data,
-                                        colorbar=dict(title="Distance<br>[mm]"),
-                                        hovertemplate="<b>%{text}</b><br>Patient: %{y}<br>Timestamp: %{customdata}<br>"
-                                                      "Distance: %{z:.2f} mm<extra></extra>",
-                                        colorscale=constants.HEATMAP_CS), layout=layout)
+        fig = go.Figure(data=go.Heatmap(z=data, zmin=0, zmax=heatmap_zmax(metric), text=hover_text,
+                                        customdata=custom_data, colorbar=dict(title="Distance<br>[mm]"),
+                                        hovertemplate=hover_template, colorscale=constants.HEATMAP_CS), layout=layout)
     else:
         fig = go.Figure(data=go.Heatmap(z=data, text=hover_text, customdata=custom_data,
-                                        colorbar=dict(title="Distance<br>[mm]"),
-                                        hovertemplate="<b>%{text}</b><br>Patient: %{y}<br>Timestamp: "
-                                                      "%{customdata}<br>" "Distance: %{z:.2f} mm<extra></extra>",
+                                        colorbar=dict(title="Distance<br>[mm]"), hovertemplate=hover_template,
                                         colorscale=constants.HEATMAP_CS), layout=layout)
     return fig
 
 
+def heatmap_zmax(metric):
+    """Maximum of the uniform colour scale, the surface metrics and deformations share the maximum of all RMs."""
+    if metric == "Centroid distance":
+        return 85
+    if metric == constants.DEFORMATION_METRIC:
+        return np.nanmax(data_store.current()["deformations"], initial=0)
+    return np.nanmax(data_store.current()["surface_metrics"][:, :, constants.SURFACE_METRICS.index(metric)], initial=0)
+
+
+def heatmap_window(zoom):
+    """
+    Rows of the heatmap inside the zoomed y range, all rows if the graph is not zoomed.
+    :param zoom: relayoutData of the heatmap
+    :return: index of the first and one after the last visible row
+    """
+    rows = len(PATIENTS)
+    if not zoom or zoom.get("yaxis.autorange"):
+        return 0, rows
+
+    if "yaxis.range" in zoom:
+        low, high = zoom["yaxis.range"]
+    elif "yaxis.range[0]" in zoom:
+        low, high = zoom["yaxis.range[0]"], zoom["yaxis.range[1]"]
+    else:
+        return 0, rows
+
+    low, high = sorted([low, high])
+    return min(max(int(np.ceil(low - 0.5)), 0), rows - 1), min(max(int(np.floor(high + 0.5)), 1), rows)
+
+
+def heatmap_bins(zoom):
+    """
+    Rows aggregated into every row of the heatmap of a large cohort, one row per bin unless the zoom window holds more
+    than HEATMAP_MAX_ROWS of them.
+    :param zoom: relayoutData of the heatmap
+    :return: arrays of the first and one after the last row of every bin
+    """
+    first, last = heatmap_window(zoom)
+    bins = min(last - first, constants.HEATMAP_MAX_ROWS)
+    starts = first + (np.arange(bins) * (last - first)) // bins
+
+    return starts, np.append(starts[1:], last)
+
+
+def heatmap_row_extent(row, zoom):
+    """
+    Vertical extent of the highlight of the patient row. A binned row of a large cohort is highlighted as its whole
+    bin, which is where the row is drawn.
+    :param row: index of the patient in PATIENTS
+    :param zoom: relayoutData of the heatmap
+    :return: lower and upper y coordinate of the highlight
+    """
+    if len(PATIENTS) > constants.LARGE_COHORT:
+        starts, ends = heatmap_bins(zoom)
+        b = int(np.searchsorted(starts, row, side="right")) - 1
+        # the rows outside the zoom window are not drawn, their highlight stays outside the visible range
+        if starts[0] <= row < ends[-1] and ends[b] - starts[b] > 1:
+            return float(starts[b]) - 0.41, float(ends[b]) - 1 + 0.41
+
+    return row - 0.41, row + 0.41
+
+
+def create_large_heatmap_fig(scale, layout, method, metric, zoom):
+    """
+    Heatmap of a large cohort. Only the rows of the zoom window are sent. If there are more of them than
+    HEATMAP_MAX_ROWS, neighbouring rows are aggregated into bins by their maximum, so the figure size does not grow
+    with the cohort and no movement is hidden. The hover texts are sent only for the rows shown one by one.
+    :param scale: selected scale
+    :param layout: figure layout
+    :param method: RM of the heatmap
+    :param metric: centroid distance, one of the surface-distance metrics or the mean deformation
+    :param zoom: relayoutData of the heatmap
+    :return: heatmap figure whose y coordinates are the row indices of the patients
+    """
+    matrix = heatmap_matrix(method, metric)
+    first, last = heatmap_window(zoom)
+    starts, ends = heatmap_bins(zoom)
+    bins = len(starts)
+
+    if bins == last - first:
+        columns = len(TIMESTAMPS) * 4
+        custom_data = np.tile(np.repeat(TIMESTAMPS, 4), (bins, 1))
+        hover_text = np.tile(constants.ORGANS, (bins, columns // 4))
+        heatmap = dict(z=matrix[first:last], y=np.arange(first, last), text=hover_text, customdata=custom_data,
+                       hovertemplate="<b>%{text}</b><br>Patient: %{y}<br>Timestamp: %{customdata}<br>" + metric +
+                                     ": %{z:.2f} mm<extra></extra>")
+    else:
+        # the maximum of every bin, np.fmax ignores the cells which were not computed
+        window = matrix[first:last]
+        aggregated = np.fmax.reduceat(window, starts - first, axis=0)
+        # a click on a bin selects the patient of its maximum, or the first patient if none of its cells was computed
+        bin_of_row = np.repeat(np.arange(bins), ends - starts)
+        rows = np.where(window == aggregated[bin_of_row], np.arange(first, last)[:, np.newaxis], last)
+        patients = np.minimum.reduceat(rows, starts - first, axis=0)
+        patients = np.where(patients == last, starts[:, np.newaxis], patients)
+
+        columns = len(TIMESTAMPS) * 4
+        custom_data = np.stack([np.tile(np.repeat(TIMESTAMPS, 4), (bins, 1)), patients,
+                                np.tile(starts[:, np.newaxis], (1, columns)),
+                                np.tile(ends[:, np.newaxis] - 1, (1, columns))], axis=-1)
+        heatmap = dict(z=aggregated, y=(starts + ends - 1) / 2, text=np.tile(constants.ORGANS, (bins, columns // 4)),
+                       customdata=custom_data,
+                       hovertemplate="<b>%{text}</b><br>Patients %{customdata[2]} to %{customdata[3]}<br>Timestamp: "
+                                     "%{customdata[0]}<br>Maximum " + metric + ": %{z:.2f} mm of patient "
+                                     "%{customdata[1]}<extra></extra>")
+
+    if "uniform" in scale:
+        heatmap.update(zmin=0, zmax=heatmap_zmax(metric))
+
+    return go.Figure(data=go.Heatmap(colorbar=dict(title="Distance<br>[mm]"), colorscale=constants.HEATMAP_CS,
+                                     **heatmap), layout=layout)
+
+
+def heatmap_row_labels(zoom):
+    """
+    Tick labels of the patient rows. The rows of a large cohort are labelled only inside the zoom window and at most
+    HEATMAP_MAX_LABELS of them, evenly spaced.
+    :param zoom: relayoutData of the heatmap
+    :return: tick texts and tick values
+    """
+    if len(PATIENTS) <= constants.LARGE_COHORT:
+        return PATIENTS, np.arange(0, len(PATIENTS), 1)
+
+    first, last = heatmap_window(zoom)
+    rows = np.unique(np.linspace(first, last - 1, min(last - first, constants.HEATMAP_MAX_LABELS)).astype(int))
+    return [PATIENTS[row] for row in rows], rows
+
+
 def add_heatmap_annotations(fig):
     """Adds organ legend as image, so it is not clickable"""
     fig.add_layout_image(dict(source=app.get_asset_url("annot_heatmap1.png"),
@@ -749,76 +1256,104 @@ def add_heatmap_annotations(fig):
                               xanchor="right", yanchor="bottom"))
 
 
-def decide_heatmap_highlights(fig, data, click_id):
+def decide_heatmap_highlights(fig, data, click_id, zoom=None):
     """
     Computes what to highlight in the heatmaps according to clickData from other graphs.
     :param fig: heatmap figure
     :param data: clickData from the clicked graph
     :param click_id: id of the clicked graph
+    :param zoom: relayoutData of the heatmap, the rows of a large cohort may be aggregated in its window
     """
     if "heatmap" in click_id:
-        fig.add_shape(type="rect", x0=data["x"] - 0.43, y0=data["y"] - 0.41, x1=data["x"] + 0.43,
-                      y1=data["y"] + 0.41, line_color="white", line_width=4)
+        y0, y1 = heatmap_row_extent(heatmap_row(data), zoom)
+        fig.add_shape(type="rect", x0=data["x"] - 0.43, y0=y0, x1=data["x"] + 0.43, y1=y1, line_color="white",
+                      line_width=4)
     else:
-        y = PATIENTS.index(patient_id)
+        y0, y1 = heatmap_row_extent(PATIENTS.index(patient_id), zoom)
+        # column of the organ within a timestamp, the curves of every RM follow the order of ORGANS except that the
+        # first curve of the centring shows the bones, which are the first column
+        curves = len(constants.METHODS) * 3 + 1
         trace = 0
-        if data["curveNumber"] == 0:
-            trace = 1
-        elif data["curveNumber"] == 1 or data["curveNumber"] == 5:
-            trace = 2
-        elif data["curveNumber"] == 2 or data["curveNumber"] == 6:
-            trace = 3
+        if data["curveNumber"] < curves and data["curveNumber"] != 3:
+            method, position = divmod(data["curveNumber"] - (data["curveNumber"] > 3), 3)
+            trace = 0 if method == constants.METHODS.index("Prostate Centring") and position == 0 else position + 1
 
         if "average" in click_id:
             for i in range(13):
-                fig.add_shape(type="rect", x0=(trace - 0.43) + 4 * i, y0=y - 0.41, x1=(trace + 0.43) + 4 * i,
-                              y1=y + 0.41, line_width=4, line_color="white")
+                fig.add_shape(type="rect", x0=(trace - 0.43) + 4 * i, y0=y0, x1=(trace + 0.43) + 4 * i,
+                              y1=y1, line_width=4, line_color="white")
         elif "organ" in click_id:
-            fig.add_shape(type="rect", x0=timestamp_i * 4 - 0.43 + trace, y0=y - 0.41,
-                          x1=timestamp_i * 4 + 0.43 + trace, y1=y + 0.41, line_color="white", line_width=4)
+            fig.add_shape(type="rect", x0=timestamp_i * 4 - 0.43 + trace, y0=y0,
+                          x1=timestamp_i * 4 + 0.43 + trace, y1=y1, line_color="white", line_width=4)
         elif "differences" in click_id:
             x = data["curveNumber"] + 2
-            fig.add_shape(type="rect", x0=timestamp_i * 4 - 0.43 + x, y0=y - 0.41, x1=timestamp_i * 4 + 0.43 + x,
-                          y1=y + 0.41, line_color="white", line_width=4)
+            fig.add_shape(type="rect", x0=timestamp_i * 4 - 0.43 + x, y0=y0, x1=timestamp_i * 4 + 0.43 + x,
+                          y1=y1, line_color="white", line_width=4)
         elif "rotations" in click_id:
-            fig.add_shape(type="rect", x0=timestamp_i * 4 - 0.43, y0=y - 0.41, x1=timestamp_i * 4 + 3.43,
-                          y1=y + 0.41, line_color="white", line_width=4)
+            fig.add_shape(type="rect", x0=timestamp_i * 4 - 0.43, y0=y0, x1=timestamp_i * 4 + 3.43,
+                          y1=y1, line_color="white", line_width=4)
 
 
-def create_data_for_heatmap(icp):
+def create_data_for_heatmap(method, metric="Centroid distance"):
     """
     Creates hover texts and formats the data for the heatmaps
-    :param icp: true if our graph is the icp version of the heatmaps, false otherwise
+    :param method: RM of the heatmap, ICP, prostate centring or organ registration
+    :param metric: centroid distance, one of the surface-distance metrics or the mean deformation
     :return: formatted data for the heatmap and the hover text
     """
     # data is 2d array with distances for the heightmap, custom_data and hover_text are used just for hover labels
-    data, custom_data, hover_text = [], [], []
-    for i in range(len(PATIENTS)):
-        # patient contains four arrays: bones, prostate, bladder, rectum with distances from all the timestamps
-        patient = all_distances_icp[i] if icp else all_distances_center[i]
-        data_row, custom_row, hover_row = [], [], []
-
+    data, custom_data, hover_text = heatmap_matrix(method, metric), [], []
+    for _ in range(len(PATIENTS)):
+        custom_row, hover_row = [], []
         for j in range(len(TIMESTAMPS)):
-            data_row.extend([0, patient[0][j], patient[1][j], patient[2][j]]) if icp \
-                else data_row.extend([patient[0][j], 0, patient[1][j], patient[2][j]])
             custom_row.extend([j + 1, j + 1, j + 1, j + 1])
             hover_row.extend(["Bones", "Prostate", "Bladder", "Rectum"])
 
-        data.append(data_row)
         custom_data.append(custom_row)
         hover_text.append(hover_row)
 
     return data, custom_data, hover_text
 
 
+def heatmap_matrix(method, metric="Centroid distance"):
+    """
+    Values of the heatmap cells of all patients, every timestamp has four cells in the order of constants.ORGANS.
+    :param method: RM of the heatmap, ICP, prostate centring or organ registration
+    :param metric: centroid distance, one of the surface-distance metrics or the mean deformation
+    :return: float32 array indexed by patient and cell
+    """
+    dataset = data_store.current()
+    m = constants.METHODS.index(method)
+    cells = np.zeros((len(PATIENTS), len(TIMESTAMPS), 4), dtype=np.float32)
+
+    if metric == constants.DEFORMATION_METRIC:
+        # only the bladder and rectum are deformed, the cells of the other organs stay empty
+        cells[:, :, :2] = np.nan
+        cells[:, :, 2:] = np.transpose(dataset["deformations"][:, m], (0, 2, 1))
+    elif metric != "Centroid distance":
+        # the surface metrics are defined for every organ, including the one the RM aligns by
+        cells[:] = np.transpose(dataset["surface_metrics"][:, m, constants.SURFACE_METRICS.index(metric)], (0, 2, 1))
+    else:
+        # the distances have three organs, the one the RM aligns by is missing and stays zero; the organ registration
+        # keeps the bone ICP for the bones
+        distances = {"ICP": "distances_icp", "Prostate Centring": "distances_center",
+                     "Organ Registration": "distances_organ"}[method]
+        organs = [0, 2, 3] if method == "Prostate Centring" else [1, 2, 3]
+        cells[:, :, organs] = np.transpose(dataset[distances], (0, 2, 1))
+
+    return cells.reshape(len(PATIENTS), -1)
+
+
 @app.callback(
     Output("snd-timestamp-dropdown", "value"),
     Input("organ-distances", "clickData"),
     Input("alignment-differences", "clickData"),
     Input("heatmap-icp", "clickData"),
     Input("heatmap-center", "clickData"),
+    Input("heatmap-organ", "clickData"),
     Input("rotations-graph", "clickData"))
-def update_timestamp_dropdown(organ_distances, differences, heatmap_icp, heatmap_center, rotations_graph):
+def update_timestamp_dropdown(organ_distances, differences, heatmap_icp, heatmap_center, heatmap_organ,
+                              rotations_graph):
     """Function needed for updating the callbacks."""
     return timestamp_i + 1
 
@@ -827,21 +1362,43 @@ def update_timestamp_dropdown(organ_distances, differences, heatmap_icp, heatmap
     Output("rotations-axes", "figure"),
     Input("heatmap-icp", "clickData"),
     Input("heatmap-center", "clickData"),
+    Input("heatmap-organ", "clickData"),
     Input("average-distances", "clickData"),
     Input("alignment-radioitems", "value"),
     Input("mode-radioitems", "value"),
     Input("fst-timestamp-dropdown", "value"))
-def create_3d_angle(heatmap_icp, heatmap_center, average_distances, method, mode, fst_timestamp):
+def create_3d_angle(heatmap_icp, heatmap_center, heatmap_organ, average_distances, method, mode, fst_timestamp):
     """
     Creates 3D rotation angle representation graph.
     :param heatmap_icp: used for firing the callback and changing the patient
     :param heatmap_center: used for firing the callback and changing the patient
+    :param heatmap_organ: used for firing the callback and changing the patient
     :param average_distances: used for firing the callback and changing the patient
     :param method: method of alignment - ICP or prostate centring
     :param mode: plan organs or two timestamps
     :param fst_timestamp: number of the first selected timestamp
     :return: 3D rotation figure
     """
+    if "ICP" in method and "Two" in mode and fst_timestamp == "plan":
+        rotations = data_store.current()["rotations"][PATIENTS.index(patient_id)]
+        text_x = str(round(rotations[0][timestamp_i], 2)) + "°"
+        text_y = str(round(rotations[1][timestamp_i], 2)) + "°"
+        text_z = str(round(rotations[2][timestamp_i], 2)) + "°"
+    else:
+        text_x, text_y, text_z = "0°", "0°", "0°"
+
+    return figure_cache.get_or_create("rotations-axes", [text_x, text_y, text_z],
+                                      lambda: make_3d_angle_figure(text_x, text_y, text_z))
+
+
+def make_3d_angle_figure(text_x, text_y, text_z):
+    """
+    Helper function for plotting of the 3D rotation graph
+    :param text_x: rotation angle around the X axis
+    :param text_y: rotation angle around the Y axis
+    :param text_z: rotation angle around the Z axis
+    :return: 3D rotation figure
+    """
     layout = go.Layout(font=dict(size=12, color='darkgrey'), paper_bgcolor='rgba(50,50,50,1)', showlegend=False,
                        plot_bgcolor='rgba(50,50,50,1)', margin=dict(l=10, r=10, t=10, b=10), height=280, width=320)
     fig = go.Figure(layout=layout)
@@ -851,13 +1408,6 @@ def create_3d_angle(heatmap_icp, heatmap_center, average_distances, method, mode
     cone_tip = 7
     size = 12
 
-    if "ICP" in method and "Two" in mode and fst_timestamp == "plan":
-        text_x = str(round(rotations[PATIENTS.index(patient_id)][0][0][timestamp_i], 2)) + "°"
-        text_y = str(round(rotations[PATIENTS.index(patient_id)][0][1][timestamp_i], 2)) + "°"
-        text_z = str(round(rotations[PATIENTS.index(patient_id)][0][2][timestamp_i], 2)) + "°"
-    else:
-        text_x, text_y, text_z = "0°", "0°", "0°"
-
     create_rotation_axes(fig, annot)
     t = np.linspace(0, 10, steps)
     x, y, z = 20, np.cos(t) * size, np.sin(t) * size
@@ -935,18 +1485,23 @@ def create_rotation_axes(fig, annot):
     Input("snd-timestamp-dropdown", "value"),
     Input("heatmap-icp", "clickData"),
     Input("heatmap-center", "clickData"),
+    Input("heatmap-organ", "clickData"),
     Input("average-distances", "clickData"),
     Input("organ-distances", "clickData"),
-    Input("alignment-differences", "clickData"))
-def create_3dgraph(method, organs, mode, fst_timestamp, snd_timestamp, heatmap_icp, heatmap_center, average_distances,
-                   organ_distances, differences):
+    Input("alignment-differences", "clickData"),
+    Input("colouring-radioitems", "value"))
+def create_3dgraph(method, organs, mode, fst_timestamp, snd_timestamp, heatmap_icp, heatmap_center, heatmap_organ,
+                   average_distances, organ_distances, differences, colouring):
     """
-    Creates the 3D figure and visualises organs and bones. The last five arguments are just for updating the graph.
+    Creates the 3D figure and visualises organs and bones. The six arguments after the timestamps are just for
+    updating the graph.
     :param method: ICP or prostate aligning registration method
     :param organs: organs selected by the user
     :param mode: showing either plan organs or organs in the two timestamps
     :param fst_timestamp: the first selected timestamp
     :param snd_timestamp: the second selected timestamp
+    :param colouring: uniform colours, distances to the plan organs or the lengths of the deformation of the bladder
+    and rectum
     :return: the 3d figure
     """
     fst_timestamp = "_plan" if fst_timestamp == "plan" else fst_timestamp
@@ -956,26 +1511,85 @@ def create_3dgraph(method, organs, mode, fst_timestamp, snd_timestamp, heatmap_i
     if "distances" in ctx.triggered_id or "heatmap" in ctx.triggered_id or "differences" in ctx.triggered_id:
         organs = [organ]
 
-    objects_fst = import_selected_organs(organs, fst_timestamp, patient_id)
-    objects_snd = import_selected_organs(organs, snd_timestamp, patient_id)
+    # only the inputs which change the figure in the selected mode are part of the key
+    inputs = [patient_id, organs, mode]
+    if "Plan" not in mode:
+        inputs.append(method)
+    if "Two" in mode:
+        inputs.extend([fst_timestamp, snd_timestamp, colouring])
+
+    fig = figure_cache.get_or_create("main-graph", inputs, lambda: make_3d_figure(
+        method, organs, mode, fst_timestamp, snd_timestamp, colouring))
+
+    # the neighbouring timestamps of the shown organs are usually looked at next
+    if "Two" in mode:
+        mesh_cache.prefetch_neighbours(patient_id, [fst_timestamp, snd_timestamp], organs, [method])
+
+    return fig, organs
+
 
+def make_3d_figure(method, organs, mode, fst_timestamp, snd_timestamp, colouring="Uniform"):
+    """
+    Helper function for plotting of the 3D graph
+    :param method: ICP or prostate aligning registration method
+    :param organs: organs selected by the user
+    :param mode: showing plan organs, organs in the two timestamps or organs in all timestamps
+    :param fst_timestamp: the first selected timestamp
+    :param snd_timestamp: the second selected timestamp
+    :param colouring: uniform colours, distances to the plan organs or the lengths of the deformation of the bladder
+    and rectum
+    :return: the 3d figure
+    """
     camera = dict(up=dict(x=0, y=0, z=1), center=dict(x=0, y=0, z=0), eye=dict(x=0.5, y=-2, z=0))
     layout = go.Layout(font=dict(size=12, color='darkgrey'), paper_bgcolor='rgba(50,50,50,1)', uirevision=patient_id,
                        plot_bgcolor='rgba(50,50,50,1)', margin=dict(l=40, r=40, t=60, b=40), showlegend=True)
     fig = go.Figure(layout=layout)
     fig.update_layout(scene_camera=camera, scene=dict(xaxis_title='x [mm]', yaxis_title='y [mm]', zaxis_title='z [mm]'))
 
-    fst_meshes, snd_meshes = \
-        decide_3d_graph_mode(mode, fig, method, organs, fst_timestamp, snd_timestamp, objects_fst, objects_snd)
+    fst_meshes, snd_meshes = decide_3d_graph_mode(mode, fig, method, organs, fst_timestamp, snd_timestamp)
+    if "Two timestamps" in mode and colouring != "Uniform":
+        colour_meshes([(fst_meshes, fst_timestamp), (snd_meshes, snd_timestamp)], method, organs, colouring)
 
     for meshes in [fst_meshes, snd_meshes]:
         for mesh in meshes:
-            mesh.update(cmin=-7, lightposition=dict(x=100, y=200, z=0),
+            mesh.update(cmin=-7 if mesh.intensity is None else 0, lightposition=dict(x=100, y=200, z=0),
                         lighting=dict(ambient=0.4, diffuse=1, fresnel=0.1, specular=1, roughness=0.5,
                                       facenormalsepsilon=1e-15, vertexnormalsepsilon=1e-15))
             fig.add_trace(mesh)
 
-    return fig, organs
+    return fig
+
+
+def colour_meshes(timestamp_meshes, method, organs, colouring):
+    """
+    Colours the vertices of the aligned organs by their distances to the plan organ surfaces, or the bladder and rectum
+    by the lengths of their displacements onto the plan organs. The values are cached, so switching the colouring
+    back and forth computes nothing again. The plan organs keep their uniform colour.
+    :param timestamp_meshes: pairs of the go.Mesh3d meshes in the order of the organs and their timestamp
+    :param method: RM which aligned the organs
+    :param organs: organs selected by the user
+    :param colouring: distance to plan or deformation
+    """
+    coloured = []
+    for meshes, timestamp in timestamp_meshes:
+        for mesh, organ_name in zip(meshes, organs):
+            if timestamp == "_plan":
+                break
+            if colouring == "Deformation" and organ_name in constants.DEFORMABLE_ORGANS:
+                values = np.linalg.norm(mesh_cache.get_displacements(patient_id, organ_name, timestamp, method),
+                                        axis=1)
+            elif colouring == "Distance to plan":
+                values = mesh_cache.get_surface_distances(patient_id, organ_name, timestamp, method)
+            else:
+                continue
+            coloured.append((mesh, organ_name, values))
+
+    # the organs of both timestamps share one colour scale, so only the first one shows it
+    cmax = max([float(np.max(values)) for _, _, values in coloured], default=0)
+    for n, (mesh, organ_name, values) in enumerate(coloured):
+        mesh.update(intensity=values, intensitymode="vertex", colorscale=constants.HEATMAP_CS, cmin=0, cmax=cmax,
+                    showscale=n == 0, colorbar=dict(title="{}<br>[mm]".format(colouring)),
+                    hovertemplate=organ_name + "<br>" + colouring + ": %{intensity:.2f} mm<extra></extra>")
 
 
 def import_selected_organs(organs, time_or_plan, patient):
@@ -988,29 +1602,25 @@ def import_selected_organs(organs, time_or_plan, patient):
     """
     objects = []
     for organ in organs:
-        objects.extend(registration_methods.import_obj([FILEPATH + "{}\\{}\\{}{}.obj"
-                                                       .format(patient, organ.lower(), organ.lower(), time_or_plan)]))
+        objects.append(mesh_cache.get_object(patient, organ, time_or_plan))
     return objects
 
 
-def decide_3d_graph_mode(mode, fig, method, organs, fst_timestamp, snd_timestamp, objects_fst, objects_snd):
+def decide_3d_graph_mode(mode, fig, method, organs, fst_timestamp, snd_timestamp):
     """
     Helper function to perform commands according to the chosen mode
-    :param mode: showing either plan organs or organ in the two timestamps
+    :param mode: showing plan organs, organs in the two timestamps or organs in all timestamps
     :param fig: 3D figure
     :param method: ICP or prostate aligning registration method
     :param organs: organs selected by the user
     :param fst_timestamp: the first selected timestamp
     :param snd_timestamp: the second selected timestamp
-    :param objects_fst: organs from the first timestamp
-    :param objects_snd: organs from the second timestamp
     :return: created meshes
     """
     fst_meshes, snd_meshes = [], []
 
     if "Two timestamps" in mode:
-        fst_meshes, snd_meshes = \
-            two_timestamps_mode(method, fst_timestamp, snd_timestamp, objects_fst, objects_snd)
+        fst_meshes, snd_meshes = two_timestamps_mode(method, organs, fst_timestamp, snd_timestamp)
 
         fst_timestamp = "plan organs" if "_plan" == fst_timestamp else "timestamp number {}".format(fst_timestamp)
         snd_timestamp = "plan organs" if "_plan" == snd_timestamp else "timestamp number {}".format(snd_timestamp)
@@ -1018,6 +1628,12 @@ def decide_3d_graph_mode(mode, fig, method, organs, fst_timestamp, snd_timestamp
         fig.update_layout(title_text="Patient {}, {} (pink) and {} (purple)"
                           .format(patient_id, fst_timestamp, snd_timestamp), title_x=0.5, title_y=0.95)
 
+    elif "All timestamps" in mode:
+        fst_meshes = create_meshes_from_objs(import_selected_organs(organs, "_plan", patient_id), constants.PINK)
+        snd_meshes = add_animation_frames(fig, method, organs, len(fst_meshes))
+        fig.update_layout(title_text="Patient {}, plan organs (pink) and all timestamps (purple)".format(patient_id),
+                          title_x=0.5, title_y=0.95)
+
     else:
         objects = import_selected_organs(organs, "_plan", patient_id)
         fst_meshes = create_meshes_from_objs(objects, constants.PINK)
@@ -1026,74 +1642,115 @@ def decide_3d_graph_mode(mode, fig, method, organs, fst_timestamp, snd_timestamp
     return fst_meshes, snd_meshes
 
 
-def two_timestamps_mode(method, fst_timestamp, snd_timestamp, objects_fst, objects_snd):
+def add_animation_frames(fig, method, organs, first_trace):
+    """
+    Adds a frame with the aligned and decimated organs of every timestamp and the slider which switches them, so the
+    timestamps are scrubbed in the browser without any further callback.
+    :param fig: 3D figure
+    :param method: ICP or prostate centring
+    :param organs: organs selected by the user
+    :param first_trace: index of the first trace replaced by the frames
+    :return: meshes of the first timestamp
+    """
+    frames, steps = [], []
+    for timestamp in TIMESTAMPS:
+        objects = [mesh_cache.get_decimated_object(patient_id, organ_a, timestamp, method) for organ_a in organs]
+        frames.append(go.Frame(data=create_meshes_from_objs(objects, constants.PURPLE), name=str(timestamp),
+                               traces=list(range(first_trace, first_trace + len(organs)))))
+        steps.append(dict(method="animate", label=str(timestamp), args=[[str(timestamp)], dict(
+            mode="immediate", frame=dict(duration=0, redraw=True), transition=dict(duration=0))]))
+
+    fig.frames = frames
+    fig.update_layout(sliders=[dict(active=0, steps=steps, currentvalue=dict(prefix="Timestamp: "),
+                                    pad=dict(t=10), len=0.9, x=0.05)],
+                      updatemenus=[dict(type="buttons", showactive=False, x=0.05, y=0, xanchor="right",
+                                        buttons=[dict(label="▶", method="animate", args=[None, dict(
+                                            frame=dict(duration=500, redraw=True), fromcurrent=True)])])])
+
+    return list(frames[0].data)
+
+
+def two_timestamps_mode(method, organs, fst_timestamp, snd_timestamp):
     """
     Helper to get the chosen meshes and align them according to the selected method.
-    :param method: ICP or prostate centering
+    :param method: ICP, prostate centering or organ registration
+    :param organs: organs selected by the user
     :param fst_timestamp: number of the first selected timestamp
     :param snd_timestamp: number of the second selected timestamp
-    :param objects_fst: objects imported in the time of the first timestamp
-    :param objects_snd: objects imported in the time of the second timestamp
     :return: aligned meshes and center of the moved organs
     """
     fst_meshes, snd_meshes = [], []
     if "ICP" in method:
-        meshes = get_meshes_after_icp(fst_timestamp, objects_fst, patient_id)
+        meshes = get_meshes_after_icp(fst_timestamp, organs, patient_id)
         fst_meshes.extend(meshes)
-        meshes = get_meshes_after_icp(snd_timestamp, objects_snd, patient_id, constants.PURPLE)
+        meshes = get_meshes_after_icp(snd_timestamp, organs, patient_id, constants.PURPLE)
+        snd_meshes.extend(meshes)
+
+    elif "Organ" in method:
+        meshes = get_meshes_after_organ_registration(fst_timestamp, organs, patient_id)
+        fst_meshes.extend(meshes)
+        meshes = get_meshes_after_organ_registration(snd_timestamp, organs, patient_id, constants.PURPLE)
         snd_meshes.extend(meshes)
 
     else:
-        meshes = get_meshes_after_centering(fst_timestamp, objects_fst, patient_id, constants.PINK)
+        meshes = get_meshes_after_centering(fst_timestamp, organs, patient_id, constants.PINK)
         fst_meshes.extend(meshes)
-        meshes = get_meshes_after_centering(snd_timestamp, objects_snd, patient_id)
+        meshes = get_meshes_after_centering(snd_timestamp, organs, patient_id)
         snd_meshes.extend(meshes)
 
     return fst_meshes, snd_meshes
 
 
-def get_meshes_after_icp(timestamp, objects, patient, color=constants.PINK):
+def get_meshes_after_icp(timestamp, organs, patient, color=constants.PINK):
     """
-    Runs functions which perform the icp aligning.
+    Runs functions which perform the icp aligning. The aligned organs are taken from the cache if they were
+    already computed or prefetched.
     :param timestamp: chosen time
-    :param objects: organ meshes
+    :param organs: selected organs
     :param patient: patient ID
     :param color: mesh color, the first mesh is pink, the second purple
     :return: meshes after aligning
     """
-
-    plan_bones = registration_methods.import_obj([FILEPATH + "{}\\bones\\bones_plan.obj".format(patient)])
-    bones = registration_methods.import_obj([FILEPATH + "{}\\bones\\bones{}.obj".format(patient, timestamp)])
-
-    transform_matrix = registration_methods.icp_transformation_matrix(bones[0][0], plan_bones[0][0])
-    transfr_objects = registration_methods.vertices_transformation(transform_matrix, deepcopy(objects))
+    transfr_objects = [mesh_cache.get_aligned_object(patient, organ_a, timestamp, "ICP") for organ_a in organs]
     after_icp_meshes = create_meshes_from_objs(transfr_objects, color)
 
     return after_icp_meshes
 
 
-def get_meshes_after_centering(timestamp, objects, patient, color=constants.PURPLE):
+def get_meshes_after_centering(timestamp, organs, patient, color=constants.PURPLE):
     """
-    Runs functions which perform the prostate centring.
+    Runs functions which perform the prostate centring. The aligned organs are taken from the cache if they were
+    already computed or prefetched.
     :param timestamp: chosen time
-    :param objects: organ meshes
+    :param organs: selected organs
     :param patient: patient ID
     :param color: mesh color, the first mesh is pink, the second purple
     :return: meshes after aligning
     """
-
-    prostate = registration_methods.import_obj([FILEPATH + "{}\\prostate\\prostate{}.obj".format(patient, timestamp)])
-    plan_center = registration_methods.find_center_of_mass(registration_methods.import_obj(
-        [FILEPATH + "{}\\prostate\\prostate_plan.obj".format(patient)])[0][0])
-    other_center = registration_methods.find_center_of_mass(prostate[0][0])
-
-    center_matrix = registration_methods.create_translation_matrix(plan_center, other_center)
-    center_transfr_objects = registration_methods.vertices_transformation(center_matrix, deepcopy(objects))
+    center_transfr_objects = [mesh_cache.get_aligned_object(patient, organ_a, timestamp, "Prostate Centring")
+                              for organ_a in organs]
     after_center_meshes = create_meshes_from_objs(center_transfr_objects, color)
 
     return after_center_meshes
 
 
+def get_meshes_after_organ_registration(timestamp, organs, patient, color=constants.PINK):
+    """
+    Gets every organ registered to its plan organ, the bones are aligned by ICP. The aligned organs are taken from the
+    cache if they were already computed or prefetched.
+    :param timestamp: chosen time
+    :param organs: selected organs
+    :param patient: patient ID
+    :param color: mesh color, the first mesh is pink, the second purple
+    :return: meshes after aligning
+    """
+    organ_transfr_objects = [mesh_cache.get_aligned_object(patient, organ_a, timestamp, "Organ Registration")
+                             for organ_a in organs]
+    after_organ_meshes = create_meshes_from_objs(organ_transfr_objects, color)
+
+    return after_organ_meshes
+
+
 @app.callback(
     Output("x-slice-graph", "figure"),
     Output("y-slice-graph", "figure"),
@@ -1138,9 +1795,7 @@ def create_graph_slices(x_slider, y_slider, z_slider, organs, method, mode, fst_
         snd_meshes = two_slices_mode(method, patient_id, organs, snd_timestamp)
     else:
         for organ_a in organs:
-            fst_meshes.append(
-                trimesh.load_mesh(FILEPATH + "{}\\{}\\{}_plan.obj".format(patient_id, organ_a.lower(),
-                                                                          organ_a.lower())))
+            fst_meshes.append(mesh_cache.get_mesh(patient_id, organ_a, "_plan"))
 
     x_fig = create_slice_final(x_slider, fst_meshes, snd_meshes, figures[0], "x")
     y_fig = create_slice_final(y_slider, fst_meshes, snd_meshes, figures[1], "y")
@@ -1158,45 +1813,18 @@ def two_slices_mode(method, patient, organs, timestamp):
     :param timestamp: chosen time of the timestamp
     :return: aligned meshes
     """
-    if "ICP" in method:
-        plan_bones = registration_methods.import_obj([FILEPATH + "{}\\bones\\bones_plan.obj".format(patient)])
-        bones = registration_methods.import_obj([FILEPATH + "{}\\bones\\bones{}.obj".format(patient, timestamp)])
-        icp_matrix = registration_methods.icp_transformation_matrix(bones[0][0], plan_bones[0][0])
-        meshes = selected_organs_slices(icp_matrix, patient, organs, timestamp)
-
-    else:
-        plan_prostate = trimesh.load_mesh(FILEPATH + "{}\\prostate\\prostate_plan.obj".format(patient))
-        prostate = trimesh.load_mesh(FILEPATH + "{}\\prostate\\prostate{}.obj".format(patient, timestamp))
-        key_center = registration_methods.find_center_of_mass(plan_prostate.vertices)
-        other_center = registration_methods.find_center_of_mass(prostate.vertices)
-        center_matrix = registration_methods.create_translation_matrix(key_center, other_center)
-        meshes = selected_organs_slices(center_matrix, patient, organs, timestamp)
-
-    return meshes
-
-
-def selected_organs_slices(matrix, patient, organs, timestamp):
-    """
-    Applies the transformation to selected organs.
-    :param matrix: acquired either from icp algorithm or centering on the prostate
-    :param patient: chosen patient id
-    :param organs: organs chosen in the 3D graph
-    :param timestamp: chosen time of the timestamp
-    :return: transformed meshes
-    """
     meshes = []
 
     for organ_a in organs:
-        mesh = trimesh.load_mesh(FILEPATH + "{}\\{}\\{}{}.obj".format(patient, organ_a.lower(), organ_a.lower(),
-                                                                      timestamp))
-        meshes.append(deepcopy(mesh).apply_transform(matrix))
+        meshes.append(mesh_cache.get_mesh(patient, organ_a, timestamp, method))
 
     return meshes
 
 
 def create_slice(mesh, slice_slider, params):
     """
-    Creates the slices from the imported organs
+    Creates the slices from the imported organs. Only the faces which the slice index of the mesh gives for the plane
+    position are cut, so dragging the slider stays fast even for the bones.
     :param mesh: mesh of the selected organ
     :param slice_slider: where on the normal of the axis we want to make the slice
     :param params: parameters for the computation of the slice
@@ -1212,7 +1840,13 @@ def create_slice(mesh, slice_slider, params):
     else:
         plane_origin[2] = (min_val + 0.5) + slope * slice_slider
 
-    axis_slice = mesh.section(plane_origin=plane_origin, plane_normal=plane_normal)
+    axis_i = "xyz".index(axis)
+    faces = registration_methods.slice_faces(mesh, axis_i, plane_origin[axis_i])
+    if len(faces) == 0:
+        return []
+    axis_slice = mesh.section(plane_origin=plane_origin, plane_normal=plane_normal, local_faces=faces)
+    if axis_slice is None:
+        return []
 
     slices = []
     for entity in axis_slice.entities:
@@ -85,7 +85,13 @@ layout = html.Div(className="row", children=[
         html.Div(className="row", style={"textAlign": "center"}, children=[
             html.H6("Show scale:", style={'display': 'inline-block'}),
             dcc.RadioItems(options=["uniform", "individual"], value="uniform", inline=True, id="scale-heatmap",
-                           style={'display': 'inline-block', "font-size": "18px"})]),
+                           style={'display': 'inline-block', "font-size": "18px"}),
+            html.H6("Metric:", style={'display': 'inline-block', "padding": "0px 0px 0px 40px"}),
+            dcc.Dropdown(options=["Centroid distance"] + constants.SURFACE_METRICS + [constants.DEFORMATION_METRIC],
+                         value="Centroid distance",
+                         searchable=False, clearable=False, id="metric-heatmap",
+                         style={'display': 'inline-block', "width": "250px", "font-size": "16px",
+                                "vertical-align": "middle", "padding": "0px 0px 0px 20px"})]),
 
         html.Div(style={'textAlign': 'center'}, children=[
             dcc.Graph(id="heatmap-icp", config=dict(modeBarButtonsToRemove=constants.MODEBAR),
@@ -94,6 +100,30 @@ layout = html.Div(className="row", children=[
         html.Div(style={'textAlign': 'center'}, children=[
             dcc.Graph(id="heatmap-center", config=dict(modeBarButtonsToRemove=constants.MODEBAR),
                       style={'display': 'inline-block', "padding": "0px 0px 20px 0px", "width": "95%"})]),
+        html.Div(style={'textAlign': 'center'}, children=[
+            dcc.Graph(id="heatmap-organ", config=dict(modeBarButtonsToRemove=constants.MODEBAR),
+                      style={'display': 'inline-block', "padding": "0px 0px 20px 0px", "width": "95%"})]),
+
+        # COHORT STATISTICS ------------------------------------------------------------------------------------------
+
+        html.H6("""The cohort statistics summarise the distances of all patients in every timestamp. The left graph 
+        shows the median distance of the organ after every registration method, with the band between the 25th and 
+        75th percentile. The right graph compares ICP and prostate centring on the same patients: below zero, the organ 
+        stayed closer to the plan after ICP. The band is the bootstrap confidence interval of the mean difference.""",
+                style={"margin-left": "40px", "margin-right": "40px", "color": "#081e5e",
+                       "background-color": constants.LIGHT_GREY, "border-radius": "5px",
+                       "padding": "10px 30px 10px 30px"}),
+
+        html.Div(className="row", style={"textAlign": "center"}, children=[
+            html.H6("Organ:", style={'display': 'inline-block'}),
+            dcc.Dropdown(options=constants.ORGANS, value="Bladder", searchable=False, clearable=False,
+                         id="statistics-organ", style={'display': 'inline-block', "width": "150px",
+                                                       "font-size": "16px", "vertical-align": "middle",
+                                                       "padding": "0px 0px 0px 20px"})]),
+
+        html.Div(style={'textAlign': 'center'}, children=[
+            dcc.Graph(id="cohort-statistics", config=dict(modeBarButtonsToRemove=constants.MODEBAR),
+                      style={'display': 'inline-block', "width": "95%", "padding": "20px 0px 20px 0px"})]),
 
         html.H6("Individual patient section",
                 style={"margin": "20px 40px 20px 40px", "color": "#171717",
@@ -131,8 +161,47 @@ layout = html.Div(className="row", children=[
 
         html.Div(className="row", style={'textAlign': 'center'}, children=[
             dcc.Graph(id="alignment-differences", config=dict(modeBarButtonsToRemove=constants.MODEBAR),
+                      style={"padding": "20px 40px 30px 40px", 'display': 'inline-block', "width": "95%"})]),
+
+        # OVERLAP GRAPH ---------------------------------------------------------------------------------------------
+
+        html.H6("""The distances above compare only the centroids of the organs. The overlap graph shows how much 
+        of the organ volume is shared with the plan organ after each registration method. The value 1 means the 
+        aligned organ occupies exactly the same voxels as the plan organ, 0 means they do not overlap at all.""",
+                style={"margin-left": "40px", "margin-right": "40px", "color": "#081e5e",
+                       "background-color": constants.LIGHT_GREY, "border-radius": "5px",
+                       "padding": "10px 30px 10px 30px"}),
+
+        html.Div(className="row", style={"textAlign": "center"}, children=[
+            html.H6("Show coefficient:", style={'display': 'inline-block'}),
+            dcc.RadioItems(options=constants.OVERLAP_METRICS, value="Dice", inline=True, id="overlap-metric",
+                           style={'display': 'inline-block', "font-size": "18px"})]),
+
+        html.Div(className="row", style={'textAlign': 'center'}, children=[
+            dcc.Graph(id="overlap-graph", config=dict(modeBarButtonsToRemove=constants.MODEBAR),
                       style={"padding": "20px 40px 30px 40px", 'display': 'inline-block', "width": "95%"})])]),
 
+    # FRACTION PAIRS GRAPH ------------------------------------------------------------------------------------------
+    html.H6("""The fraction pairs heatmap shows how stable the organ positions are between the treatment 
+    appointments. Every cell is the distance between the organ centroids of the two timestamps after both were 
+    aligned to the plan with the selected registration method.""",
+            style={"margin-left": "40px", "margin-right": "40px", "color": "#081e5e",
+                   "background-color": constants.LIGHT_GREY, "border-radius": "5px",
+                   "padding": "10px 30px 10px 30px"}),
+
+    html.Div(className="row", style={"textAlign": "center"}, children=[
+        html.H6("Show method:", style={'display': 'inline-block'}),
+        dcc.RadioItems(options=constants.METHODS, value="ICP", inline=True, id="pairs-method",
+                       style={'display': 'inline-block', "font-size": "18px"}),
+        html.H6("Organ:", style={'display': 'inline-block', "padding": "0px 0px 0px 40px"}),
+        dcc.Dropdown(options=constants.ORGANS, value="Prostate", searchable=False, clearable=False,
+                     id="pairs-organ", style={'display': 'inline-block', "width": "150px", "font-size": "16px",
+                                              "vertical-align": "middle", "padding": "0px 0px 0px 20px"})]),
+
+    html.Div(className="row", style={'textAlign': 'center'}, children=[
+        dcc.Graph(id="fraction-pairs", config=dict(modeBarButtonsToRemove=constants.MODEBAR),
+                  style={"padding": "20px 40px 10px 40px", 'display': 'inline-block', "width": "60%"})]),
+
     # ROTATIONS GRAPH -----------------------------------------------------------------------------------------------
     html.H6("""This graph depicts how the organs in a given time rotated in relation to the organs in the plan 
     images. The rotations along the three axes were computed with the ICP algorithm, and they are shown as angles in 
@@ -145,6 +214,23 @@ layout = html.Div(className="row", children=[
         dcc.Graph(id="rotations-graph", config=dict(modeBarButtonsToRemove=constants.MODEBAR),
                   style={"padding": "20px 40px 10px 40px", "width": "95%"})]),
 
+    # TRAJECTORY GRAPH ----------------------------------------------------------------------------------------------
+    html.H6("""The trajectory graph shows where the organ centroids were after the alignment in every timestamp, 
+    relative to the plan organ centroids in the origin. The cones point from one timestamp to the next one, 
+    so one can follow how the organs moved during the treatment.""",
+            style={"margin-left": "40px", "margin-right": "40px", "color": "#081e5e",
+                   "background-color": constants.LIGHT_GREY, "border-radius": "5px",
+                   "padding": "10px 30px 10px 30px"}),
+
+    html.Div(className="row", style={"textAlign": "center"}, children=[
+        html.H6("Show method:", style={'display': 'inline-block'}),
+        dcc.RadioItems(options=constants.METHODS[:2], value="ICP", inline=True, id="trajectory-method",
+                       style={'display': 'inline-block', "font-size": "18px"})]),
+
+    html.Div(className="row", style={'textAlign': 'center'}, children=[
+        dcc.Graph(id="trajectory-graph", config=dict(modeBarButtonsToRemove=constants.D3_MODEBAR),
+                  style={"padding": "20px 40px 10px 40px", 'display': 'inline-block', "width": "80%"})]),
+
     html.H6("Timestamp section",
             style={"margin": "20px 40px 20px 40px", "color": "#171717",
                    "font-family": "Bahnschrift", 'font-weight': 'bold',
@@ -171,7 +257,7 @@ layout = html.Div(className="row", children=[
             html.Div(className="six columns", children=[
 
                 html.H6("Select the mode:", style={'display': 'inline-block', "padding": "20px 0px 0px 45px"}),
-                dcc.RadioItems(options=["Plan organs", "Two timestamps"],
+                dcc.RadioItems(options=["Plan organs", "Two timestamps", "All timestamps"],
                                value="Plan organs", id="mode-radioitems", inline=True,
                                style={'display': 'inline-block', "padding": "0px 0px 0px 20px", "font-size": "18px"},
                                inputStyle={"margin-left": "20px"}),
@@ -187,7 +273,7 @@ layout = html.Div(className="row", children=[
 
                 html.H6("Select the method of alignment:",
                         style={'display': 'inline-block', "padding": "0px 50px 0px 45px"}, id="method"),
-                dcc.RadioItems(options=["ICP", "Prostate Centring"], value="ICP", inline=True,
+                dcc.RadioItems(options=constants.METHODS, value="ICP", inline=True,
                                id="alignment-radioitems",
                                style={'display': 'inline-block', "font-size": "18px", "padding": "0px 100px 0px 12px"}),
 
@@ -197,6 +283,10 @@ layout = html.Div(className="row", children=[
                               id="organs-checklist",
                               style={'display': 'inline-block', "font-size": "18px", "padding": "0px 0px 0px 25px"}),
 
+                html.H6("Colour the organs:", style={'display': 'inline-block', "padding": "0px 0px 0px 45px"}),
+                dcc.RadioItems(options=constants.COLOURINGS, value="Uniform", inline=True, id="colouring-radioitems",
+                               style={'display': 'inline-block', "font-size": "18px", "padding": "0px 0px 0px 25px"}),
+
                 dcc.Graph(id="main-graph", config=dict(modeBarButtonsToRemove=constants.D3_MODEBAR)),
             ]),
 
@@ -0,0 +1,123 @@
+import time
+import numpy as np
+
+import registration_methods
+from constants import PATIENTS, TIMESTAMPS, CENTROIDS
+
+ORGANS = ["bones", "prostate", "bladder", "rectum"]
+
+
+def _stack(meshes):
+    """Vertices and faces of all meshes in one array each, the faces index the stacked vertices."""
+    vertices = [np.asarray(mesh[0], dtype=np.float64) for mesh in meshes]
+    vertex_starts = np.cumsum([0] + [len(v) for v in vertices])[:-1]
+    faces = [np.asarray(mesh[1], dtype=np.int64) + start for mesh, start in zip(meshes, vertex_starts)]
+    face_starts = np.cumsum([0] + [len(f) for f in faces])[:-1]
+
+    return np.vstack(vertices), vertex_starts, np.vstack(faces), face_starts
+
+
+def batch_centroids(meshes, definition="vertex", block=1 << 16):
+    """
+    Centroids of many meshes at once, every sum runs over the stacked arrays of a group of them. The groups hold
+    about block vertices, larger stacks are slower than computing the meshes one by one, since their gathered
+    triangles no longer fit into the cache.
+    vertex: mean of the vertices, biased towards densely meshed regions
+    area: centroid of the surface, the triangle centroids weighted by their areas
+    volume: centroid of the solid, the tetrahedra of the triangles and the vertex mean weighted by their signed volumes,
+    it is exact for closed meshes
+    :param meshes: list of [vertices, faces]
+    :param definition: vertex, area or volume
+    :param block: number of vertices stacked at once, a larger mesh is computed on its own
+    :return: array of shape (N, 3) with the centroids in float64, NaN for the meshes without vertices or faces
+    """
+    if definition not in CENTROIDS:
+        raise ValueError("Unknown centroid definition {}, expected one of {}".format(definition, CENTROIDS))
+
+    # an empty mesh would repeat an offset of np.add.reduceat, which then returns an element instead of a sum
+    nonempty = [i for i, (vertices, faces) in enumerate(meshes) if len(vertices) and len(faces)]
+    result = np.full((len(meshes), 3), np.nan)
+
+    first, stacked = 0, 0
+    for position, i in enumerate(nonempty):
+        if stacked and stacked + len(meshes[i][0]) > block:
+            result[nonempty[first:position]] = _centroids([meshes[j] for j in nonempty[first:position]], definition)
+            first, stacked = position, 0
+        stacked += len(meshes[i][0])
+    if nonempty:
+        result[nonempty[first:]] = _centroids([meshes[j] for j in nonempty[first:]], definition)
+
+    return result
+
+
+def _centroids(meshes, definition):
+    vertices, vertex_starts, faces, face_starts = _stack(meshes)
+    counts = np.diff(np.append(vertex_starts, len(vertices)))
+    means = np.add.reduceat(vertices, vertex_starts, axis=0) / counts[:, np.newaxis]
+    if definition == "vertex":
+        return means
+
+    # the triangles are moved by the vertex mean of their mesh, which keeps the volume sums well conditioned
+    mesh_of_face = np.repeat(np.arange(len(meshes)), np.diff(np.append(face_starts, len(faces))))
+    a, b, c = (vertices[faces[:, k]] - means[mesh_of_face] for k in range(3))
+
+    if definition == "area":
+        weights = 0.5 * np.linalg.norm(np.cross(b - a, c - a), axis=1)
+        points = (a + b + c) / 3
+    else:
+        weights = np.einsum("ij,ij->i", a, np.cross(b, c)) / 6
+        points = (a + b + c) / 4
+
+    totals = np.add.reduceat(weights, face_starts)
+    moments = np.add.reduceat(points * weights[:, np.newaxis], face_starts, axis=0)
+
+    return means + moments / totals[:, np.newaxis]
+
+
+def centroid(vertices, faces, definition="vertex"):
+    """Centroid of one mesh, see batch_centroids()."""
+    return batch_centroids([[vertices, faces]], definition)[0]
+
+
+def benchmark(patients=PATIENTS):
+    """
+    Times the centroids of all meshes of the patients computed one by one and in one batch, and measures how far the
+    area and volume centroids lie from the vertex means.
+    :param patients: ids of the patients
+    :return: seconds per definition for the single and batch computation, and the mean and maximal difference in mm
+    of every organ and definition
+    """
+    meshes, organs = [], []
+    for patient in patients:
+        for organ in ORGANS:
+            for time_or_plan in ["_plan"] + TIMESTAMPS:
+                meshes.append(registration_methods.import_obj([registration_methods.obj_path(
+                    patient, organ, time_or_plan)])[0])
+                organs.append(organ)
+
+    timings, results = {}, {}
+    for definition in CENTROIDS:
+        start = time.perf_counter()
+        [centroid(vertices, faces, definition) for vertices, faces in meshes]
+        single = time.perf_counter() - start
+        start = time.perf_counter()
+        results[definition] = batch_centroids(meshes, definition)
+        timings[definition] = (single, time.perf_counter() - start)
+
+    organs = np.array(organs)
+    differences = {}
+    for definition in CENTROIDS[1:]:
+        shift = np.linalg.norm(results[definition] - results["vertex"], axis=1)
+        for organ in ORGANS:
+            differences[(organ, definition)] = (shift[organs == organ].mean(), shift[organs == organ].max())
+
+    return timings, differences
+
+
+if __name__ == '__main__':
+    timings, differences = benchmark()
+    for definition, (single, batch) in timings.items():
+        print("{:>7}: {:.4f} s one by one, {:.4f} s in one batch".format(definition, single, batch))
+    for (organ, definition), (mean, largest) in differences.items():
+        print("{:>9} {:>7} centroid differs from the vertex mean by {:.3f} mm on average, {:.3f} mm at most".format(
+            organ, definition, mean, largest))
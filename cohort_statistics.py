@@ -0,0 +1,97 @@
+import threading
+import warnings
+import numpy as np
+
+import data_store
+from constants import METHODS, ORGANS, STATISTICS_PERCENTILES, BOOTSTRAP_RESAMPLES, CONFIDENCE
+
+# organs of the stored distances of every RM in the order of ORGANS, the organ the RM aligns by has no distance
+DISTANCE_ORGANS = {"ICP": ["Prostate", "Bladder", "Rectum"], "Prostate Centring": ["Bones", "Bladder", "Rectum"],
+                   "Organ Registration": ["Prostate", "Bladder", "Rectum"]}
+DISTANCE_KEYS = {"ICP": "distances_icp", "Prostate Centring": "distances_center",
+                 "Organ Registration": "distances_organ"}
+
+# statistics of the loaded data versions, only the newest one is kept
+_statistics = {}
+_lock = threading.Lock()
+
+
+def distance_cube(dataset):
+    """
+    Centroid distances of the cohort in one array, NaN for the organ the RM aligns by and the missing fractions.
+    :param dataset: dictionary from data_store
+    :return: array indexed by patient, RM, organ of ORGANS and timestamp
+    """
+    patients, _, timestamps = dataset["distances_icp"].shape
+    cube = np.full((patients, len(METHODS), len(ORGANS), timestamps), np.nan)
+    for m, method in enumerate(METHODS):
+        organs = [ORGANS.index(organ) for organ in DISTANCE_ORGANS[method]]
+        cube[:, m, organs] = dataset[DISTANCE_KEYS[method]]
+
+    return cube
+
+
+def bootstrap_means(values, resamples=BOOTSTRAP_RESAMPLES, seed=0):
+    """
+    Bootstrap distribution of the means over the first axis. All resamples are drawn at once as counts of every
+    patient, so every mean of every resample is one matrix product; NaN values are left out of their means.
+    :param values: array indexed by patient first
+    :param resamples: number of resamples
+    :param seed: seed of the resampling, the same seed gives the same intervals
+    :return: array of the resampled means indexed by the resample first
+    """
+    patients = len(values)
+    flat = values.reshape(patients, -1)
+    valid = ~np.isnan(flat)
+    counts = np.random.default_rng(seed).multinomial(patients, np.full(patients, 1 / patients), size=resamples)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = (counts @ np.where(valid, flat, 0)) / (counts @ valid)
+
+    return means.reshape((resamples,) + values.shape[1:])
+
+
+def compute(dataset, resamples=BOOTSTRAP_RESAMPLES, confidence=CONFIDENCE, seed=0):
+    """
+    Cohort statistics of the centroid distances per RM, organ and timestamp: the median, the percentiles, the mean
+    with its bootstrap confidence interval and the paired differences of ICP and the prostate centring, which are
+    defined for the patients and organs with both distances.
+    :param dataset: dictionary from data_store
+    :param resamples: number of bootstrap resamples
+    :param confidence: level of the confidence intervals
+    :param seed: seed of the resampling
+    :return: dictionary of arrays, the statistics of the RMs are indexed by RM, organ and timestamp, the differences by
+    organ and timestamp, the percentiles and intervals have an additional first axis
+    """
+    cube = distance_cube(dataset)
+    differences = cube[:, METHODS.index("ICP")] - cube[:, METHODS.index("Prostate Centring")]
+    tails = [50 * (1 - confidence), 50 * (1 + confidence)]
+
+    # cells without any computed distance give NaN statistics, which the graph leaves empty
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        means = bootstrap_means(np.concatenate([cube, differences[:, np.newaxis]], axis=1), resamples, seed)
+        intervals = np.nanpercentile(means, tails, axis=0)
+
+        return dict(median=np.nanmedian(cube, axis=0),
+                    percentiles=np.nanpercentile(cube, STATISTICS_PERCENTILES, axis=0),
+                    mean=np.nanmean(cube, axis=0),
+                    mean_interval=intervals[:, :len(METHODS)],
+                    difference_median=np.nanmedian(differences, axis=0),
+                    difference_mean=np.nanmean(differences, axis=0),
+                    difference_interval=intervals[:, len(METHODS)],
+                    patients=np.count_nonzero(~np.isnan(differences), axis=0))
+
+
+def current():
+    """Statistics of the current dataset, computed once per data version."""
+    dataset = data_store.current()
+    with _lock:
+        statistics = _statistics.get(dataset["version"])
+    if statistics is None:
+        statistics = compute(dataset)
+        with _lock:
+            _statistics.clear()
+            _statistics[dataset["version"]] = statistics
+
+    return statistics
@@ -1,11 +1,107 @@
-import trimesh
-import trimesh.registration
+import time
 import numpy
-from scipy.spatial.transform import Rotation as R
 
 import registration_methods
+import surface_metrics
+import deformation
+import voxel_overlap
+import fraction_pairs
+import plan_index
+import sdf
+import organ_registration
+import mesh_cache
 import json
 import constants
+from concurrent.futures import ProcessPoolExecutor
+
+
+def patient_registrations(pat):
+    """The single ICP registration of every timestamp of the patient, shared by all the written files."""
+    return [mesh_cache.get_registration(pat, i) for i in constants.TIMESTAMPS]
+
+
+def computed_registrations(pat):
+    """Runs the ICP_VARIANT of every timestamp of the patient, ignoring the stored registrations."""
+    return [mesh_cache.compute_registration(pat, i) for i in constants.TIMESTAMPS]
+
+
+def write_registrations(registrations_file="computations_files/icp_registrations.txt"):
+    """Runs the ICP once per patient and timestamp and stores everything it gives."""
+    with ProcessPoolExecutor() as executor:
+        all_results = list(executor.map(computed_registrations, constants.PATIENTS))
+
+    all_reg = {}
+    for pat, results in zip(constants.PATIENTS, all_results):
+        all_reg[pat] = {str(i): dict(result._asdict(), matrix=numpy.asarray(result.matrix).tolist())
+                        for i, result in zip(constants.TIMESTAMPS, results)}
+
+    with open(registrations_file, "w") as reg_f:
+        json.dump(all_reg, reg_f)
+
+
+# write_registrations()
+
+
+def write_organ_registrations(registrations_file="computations_files/organ_registrations.txt",
+                              distances="computations_files/organ_distances_c.txt",
+                              averages="computations_files/organ_averages_c.txt"):
+    """
+    Registers every soft-tissue organ to its plan organ, all fractions of an organ in one batch and every patient in
+    its own process, and stores the registrations, the remaining centroid distances and their averages.
+    """
+    with ProcessPoolExecutor() as executor:
+        all_results = list(executor.map(organ_registration.patient_organ_registrations, constants.PATIENTS))
+
+    all_reg, all_dist = {}, []
+    with open(averages, "w") as avrg_f:
+        for pat, (registrations, dist) in zip(constants.PATIENTS, all_results):
+            all_reg[pat] = {organ: {str(i): dict(result._asdict(), matrix=numpy.asarray(result.matrix).tolist())
+                                    for i, result in zip(constants.TIMESTAMPS, results)}
+                            for organ, results in registrations.items()}
+            all_dist.append(dist)
+            for average in registration_methods.compute_average_distances(dist):
+                print(average, file=avrg_f)
+
+    with open(registrations_file, "w") as reg_f:
+        json.dump(all_reg, reg_f)
+    with open(distances, "w") as dist_f:
+        json.dump(all_dist, dist_f)
+
+
+# write_organ_registrations()
+
+
+def patient_icp_comparison(pat):
+    """Iterations, seconds and residual error of every icp variant in every timestamp of the patient."""
+    comparison = {}
+    for variant in constants.ICP_VARIANTS:
+        runs = []
+        for i in constants.TIMESTAMPS:
+            start = time.perf_counter()
+            result = mesh_cache.compute_registration(pat, i, variant)
+            runs.append([result.iterations, time.perf_counter() - start, result.error])
+        comparison[variant] = runs
+
+    return comparison
+
+
+def compare_icp_variants():
+    """Compares the icp variants across the cohort, every patient in its own process."""
+    with ProcessPoolExecutor() as executor:
+        all_comparisons = list(executor.map(patient_icp_comparison, constants.PATIENTS))
+
+    summary = {}
+    for variant in constants.ICP_VARIANTS:
+        iterations, seconds, errors = numpy.array([runs for comparison in all_comparisons
+                                                   for runs in comparison[variant]]).T
+        summary[variant] = [iterations.mean(), iterations.max(), seconds.sum(), errors.mean(), errors.max()]
+        print("{}: {:.1f} iterations on average ({:.0f} at most), {:.1f} s in total, mean squared residual {:.3f} mm2 "
+              "on average ({:.3f} at most)".format(variant, *summary[variant]))
+
+    return summary
+
+
+# compare_icp_variants()
 
 
 def write_computations_centroid(distances, averages, icp):
@@ -14,11 +110,11 @@ def write_computations_centroid(distances, averages, icp):
         for pat in constants.PATIENTS:
             print(pat)
             if icp:
-                dist = Project_2.compute_distances_after_icp_centroid(pat)
+                dist = registration_methods.compute_distances_after_icp_centroid(pat, patient_registrations(pat))
             else:
-                dist = Project_2.compute_distances_after_centering_centroid(pat)
+                dist = registration_methods.compute_distances_after_centering_centroid(pat)
 
-            prostate_bones, bladder, rectum = Project_2.compute_average_distances(dist)
+            prostate_bones, bladder, rectum = registration_methods.compute_average_distances(dist)
 
             all_dist.append(dist)
 
@@ -29,6 +125,32 @@ def write_computations_centroid(distances, averages, icp):
         json.dump(all_dist, dist_f)
 
 
+def verify_distances_centroid(distances, icp, tolerance=constants.DISTANCE_TOLERANCE):
+    """
+    Recomputes the centroid distances and compares them with the stored file, so a change of the mesh
+    representation (e.g. float32 vertices) does not silently change the results.
+    :param distances: stored distances file, e.g. computations_files/icp_distances_c.txt
+    :param icp: true for the icp distances, false for the prostate centring ones
+    :param tolerance: maximal allowed absolute difference in mm
+    :return: the largest difference found
+    """
+    with open(distances, "r") as dist_f:
+        stored = numpy.array(json.load(dist_f))
+
+    largest = 0
+    for i, pat in enumerate(constants.PATIENTS):
+        if icp:
+            dist = registration_methods.compute_distances_after_icp_centroid(pat, patient_registrations(pat))
+        else:
+            dist = registration_methods.compute_distances_after_centering_centroid(pat)
+
+        difference = numpy.abs(numpy.array(dist) - stored[i]).max()
+        largest = max(largest, difference)
+        assert difference <= tolerance, "patient {} differs by {} mm".format(pat, difference)
+
+    return largest
+
+
 # write_computations_centroid("icp_distances_c.txt", "icp_averages_c.txt", True)
 # write_computations_centroid("center_distances_c.txt", "center_averages_c.txt", False)
 
@@ -39,33 +161,26 @@ def write_computations_centroid(distances, averages, icp):
 #     all_movements_icp = json.load(icp_mov)
 
 
-def write_plan_center_points():
-    with open("computations_files/plan_center_points.txt", "w") as cent_points:
-        all_cent_p = []
-        for pat in constants.PATIENTS:
-            cent_p = []
-            for organ in ["bones", "prostate", "bladder", "rectum"]:
-                x1, y1, z1 = Project_2.find_center_of_mass(trimesh.load_mesh(
-                    constants.FILEPATH + "{}\\{}\\{}_plan.obj".format(pat, organ, organ)).bounds)
+def write_plan_index():
+    """Builds the plan index of every patient in its own process, the application then only loads the files."""
+    with ProcessPoolExecutor() as executor:
+        list(executor.map(plan_index.build, constants.PATIENTS))
+
 
-                cent_p.append((x1, y1, z1))
-            all_cent_p.append(cent_p)
-        json.dump(all_cent_p, cent_points)
+def write_sdf():
+    """Builds the signed distance fields of the plan organs of every patient in its own process."""
+    with ProcessPoolExecutor() as executor:
+        list(executor.map(sdf.build_all, [[patient] for patient in constants.PATIENTS]))
 
 
 def write_rotation_file():
     with open("computations_files/rotation_icp.txt", "w") as rots_file:
         all_rot = []
         for pat in constants.PATIENTS:
-            plan_bones = Project_2.import_obj([constants.FILEPATH + "{}\\bones\\bones_plan.obj".format(pat)])
             rot_x, rot_y, rot_z = [], [], []
             patient_rot = []
-            for i in range(1, 14):
-                bones = Project_2.import_obj([constants.FILEPATH + "{}\\bones\\bones{}.obj".format(pat, i)])
-                matrix, transformed, _ = trimesh.registration.icp(bones[0][0], plan_bones[0][0], scale=False)
-                rotation_m = numpy.array([matrix[0][:3], matrix[1][:3], matrix[2][:3]])
-
-                rotation_m = list(R.from_matrix(rotation_m).as_euler('xyz', degrees=True))
+            for result in patient_registrations(pat):
+                rotation_m = result.rotation
                 rot_x.append(rotation_m[0])
                 rot_y.append(rotation_m[1])
                 rot_z.append(rotation_m[2])
@@ -78,4 +193,53 @@ def write_rotation_file():
 
 # write_rotation_file()
 
-# write_plan_center_points()
+# write_plan_index()
+
+# write_sdf()
+
+
+def write_surface_metrics(metrics_file="computations_files/surface_metrics.txt"):
+    """Computes the surface-distance metrics of the whole cohort, every patient in its own process."""
+    with ProcessPoolExecutor() as executor:
+        all_metrics = list(executor.map(surface_metrics.patient_surface_metrics, constants.PATIENTS))
+
+    with open(metrics_file, "w") as metrics_f:
+        json.dump(all_metrics, metrics_f)
+
+
+# write_surface_metrics()
+
+
+def write_overlap_metrics(overlap_file="computations_files/overlap_metrics.txt"):
+    """Computes the Dice and Jaccard coefficients of the whole cohort, every patient in its own process."""
+    with ProcessPoolExecutor() as executor:
+        all_overlaps = list(executor.map(voxel_overlap.patient_overlap, constants.PATIENTS))
+
+    with open(overlap_file, "w") as overlap_f:
+        json.dump(all_overlaps, overlap_f)
+
+
+# write_overlap_metrics()
+
+
+def write_deformations(deformations_file="computations_files/deformations.txt"):
+    """Computes the mean deformations of the bladder and rectum of the whole cohort, every fraction in a process."""
+    all_deformations = deformation.cohort_deformations()
+
+    with open(deformations_file, "w") as deformations_f:
+        json.dump(all_deformations, deformations_f)
+
+
+# write_deformations()
+
+
+def write_fraction_pairs(pairs_file="computations_files/fraction_pairs.txt"):
+    """Computes the fraction-to-fraction residual matrices of the whole cohort, every patient in its own process."""
+    with ProcessPoolExecutor() as executor:
+        all_pairs = list(executor.map(fraction_pairs.patient_fraction_pairs, constants.PATIENTS))
+
+    with open(pairs_file, "w") as pairs_f:
+        json.dump(all_pairs, pairs_f)
+
+
+# write_fraction_pairs()
@@ -56,3 +56,84 @@ CONE_START = 0.9
 # which function we want to get rid of in the modebar
 MODEBAR = ["autoScale2d", "lasso2d", "select2d", "zoomOut2d", "zoomIn2d"]
 D3_MODEBAR = ["orbitRotation", "resetCameraDefault3d"]
+
+# mesh cache and speculative prefetching of the neighbouring timestamps
+CACHE_SIZE = 256
+PREFETCH_RADIUS = 2
+PREFETCH_WORKERS = 4
+
+# cell edge in mm of the vertex clustering used for the animation frames
+DECIMATION_CELL = 3.0
+
+# name prefix of the shared memory blocks published by mesh_store.py
+MESH_STORE_NAME = "rmvc_meshes"
+
+# allowed difference in mm between the recomputed and the stored distances
+DISTANCE_TOLERANCE = 0.01
+
+# registration methods, organs in the order of the heatmap cells and the surface-distance metrics
+METHODS = ["ICP", "Prostate Centring", "Organ Registration"]
+METHOD_TITLES = {"ICP": "ICP aligning", "Prostate Centring": "prostate centring",
+                 "Organ Registration": "organ registration"}
+ORGANS = ["Bones", "Prostate", "Bladder", "Rectum"]
+SURFACE_METRICS = ["Hausdorff", "Mean surface distance", "95th percentile"]
+
+# voxel overlap: edge of a voxel in mm, organs compared and how many plan grids are kept in memory
+VOXEL_PITCH = 1.0
+OVERLAP_ORGANS = ["Prostate", "Bladder", "Rectum"]
+OVERLAP_METRICS = ["Dice", "Jaccard"]
+PLAN_GRID_CACHE = 12
+
+# disk-backed cache of the figures, its directory and the maximal size in bytes
+FIGURE_CACHE_DIR = "figure_cache"
+FIGURE_CACHE_SIZE = 512 * 1024 * 1024
+
+# response compression of the server by flask-compress, smaller responses are sent as they are, and caching of the
+# static assets, which stays on without the compression
+COMPRESS_RESPONSES = True
+COMPRESS_MIN_SIZE = 1024
+STATIC_MAX_AGE = 7 * 24 * 60 * 60
+
+# how often in seconds the server checks the computations files for a new version, 0 turns the watcher off
+RELOAD_INTERVAL = 30
+
+# per-patient features of the plan organs (centroids, bounds, axes, area, volume and KD-trees) stored by plan_index.py
+PLAN_INDEX_DIR = "plan_index"
+
+# signed distance fields of the plan organs stored by sdf.py, the spacing of their grids and the margin around the
+# organs in mm
+SDF_DIR = "sdf"
+SDF_PITCH = 2.0
+SDF_MARGIN = 20.0
+
+# centroid definitions of centroid.py and the one used by the prostate centring RM and the centroid distances
+CENTROIDS = ["vertex", "area", "volume"]
+CENTROID = "vertex"
+
+# icp variants and the one used by the precompute, the 3D view and the slices
+ICP_VARIANTS = ["point-to-point", "point-to-plane"]
+ICP_VARIANT = "point-to-point"
+
+# deformable registration of the bladder and rectum by coherent point drift: kernel width in mm, regularisation, share
+# of outliers, number of subsampled points and the time limit in seconds of one organ, the heatmap metric of the mean
+# displacement lengths and the colourings of the 3D meshes
+DEFORMABLE_ORGANS = ["Bladder", "Rectum"]
+DEFORMATION_METRIC = "Mean deformation"
+COLOURINGS = ["Uniform", "Distance to plan", "Deformation"]
+CPD_BETA = 10.0
+CPD_LAMBDA = 2.0
+CPD_OUTLIERS = 0.1
+CPD_POINTS = 400
+CPD_TIME_LIMIT = 5.0
+
+# cohorts with more patients get the aggregated heatmaps: the rows of the zoom window are sent one by one only up to
+# HEATMAP_MAX_ROWS, more of them are binned, and at most HEATMAP_MAX_LABELS patient ids are shown
+LARGE_COHORT = 100
+HEATMAP_MAX_ROWS = 200
+HEATMAP_MAX_LABELS = 40
+
+# cohort statistics of cohort_statistics.py: percentiles of the distances, bootstrap resamples of the confidence
+# intervals and their level
+STATISTICS_PERCENTILES = [5, 25, 75, 95]
+BOOTSTRAP_RESAMPLES = 2000
+CONFIDENCE = 0.95
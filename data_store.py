@@ -0,0 +1,225 @@
+import os
+import json
+import hashlib
+import time
+import logging
+import threading
+import numpy as np
+from registration_methods import RegistrationResult
+from constants import FILEPATH, PATIENTS, TIMESTAMPS, METHODS, ORGANS, SURFACE_METRICS, OVERLAP_METRICS, \
+    OVERLAP_ORGANS, DEFORMABLE_ORGANS
+
+log = logging.getLogger(__name__)
+
+COMPUTATIONS_DIR = "computations_files/"
+
+# exists while a writer replaces a set of files which belong together, the dataset is not loaded meanwhile
+PUBLISHING_FILE = "publishing.lock"
+
+# the loaded dataset, None until it is needed for the first time
+_dataset = None
+_lock = threading.Lock()
+
+# functions called with the new dataset after it replaced the old one
+_listeners = []
+
+
+def data_version():
+    """
+    Hash of the names, sizes and modification times of the precomputed files and of the data location. The temporary
+    files of the writers are left out, and so are the files which were renamed while they were listed.
+    """
+    description = [FILEPATH]
+    for name in sorted(os.listdir(COMPUTATIONS_DIR)):
+        if name.endswith(".tmp") or name == PUBLISHING_FILE:
+            continue
+        try:
+            stat = os.stat(os.path.join(COMPUTATIONS_DIR, name))
+        except FileNotFoundError:
+            continue
+        description.append((name, stat.st_size, stat.st_mtime_ns))
+
+    return hashlib.sha1(json.dumps(description).encode()).hexdigest()[:16]
+
+
+def publishing():
+    """True while a writer replaces the files of a new version, see ingest.publish()."""
+    return os.path.exists(os.path.join(COMPUTATIONS_DIR, PUBLISHING_FILE))
+
+
+def load_cube(name, shape):
+    """
+    Loads a precomputed json file into a float array. Results which were not computed yet are NaN, so the graphs
+    using them stay empty instead of failing.
+    :param name: file name in the computations_files directory
+    :param shape: shape of the array, the first dimension may be -1 for any number of patients
+    :return: array of the given shape, with no patients if the first dimension is -1 and the file cannot be used
+    """
+    path = os.path.join(COMPUTATIONS_DIR, name)
+    empty = (0 if shape[0] == -1 else shape[0],) + tuple(shape[1:])
+    if not os.path.exists(path):
+        return np.full(empty, np.nan)
+
+    with open(path, "r") as cube_f:
+        cube = np.array(json.load(cube_f), dtype=float)
+
+    # e.g. written before a RM was added, the file has to be computed again
+    if cube.size != np.prod(shape) and (shape[0] != -1 or cube.size % np.prod(shape[1:]) != 0):
+        log.warning("%s has shape %s instead of %s, it is not used", name, cube.shape, shape)
+        return np.full(empty, np.nan)
+
+    return cube.reshape(shape)
+
+
+def load_averages(name):
+    """
+    Loads the averages file with three lines per patient.
+    :param name: file name in the computations_files directory
+    :return: array indexed by patient and organ, NaN if the file does not exist
+    """
+    path = os.path.join(COMPUTATIONS_DIR, name)
+    if not os.path.exists(path):
+        return np.full((len(PATIENTS), 3), np.nan)
+
+    with open(path, "r") as avrg_f:
+        return np.array(avrg_f.read().split(), dtype=float).reshape(-1, 3)
+
+
+def load_registrations(name="icp_registrations.txt"):
+    """
+    Loads the precomputed ICP registrations.
+    :param name: file name in the computations_files directory
+    :return: dictionary with RegistrationResult for every (patient, timestamp), empty if the file does not exist
+    """
+    path = os.path.join(COMPUTATIONS_DIR, name)
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, "r") as registrations_f:
+        stored = json.load(registrations_f)
+
+    registrations = {}
+    for patient, results in stored.items():
+        for timestamp, result in results.items():
+            result["matrix"] = np.array(result["matrix"])
+            registrations[(patient, timestamp)] = RegistrationResult(**result)
+
+    return registrations
+
+
+def load_organ_registrations(name="organ_registrations.txt"):
+    """
+    Loads the precomputed registrations of the organs to their plan organs.
+    :param name: file name in the computations_files directory
+    :return: dictionary with RegistrationResult for every (patient, organ, timestamp), empty if the file does not exist
+    """
+    path = os.path.join(COMPUTATIONS_DIR, name)
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, "r") as registrations_f:
+        stored = json.load(registrations_f)
+
+    registrations = {}
+    for patient, organs in stored.items():
+        for organ, results in organs.items():
+            for timestamp, result in results.items():
+                result["matrix"] = np.array(result["matrix"])
+                registrations[(patient, organ, timestamp)] = RegistrationResult(**result)
+
+    return registrations
+
+
+def load_dataset():
+    """
+    Loads all precomputed results. Distances, movements and rotations are indexed by patient first, the metric cubes
+    by patient and RM.
+    :return: dictionary of the arrays and the data version they were loaded from
+    """
+    if publishing():
+        raise ValueError("The computations files are being replaced")
+
+    patients, timestamps = len(PATIENTS), len(TIMESTAMPS)
+    version = data_version()
+    dataset = dict(version=version,
+                   distances_icp=load_cube("icp_distances_c.txt", (patients, 3, timestamps)),
+                   distances_center=load_cube("center_distances_c.txt", (patients, 3, timestamps)),
+                   averages_icp=load_averages("icp_averages_c.txt"),
+                   averages_center=load_averages("center_averages_c.txt"),
+                   distances_organ=load_cube("organ_distances_c.txt", (patients, 3, timestamps)),
+                   averages_organ=load_averages("organ_averages_c.txt"),
+                   rotations=load_cube("rotation_icp.txt", (patients, 3, timestamps)),
+                   movements_icp=load_cube("icp_movements.txt", (patients, 3, timestamps, 3)),
+                   movements_center=load_cube("center_movements.txt", (patients, 3, timestamps, 3)),
+                   surface_metrics=load_cube("surface_metrics.txt", (patients, len(METHODS), len(SURFACE_METRICS),
+                                                                     len(ORGANS), timestamps)),
+                   overlaps=load_cube("overlap_metrics.txt", (patients, len(METHODS), len(OVERLAP_METRICS),
+                                                              len(OVERLAP_ORGANS), timestamps)),
+                   fraction_pairs=load_cube("fraction_pairs.txt", (patients, len(METHODS), len(ORGANS), timestamps,
+                                                                   timestamps)),
+                   deformations=load_cube("deformations.txt", (patients, len(METHODS), len(DEFORMABLE_ORGANS),
+                                                               timestamps)),
+                   registrations=load_registrations(),
+                   organ_registrations=load_organ_registrations())
+
+    # the files changed while they were read, e.g. the precompute was still writing them
+    if data_version() != version or publishing():
+        raise ValueError("The computations files changed during loading")
+
+    return dataset
+
+
+def current():
+    """The loaded dataset, it is loaded on the first call. Callers keep the returned one for a whole request."""
+    global _dataset
+
+    with _lock:
+        if _dataset is None:
+            _dataset = load_dataset()
+        return _dataset
+
+
+def on_reload(listener):
+    """Registers a function called with the new dataset after each reload."""
+    _listeners.append(listener)
+
+
+def reload_if_changed():
+    """
+    Loads the new version of the computations files and swaps the dataset in one assignment, so the requests see
+    either the old or the new dataset. A dataset which fails to load is retried at the next check.
+    :return: true if the dataset was replaced
+    """
+    global _dataset
+
+    if publishing() or data_version() == current()["version"]:
+        return False
+
+    try:
+        dataset = load_dataset()
+    except (ValueError, OSError) as e:
+        log.warning("Reloading the computations files failed, keeping version %s: %s", current()["version"], e)
+        return False
+
+    _dataset = dataset
+    log.info("Loaded computations files version %s", dataset["version"])
+    for listener in _listeners:
+        listener(dataset)
+
+    return True
+
+
+def watch(interval):
+    """
+    Starts the thread which checks the computations files every interval seconds and reloads them off the request
+    path when they change.
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                reload_if_changed()
+            except Exception:
+                log.exception("Watching the computations files failed")
+
+    threading.Thread(target=run, name="data-watcher", daemon=True).start()
@@ -0,0 +1,48 @@
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import mesh_cache
+import registration_methods
+from constants import PATIENTS, TIMESTAMPS, METHODS, DEFORMABLE_ORGANS
+
+
+def fraction_displacements(patient, organ, timestamp, method):
+    """
+    Displacement field which deforms the organ aligned by the RM onto the plan organ.
+    :param patient: id of the patient
+    :param organ: bladder or rectum
+    :param timestamp: chosen timestamp
+    :param method: RM which aligns the organ before the deformation
+    :return: displacement of every vertex in mm, array of shape (N, 3)
+    """
+    aligned = mesh_cache.get_aligned_object(patient, organ, timestamp, method)[0]
+    plan = mesh_cache.get_object(patient, organ, "_plan")[0]
+
+    return registration_methods.cpd_deformable(aligned, plan)
+
+
+def mean_deformation(patient, organ, timestamp, method):
+    """Mean length of the displacements of the organ, the value of the deformation heatmap cell."""
+    return float(np.linalg.norm(fraction_displacements(patient, organ, timestamp, method), axis=1).mean())
+
+
+def _mean_deformation(job):
+    return mean_deformation(*job)
+
+
+def cohort_deformations(patients=PATIENTS, workers=None):
+    """
+    Computes the mean deformations of the deformable organs of the patients after every RM. Every fraction is
+    registered in its own process, as the registrations of one organ are independent of each other.
+    :param patients: ids of the patients
+    :param workers: number of processes, all processors by default
+    :return: 4d list indexed by patient, RM, organ and timestamp
+    """
+    jobs = list(itertools.product(patients, DEFORMABLE_ORGANS, TIMESTAMPS, METHODS))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        values = list(executor.map(_mean_deformation, jobs, chunksize=len(METHODS)))
+
+    # jobs are ordered by patient, organ, timestamp and RM
+    cube = np.array(values).reshape(len(patients), len(DEFORMABLE_ORGANS), len(TIMESTAMPS), len(METHODS))
+    return np.transpose(cube, (0, 3, 1, 2)).tolist()
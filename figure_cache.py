@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import plotly
+import plotly.io
+
+import constants
+import data_store
+from constants import FIGURE_CACHE_DIR, FIGURE_CACHE_SIZE
+
+log = logging.getLogger(__name__)
+
+# hit-rate metrics of this process
+hits, misses = 0, 0
+
+# bytes in the cache directory as far as this process knows, None until the directory is scanned; the figures written
+# by the other workers are counted at the next eviction
+_size = None
+_lock = threading.Lock()
+
+# raised when the figures change for the same inputs and settings, e.g. after a change of their layout
+CACHE_VERSION = 1
+
+
+def _fingerprint():
+    """Hash of the settings in constants.py, the cache version and the plotly version, which all shape the figures."""
+    settings = {name: value for name, value in vars(constants).items() if name.isupper()}
+    description = json.dumps([CACHE_VERSION, plotly.__version__, settings], sort_keys=True, default=str)
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+
+# figures cached by another configuration or version of the code are never hit
+FINGERPRINT = _fingerprint()
+
+
+def _prefix(version):
+    """Beginning of the keys of the figures of the data version, made by this configuration."""
+    return "{}-{}-".format(FINGERPRINT, version)
+
+
+def figure_key(name, inputs):
+    """
+    Key of the figure from the name of the graph and its normalized inputs.
+    :param name: name of the graph
+    :param inputs: json serializable inputs, they must already be reduced to what changes the figure
+    :return: key starting with the fingerprint and the data version, followed by the hash of the name and inputs
+    """
+    description = json.dumps([name, inputs], sort_keys=True, default=str)
+    return _prefix(data_store.current()["version"]) + hashlib.sha1(description.encode()).hexdigest()
+
+
+def get_or_create(name, inputs, builder):
+    """
+    Returns the cached figure or creates and caches it.
+    :param name: name of the graph
+    :param inputs: normalized inputs of the graph
+    :param builder: function without arguments creating the figure
+    :return: figure as a dictionary when it was cached, otherwise the created figure
+    """
+    global hits, misses, _size
+
+    path = os.path.join(FIGURE_CACHE_DIR, figure_key(name, inputs) + ".json")
+    try:
+        with open(path, "r") as figure_f:
+            figure = json.load(figure_f)
+        os.utime(path)
+    except (FileNotFoundError, ValueError):
+        figure = None
+
+    with _lock:
+        if figure is not None:
+            hits += 1
+        else:
+            misses += 1
+        if (hits + misses) % 100 == 0:
+            log.info("figure cache hit rate %.2f (%d hits, %d misses)", hit_rate(), hits, misses)
+
+    if figure is not None:
+        return figure
+
+    figure = builder()
+    os.makedirs(FIGURE_CACHE_DIR, exist_ok=True)
+    temporary = "{}.{}.tmp".format(path, threading.get_ident())
+    text = plotly.io.to_json(figure)
+    with open(temporary, "w") as figure_f:
+        figure_f.write(text)
+    os.replace(temporary, path)
+
+    # the directory is scanned only when the counted size exceeds the limit
+    with _lock:
+        if _size is not None:
+            _size += len(text)
+        full = _size is None or _size > FIGURE_CACHE_SIZE
+    if full:
+        evict()
+
+    return figure
+
+
+def clear(dataset=None):
+    """
+    Deletes the cached figures of the other data versions and configurations, which can never be hit again. The
+    figures which the other workers already cached for the new version are kept.
+    :param dataset: the new dataset, all figures are deleted without it
+    """
+    global _size
+
+    if not os.path.isdir(FIGURE_CACHE_DIR):
+        return
+    prefix = _prefix(dataset["version"]) if dataset is not None else None
+    for entry in os.scandir(FIGURE_CACHE_DIR):
+        if entry.name.endswith(".json") and (prefix is None or not entry.name.startswith(prefix)):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    with _lock:
+        _size = None
+
+
+data_store.on_reload(clear)
+
+
+def hit_rate():
+    """Ratio of the served figures which were taken from the cache."""
+    return hits / (hits + misses) if hits + misses else 0
+
+
+def evict(max_size=FIGURE_CACHE_SIZE):
+    """
+    Deletes the least recently used figures until the cache fits into 90 % of max_size bytes, so the directory is
+    scanned again only after a tenth of the cache was written, and counts the rest.
+    """
+    global _size
+
+    entries = []
+    for entry in os.scandir(FIGURE_CACHE_DIR):
+        if entry.name.endswith(".json"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= 0.9 * max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+    with _lock:
+        _size = total
@@ -0,0 +1,52 @@
+import numpy as np
+
+import mesh_cache
+import registration_methods
+from constants import TIMESTAMPS, METHODS, ORGANS
+
+
+def relative_matrices(matrices):
+    """
+    Composes the transformations of the fractions to the plan into the transformations between every pair of
+    fractions, so no additional registration is needed.
+    :param matrices: array of shape (N, 4, 4) with the transformations of the N fractions to the plan
+    :return: array of shape (N, N, 4, 4), the element [i, j] transforms the fraction j into the fraction i
+    """
+    return np.einsum("iab,jbc->ijac", np.linalg.inv(matrices), matrices)
+
+
+def pairwise_residuals(matrices, centers):
+    """
+    Distances between the organ centroid of every fraction and the centroid of every other fraction transformed into
+    its space.
+    :param matrices: array of shape (N, 4, 4) with the transformations of the fractions to the plan
+    :param centers: array of shape (N, 3) with the organ centroids in the fractions
+    :return: array of shape (N, N) with the residual distances
+    """
+    homogeneous = np.hstack([centers, np.ones((len(centers), 1))])
+    moved = np.einsum("ijab,jb->ija", relative_matrices(matrices), homogeneous)
+    moved = moved[..., :3] / moved[..., 3:]
+
+    return np.linalg.norm(moved - centers[:, np.newaxis], axis=-1)
+
+
+def patient_fraction_pairs(patient):
+    """
+    Computes the fraction-to-fraction residual matrices of every organ of the patient under every RM. The
+    transformations to the plan are taken from the mesh cache.
+    :param patient: id of the patient
+    :return: 4d list indexed by RM, organ and the two timestamps
+    """
+    centers = np.array([[registration_methods.find_center_of_mass(mesh_cache.get_object(patient, organ, t)[0])
+                         for t in TIMESTAMPS] for organ in ORGANS])
+    result = []
+
+    for method in METHODS:
+        method_result = []
+        for organ, organ_centers in zip(ORGANS, centers):
+            matrices = np.array([mesh_cache.get_matrix(patient, method, t, organ) for t in TIMESTAMPS],
+                                dtype=np.float64)
+            method_result.append(pairwise_residuals(matrices, organ_centers).tolist())
+        result.append(method_result)
+
+    return result
@@ -0,0 +1,156 @@
+import os
+import json
+import argparse
+import numpy as np
+
+import data_store
+import mesh_cache
+import organ_registration
+import registration_methods
+from constants import PATIENTS, TIMESTAMPS
+
+# how many fractions of every patient are already averaged, so a new one updates the averages in O(1)
+COUNTS_FILE = "fraction_counts.txt"
+
+
+def _read_json(name, default):
+    path = os.path.join(data_store.COMPUTATIONS_DIR, name)
+    if not os.path.exists(path):
+        return default
+
+    with open(path, "r") as json_f:
+        return json.load(json_f)
+
+
+def publish(texts):
+    """
+    Replaces the files together: all of them are written under temporary names first and renamed while the
+    publishing marker of data_store exists, so the server never loads a mix of the old and the new files.
+    :param texts: dictionary of the file names and their new contents
+    """
+    paths = {name: os.path.join(data_store.COMPUTATIONS_DIR, name) for name in texts}
+    for name, text in texts.items():
+        with open(paths[name] + ".tmp", "w") as out_f:
+            out_f.write(text)
+
+    marker = os.path.join(data_store.COMPUTATIONS_DIR, data_store.PUBLISHING_FILE)
+    open(marker, "w").close()
+    try:
+        for path in paths.values():
+            os.replace(path + ".tmp", path)
+    finally:
+        os.remove(marker)
+
+
+def _series(name, shape):
+    """Stored results as a list, patients added to PATIENTS since the file was written get empty (NaN) series."""
+    cube = data_store.load_cube(name, (-1,) + shape) if os.path.exists(
+        os.path.join(data_store.COMPUTATIONS_DIR, name)) else np.full((0,) + shape, np.nan)
+    missing = np.full((len(PATIENTS) - len(cube),) + shape, np.nan)
+
+    return np.concatenate([cube, missing]).tolist()
+
+
+def _averages(name):
+    path = os.path.join(data_store.COMPUTATIONS_DIR, name)
+    averages = data_store.load_averages(name) if os.path.exists(path) else np.full((0, 3), np.nan)
+
+    return np.concatenate([averages, np.full((len(PATIENTS) - len(averages), 3), np.nan)])
+
+
+def arrived_fractions(patient, distances):
+    """Timestamps whose bones mesh exists but which have no stored distances yet."""
+    series = distances[PATIENTS.index(patient)]
+    return [i for i in TIMESTAMPS if np.isnan(series[0][i - 1]) and os.path.exists(
+        registration_methods.obj_path(patient, "bones", i))]
+
+
+def ingest(patient, fractions=None):
+    """
+    Registers only the new fractions of the patient and appends their results to the stored distances, rotations and
+    registrations, including the registrations of the organs to their plan organs. The averages are updated with the
+    running mean instead of averaging the whole series again.
+    The running server picks the new files up at its next data version check.
+    :param patient: id of the patient
+    :param fractions: timestamps to ingest, by default the ones whose meshes arrived since the last ingestion
+    :return: the ingested timestamps
+    """
+    p = PATIENTS.index(patient)
+    distances_icp = _series("icp_distances_c.txt", (3, len(TIMESTAMPS)))
+    distances_center = _series("center_distances_c.txt", (3, len(TIMESTAMPS)))
+    rotations = _series("rotation_icp.txt", (1, 3, len(TIMESTAMPS)))
+    averages_icp, averages_center = _averages("icp_averages_c.txt"), _averages("center_averages_c.txt")
+    registrations = _read_json("icp_registrations.txt", {})
+    distances_organ = _series("organ_distances_c.txt", (3, len(TIMESTAMPS)))
+    averages_organ = _averages("organ_averages_c.txt")
+    organ_registrations = _read_json("organ_registrations.txt", {})
+    counts = _read_json(COUNTS_FILE, {})
+
+    if fractions is None:
+        fractions = arrived_fractions(patient, distances_icp)
+    if patient not in counts:
+        # files written by computations_file_writer.py hold complete series, their count is read only once
+        counts[patient] = int(np.count_nonzero(~np.isnan(distances_icp[p][0])))
+
+    # the organs of all new fractions are registered in one batch per organ
+    organ_results, organ_distances = organ_registration.patient_organ_registrations(patient, fractions) \
+        if fractions else ({}, [])
+
+    for f, i in enumerate(fractions):
+        result = mesh_cache.compute_registration(patient, i)
+        icp, center = registration_methods.fraction_distances_centroid(patient, i, result.matrix)
+
+        replaced = not np.isnan(distances_icp[p][0][i - 1])
+        if not replaced:
+            counts[patient] += 1
+        for distances, averages, new in [(distances_icp, averages_icp, icp), (distances_center, averages_center,
+                                                                              center)]:
+            for j in range(3):
+                old = distances[p][j][i - 1] if replaced else None
+                averages[p][j] = registration_methods.update_average(averages[p][j], counts[patient], new[j], old)
+                distances[p][j][i - 1] = float(new[j])
+
+        for j in range(3):
+            rotations[p][0][j][i - 1] = float(result.rotation[j])
+        registrations.setdefault(patient, {})[str(i)] = dict(result._asdict(),
+                                                             matrix=np.asarray(result.matrix).tolist())
+
+        # the organ distances may be missing for fractions with ICP results, so they are counted on their own
+        replaced = not np.isnan(distances_organ[p][0][i - 1])
+        count = int(np.count_nonzero(~np.isnan(distances_organ[p][0]))) + (0 if replaced else 1)
+        for j, organ in enumerate(organ_registration.ORGANS):
+            old = distances_organ[p][j][i - 1] if replaced else None
+            averages_organ[p][j] = registration_methods.update_average(averages_organ[p][j], count,
+                                                                       organ_distances[j][f], old)
+            distances_organ[p][j][i - 1] = float(organ_distances[j][f])
+            organ_result = organ_results[organ][f]
+            organ_registrations.setdefault(patient, {}).setdefault(organ, {})[str(i)] = dict(
+                organ_result._asdict(), matrix=np.asarray(organ_result.matrix).tolist())
+
+    publish({"icp_registrations.txt": json.dumps(registrations),
+             "rotation_icp.txt": json.dumps(rotations),
+             "icp_distances_c.txt": json.dumps(distances_icp),
+             "center_distances_c.txt": json.dumps(distances_center),
+             "icp_averages_c.txt": "".join("{}\n".format(value) for value in averages_icp.ravel()),
+             "center_averages_c.txt": "".join("{}\n".format(value) for value in averages_center.ravel()),
+             "organ_registrations.txt": json.dumps(organ_registrations),
+             "organ_distances_c.txt": json.dumps(distances_organ),
+             "organ_averages_c.txt": "".join("{}\n".format(value) for value in averages_organ.ravel()),
+             COUNTS_FILE: json.dumps(counts)})
+
+    return fractions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registers the newly arrived fractions of a patient and adds them "
+                                                 "to the computations files.")
+    parser.add_argument("patient", choices=PATIENTS, help="id of the patient")
+    parser.add_argument("--fractions", nargs="+", type=int, choices=TIMESTAMPS,
+                        help="timestamps to ingest, by default the ones without stored results")
+    args = parser.parse_args()
+
+    print("Patient {}: ingested fractions {}".format(args.patient, ingest(args.patient, args.fractions)))
+
+
+if __name__ == '__main__':
+    main()
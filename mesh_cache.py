@@ -0,0 +1,274 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import trimesh
+import registration_methods
+import mesh_store
+import organ_registration
+import deformation
+import plan_index
+import sdf
+import data_store
+from registration_methods import obj_path
+from constants import TIMESTAMPS, CACHE_SIZE, PREFETCH_RADIUS, PREFETCH_WORKERS, DECIMATION_CELL, CENTROID, \
+    ICP_VARIANT
+
+# every cache maps its key to a Future, so a callback asking for a value which is just being prefetched waits for the
+# running computation instead of starting the same one again
+_objects = OrderedDict()
+_registrations = OrderedDict()
+_matrices = OrderedDict()
+_aligned = OrderedDict()
+_decimated = OrderedDict()
+_displacements = OrderedDict()
+_surface_distances = OrderedDict()
+_meshes = OrderedDict()
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+
+def _cached(cache, key, builder):
+    """
+    Returns the cached value or computes it with the builder. Only the oldest entries are evicted.
+    :param cache: one of the module caches
+    :param key: key of the value
+    :param builder: function without arguments computing the value
+    :return: cached value
+    """
+    with _lock:
+        future = cache.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            cache[key] = future
+            if len(cache) > CACHE_SIZE:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+
+    if owner:
+        try:
+            future.set_result(builder())
+        except Exception as e:
+            with _lock:
+                cache.pop(key, None)
+            future.set_exception(e)
+
+    return future.result()
+
+
+def _clear_registered(dataset):
+    """Drops the values derived from the registrations of the old dataset after a reload."""
+    with _lock:
+        for cache in [_matrices, _aligned, _decimated, _displacements, _surface_distances, _meshes]:
+            cache.clear()
+
+
+data_store.on_reload(_clear_registered)
+
+
+def get_object(patient, organ, time_or_plan):
+    """
+    Imports the organ .obj file only once. If the mesh store was published, the arrays are read-only views into the
+    shared memory instead.
+    :param patient: id of the patient
+    :param organ: organ or bones
+    :param time_or_plan: chosen timestamp or _plan suffix
+    :return: [vertices, faces] of the organ, the vertices must not be changed in place
+    """
+    def builder():
+        shared = mesh_store.get(patient, organ, time_or_plan)
+        if shared is not None:
+            return shared
+        return registration_methods.import_obj([obj_path(patient, organ, time_or_plan)])[0]
+
+    vertices, faces = _cached(_objects, (patient, organ.lower(), str(time_or_plan)), builder)
+    return [vertices, faces]
+
+
+def get_plan_tree(patient, organ):
+    """KD-tree of the plan organ vertices from the plan index of the patient."""
+    return plan_index.get(patient, organ, "tree")
+
+
+def compute_registration(patient, time_or_plan, variant=ICP_VARIANT):
+    """Runs the selected icp variant of the bones in the timestamp against the plan bones, without caching."""
+    return registration_methods.register(get_object(patient, "bones", time_or_plan)[0], get_plan_tree(patient, "bones"),
+                                         plan_index.get(patient, "bones", "normals"), variant)
+
+
+def get_registration(patient, time_or_plan, variant=ICP_VARIANT):
+    """
+    Result of the single ICP run of the bones in the timestamp against the plan bones. Precomputed results from
+    computations_files/icp_registrations.txt are used when they exist, they are computed with ICP_VARIANT.
+    :param patient: id of the patient
+    :param time_or_plan: chosen timestamp or _plan suffix
+    :param variant: point-to-point or point-to-plane
+    :return: RegistrationResult
+    """
+    if time_or_plan == "_plan":
+        return registration_methods.RegistrationResult(np.identity(4), [0, 0, 0], [0, 0, 0], 0, 0)
+    precomputed = data_store.current()["registrations"]
+    if variant == ICP_VARIANT and (patient, str(time_or_plan)) in precomputed:
+        return precomputed[(patient, str(time_or_plan))]
+
+    return _cached(_registrations, (patient, str(time_or_plan), variant),
+                   lambda: compute_registration(patient, time_or_plan, variant))
+
+
+def get_organ_registration(patient, organ, time_or_plan, variant=ICP_VARIANT):
+    """
+    Result of the registration of the organ in the timestamp to its plan organ. A missing result is computed together
+    with the other timestamps of the organ. The bones are registered by the bone ICP.
+    :param patient: id of the patient
+    :param organ: organ or bones
+    :param time_or_plan: chosen timestamp or _plan suffix
+    :param variant: point-to-point or point-to-plane
+    :return: RegistrationResult
+    """
+    organ = organ.lower()
+    if time_or_plan == "_plan" or organ == "bones":
+        return get_registration(patient, time_or_plan, variant)
+    precomputed = data_store.current()["organ_registrations"]
+    if variant == ICP_VARIANT and (patient, organ, str(time_or_plan)) in precomputed:
+        return precomputed[(patient, organ, str(time_or_plan))]
+
+    results = _cached(_registrations, (patient, organ, variant),
+                      lambda: organ_registration.register_fractions(patient, organ, variant=variant))
+    return results[TIMESTAMPS.index(int(time_or_plan))]
+
+
+def get_icp_matrix(patient, time_or_plan):
+    """Transformation matrix of the ICP RM computed from the bones in the timestamp and the plan bones."""
+    return get_registration(patient, time_or_plan).matrix
+
+
+def get_centring_matrix(patient, time_or_plan, definition=CENTROID):
+    """
+    Translation matrix of the prostate centring RM computed from the prostate in the timestamp and the plan one.
+    :param definition: centroid definition: vertex, area or volume
+    """
+    def builder():
+        plan_center = registration_methods.organ_centroid(patient, "prostate", "_plan", definition)
+        if time_or_plan == "_plan":
+            return registration_methods.create_translation_matrix(plan_center, plan_center)
+        # both centroids come from the meshes trimesh loads, as the stored centring distances do
+        other_center = registration_methods.organ_centroid(patient, "prostate", time_or_plan, definition)
+        return registration_methods.create_translation_matrix(plan_center, other_center)
+
+    return _cached(_matrices, (patient, "Prostate Centring", str(time_or_plan), definition), builder)
+
+
+def get_matrix(patient, method, time_or_plan, organ="bones"):
+    """Transformation matrix of the selected RM, the organ registration has a different one for every organ."""
+    if "ICP" in method:
+        return get_icp_matrix(patient, time_or_plan)
+    if "Organ" in method:
+        return get_organ_registration(patient, organ, time_or_plan).matrix
+    return get_centring_matrix(patient, time_or_plan)
+
+
+def _method(method):
+    """The RM from METHODS, so every spelling of the method shares the cached values."""
+    if "ICP" in method:
+        return "ICP"
+    return "Organ Registration" if "Organ" in method else "Prostate Centring"
+
+
+def get_aligned_object(patient, organ, time_or_plan, method):
+    """
+    Imports the organ and aligns it to the plan with the selected RM.
+    :param patient: id of the patient
+    :param organ: organ or bones
+    :param time_or_plan: chosen timestamp or _plan suffix
+    :param method: ICP, prostate centring or organ registration
+    :return: [vertices, faces] of the aligned organ, the vertices must not be changed in place
+    """
+    def builder():
+        matrix = get_matrix(patient, method, time_or_plan, organ)
+        return registration_methods.vertices_transformation(matrix, [get_object(patient, organ, time_or_plan)])[0]
+
+    method = _method(method)
+    vertices, faces = _cached(_aligned, (patient, organ.lower(), str(time_or_plan), method), builder)
+    return [vertices, faces]
+
+
+def get_mesh(patient, organ, time_or_plan, method=None):
+    """
+    Trimesh of the organ, aligned by the RM if one is given. The same object is returned every time, so the slice
+    indexes built into its metadata by registration_methods.slice_index() are kept with it.
+    :param patient: id of the patient
+    :param organ: organ or bones
+    :param time_or_plan: chosen timestamp or _plan suffix
+    :param method: ICP, prostate centring, organ registration or None for the imported organ
+    :return: trimesh.Trimesh, it must not be changed in place
+    """
+    def builder():
+        if method is None:
+            vertices, faces = get_object(patient, organ, time_or_plan)
+        else:
+            vertices, faces = get_aligned_object(patient, organ, time_or_plan, method)
+        return trimesh.Trimesh(vertices, faces, process=False)
+
+    method = None if method is None else _method(method)
+    return _cached(_meshes, (patient, organ.lower(), str(time_or_plan), method), builder)
+
+
+def get_decimated_object(patient, organ, time_or_plan, method):
+    """Aligned organ simplified by vertex clustering, used for the animation frames."""
+    method = _method(method)
+    return _cached(_decimated, (patient, organ.lower(), str(time_or_plan), method),
+                   lambda: registration_methods.decimate(*get_aligned_object(patient, organ, time_or_plan, method),
+                                                         DECIMATION_CELL))
+
+
+def get_surface_distances(patient, organ, time_or_plan, method):
+    """
+    Distances of the vertices of the aligned organ to the plan organ surface, interpolated in its signed distance field.
+    :param patient: id of the patient
+    :param organ: organ or bones
+    :param time_or_plan: chosen timestamp or _plan suffix
+    :param method: ICP, prostate centring or organ registration
+    :return: distance of every vertex in mm, the array must not be changed in place
+    """
+    def builder():
+        return np.abs(sdf.distances(patient, organ, get_aligned_object(patient, organ, time_or_plan, method)[0]))
+
+    method = _method(method)
+    return _cached(_surface_distances, (patient, organ.lower(), str(time_or_plan), method), builder)
+
+
+def get_displacements(patient, organ, time_or_plan, method):
+    """
+    Deformation of the aligned organ onto the plan organ, see deformation.py.
+    :return: displacement of every vertex in mm, the array must not be changed in place
+    """
+    method = _method(method)
+    return _cached(_displacements, (patient, organ.lower(), str(time_or_plan), method),
+                   lambda: deformation.fraction_displacements(patient, organ, time_or_plan, method))
+
+
+def prefetch_neighbours(patient, timestamps, organs, methods):
+    """
+    Loads and aligns the organs of the timestamps around the selected ones in the background, so the following change
+    of the timestamp in the 3D graph or the slices is served from the cache. The nearest timestamps are submitted
+    first.
+    :param patient: id of the selected patient
+    :param timestamps: selected timestamps, the plan is left out
+    :param organs: organs which are shown
+    :param methods: RMs which the organs are shown aligned with
+    """
+    selected = [TIMESTAMPS.index(timestamp) for timestamp in timestamps if timestamp in TIMESTAMPS]
+    neighbours = ["_plan"]
+    for distance in range(PREFETCH_RADIUS + 1):
+        for timestamp_i in selected:
+            for i in [timestamp_i - distance, timestamp_i + distance]:
+                if 0 <= i < len(TIMESTAMPS) and TIMESTAMPS[i] not in neighbours:
+                    neighbours.append(TIMESTAMPS[i])
+
+    for timestamp in neighbours:
+        for method in methods:
+            for organ in organs:
+                _executor.submit(get_aligned_object, patient, organ, timestamp, method)
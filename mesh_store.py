@@ -0,0 +1,134 @@
+import os
+import json
+import threading
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+import registration_methods
+from constants import PATIENTS, TIMESTAMPS, MESH_STORE_NAME
+
+ORGANS = ["bones", "prostate", "bladder", "rectum"]
+ALIGNMENT = 64
+
+# blocks attached by this process and the parsed manifest, None until the first lookup
+_blocks = []
+_manifest = None
+_lock = threading.Lock()
+
+
+def _key(patient, organ, time_or_plan):
+    return "{}/{}/{}".format(patient, organ.lower(), time_or_plan)
+
+
+def _attach(name):
+    """
+    Attaches an existing shared memory block without letting this process destroy it at exit.
+    :param name: name of the block
+    :return: attached block
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before python 3.13 the resource tracker of an attaching process unlinks the block when the process ends
+        block = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":
+            resource_tracker.unregister(block._name, "shared_memory")
+        return block
+
+
+def publish(patients=PATIENTS):
+    """
+    Parses the meshes of the cohort and copies their vertices and faces into one shared memory block. The layout of
+    the block is written as json into a second block, which the workers read in attach().
+    :param patients: ids of the patients which are published
+    :return: the data and the manifest blocks, they exist only as long as the publishing process keeps them
+    """
+    arrays, manifest, offset = [], {}, 0
+    for patient in patients:
+        for organ in ORGANS:
+            for time_or_plan in ["_plan"] + TIMESTAMPS:
+                path = registration_methods.obj_path(patient, organ, time_or_plan)
+                if not os.path.exists(path):
+                    continue
+
+                vertices, faces = registration_methods.import_obj([path])[0]
+                entry = []
+                for array in [np.asarray(vertices), np.asarray(faces)]:
+                    entry.append([offset, list(array.shape), array.dtype.str])
+                    arrays.append((offset, array))
+                    offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+                manifest[_key(patient, organ, time_or_plan)] = entry
+
+    data = shared_memory.SharedMemory(name=MESH_STORE_NAME, create=True, size=max(offset, 1))
+    for start, array in arrays:
+        np.ndarray(array.shape, dtype=array.dtype, buffer=data.buf, offset=start)[...] = array
+
+    encoded = json.dumps(manifest).encode()
+    header = shared_memory.SharedMemory(name=MESH_STORE_NAME + "_manifest", create=True, size=len(encoded) + 8)
+    header.buf[:8] = len(encoded).to_bytes(8, "little")
+    header.buf[8:len(encoded) + 8] = encoded
+
+    return data, header
+
+
+def attach():
+    """
+    Attaches the published blocks once per process.
+    :return: manifest of the store, empty if no loader process published the meshes
+    """
+    global _manifest
+
+    with _lock:
+        if _manifest is None:
+            _manifest = {}
+            try:
+                header = _attach(MESH_STORE_NAME + "_manifest")
+            except FileNotFoundError:
+                return _manifest
+            try:
+                data = _attach(MESH_STORE_NAME)
+            except FileNotFoundError:
+                # e.g. the loader process ended between the two attachments, the meshes are read from the files
+                header.close()
+                return _manifest
+
+            length = int.from_bytes(bytes(header.buf[:8]), "little")
+            _manifest = json.loads(bytes(header.buf[8:length + 8]).decode())
+            _blocks.extend([header, data])
+
+    return _manifest
+
+
+def get(patient, organ, time_or_plan):
+    """
+    Read-only views of the published vertices and faces of the organ.
+    :param patient: id of the patient
+    :param organ: organ or bones
+    :param time_or_plan: chosen timestamp or _plan suffix
+    :return: [vertices, faces] or None if the organ is not in the store
+    """
+    entry = attach().get(_key(patient, organ, time_or_plan))
+    if entry is None:
+        return None
+
+    views = []
+    for offset, shape, dtype in entry:
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=_blocks[1].buf, offset=offset)
+        view.setflags(write=False)
+        views.append(view)
+
+    return views
+
+
+if __name__ == '__main__':
+    # the loader process, the workers of the application attach to the blocks while it is running
+    blocks = publish()
+    print("Published {} bytes of meshes, press Ctrl+C to unpublish.".format(blocks[0].size))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
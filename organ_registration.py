@@ -0,0 +1,133 @@
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+import mesh_cache
+import plan_index
+import registration_methods
+from constants import TIMESTAMPS, ICP_VARIANT
+
+# soft-tissue organs registered to their own plan organ, the bones keep the bone ICP
+ORGANS = ["prostate", "bladder", "rectum"]
+
+
+def _kabsch(points, targets, starts):
+    """Rigid transformations (N, 4, 4) minimizing the squared distances of the points of each of the N groups."""
+    counts = np.diff(np.append(starts, len(points)))[:, np.newaxis]
+    points_mean = np.add.reduceat(points, starts, axis=0) / counts
+    targets_mean = np.add.reduceat(targets, starts, axis=0) / counts
+    group = np.repeat(np.arange(len(starts)), counts.ravel())
+
+    covariance = np.add.reduceat(np.einsum("ij,ik->ijk", points - points_mean[group], targets - targets_mean[group]),
+                                 starts, axis=0)
+    u, _, vt = np.linalg.svd(covariance)
+    # no reflections, the last axis is flipped where the determinant is negative
+    flip = np.where(np.linalg.det(u @ vt) < 0, -1.0, 1.0)
+    u[:, :, 2] *= flip[:, np.newaxis]
+    rotations = np.transpose(u @ vt, (0, 2, 1))
+
+    steps = np.tile(np.identity(4), (len(starts), 1, 1))
+    steps[:, :3, :3] = rotations
+    steps[:, :3, 3] = targets_mean - np.einsum("nij,nj->ni", rotations, points_mean)
+
+    return steps
+
+
+def _point_to_plane(points, targets, normals, starts):
+    """Linearised point-to-plane steps (N, 4, 4) of the N groups, the 6x6 normal equations are solved at once."""
+    system = np.hstack([np.cross(points, normals), normals])
+    residuals = np.einsum("ij,ij->i", targets - points, normals)
+    lhs = np.add.reduceat(np.einsum("ij,ik->ijk", system, system), starts, axis=0)
+    rhs = np.add.reduceat(system * residuals[:, np.newaxis], starts, axis=0)
+    solutions = np.linalg.solve(lhs + 1e-12 * np.identity(6), rhs[..., np.newaxis])[..., 0]
+
+    steps = np.tile(np.identity(4), (len(starts), 1, 1))
+    steps[:, :3, :3] = Rotation.from_rotvec(solutions[:, :3]).as_matrix()
+    steps[:, :3, 3] = solutions[:, 3:]
+
+    return steps
+
+
+def batch_register(fractions, key_tree, key_normals=None, variant=ICP_VARIANT, threshold=1e-5, max_iterations=20):
+    """
+    Registers the vertices of all fractions of one organ to its plan organ at once. Every iteration queries the shared
+    KD-tree of the plan organ with the stacked vertices of all fractions and solves the steps of all of them in one
+    batch. A fraction stops moving when its error decreases less than the threshold.
+    :param fractions: vertices of the organ in every timestamp
+    :param key_tree: KD-tree of the plan organ vertices
+    :param key_normals: unit normals of the plan organ vertices, needed by point-to-plane
+    :param variant: point-to-point or point-to-plane
+    :param threshold: the iterations of a fraction stop when its error decreases less
+    :param max_iterations: maximal number of iterations
+    :return: RegistrationResult of every fraction, the error is the mean squared distance of the closest points
+    """
+    moved = np.vstack([np.asarray(vertices, dtype=np.float64) for vertices in fractions])
+    starts = np.cumsum([0] + [len(vertices) for vertices in fractions])[:-1]
+    counts = np.diff(np.append(starts, len(moved)))
+    group = np.repeat(np.arange(len(fractions)), counts)
+    key = key_tree.data
+
+    matrices = np.tile(np.identity(4), (len(fractions), 1, 1))
+    old_costs = np.full(len(fractions), np.inf)
+    iterations = np.zeros(len(fractions), dtype=int)
+    active = np.ones(len(fractions), dtype=bool)
+
+    for _ in range(max_iterations):
+        distances, closest = key_tree.query(moved, workers=-1)
+        costs = np.add.reduceat(distances ** 2, starts) / counts
+        active &= old_costs - costs >= threshold
+        old_costs = np.where(active, costs, old_costs)
+        if not active.any():
+            break
+
+        if variant == "point-to-plane":
+            steps = _point_to_plane(moved, key[closest], np.asarray(key_normals)[closest], starts)
+        else:
+            steps = _kabsch(moved, key[closest], starts)
+
+        # converged fractions keep their transformation
+        steps[~active] = np.identity(4)
+        moved = np.einsum("nij,nj->ni", steps[group, :3, :3], moved) + steps[group, :3, 3]
+        matrices = steps @ matrices
+        iterations += active
+
+    distances, _ = key_tree.query(moved, workers=-1)
+    errors = np.add.reduceat(distances ** 2, starts) / counts
+    results = []
+    for matrix, error, count in zip(matrices, errors, iterations):
+        rotation = list(Rotation.from_matrix(matrix[:3, :3]).as_euler('xyz', degrees=True))
+        results.append(registration_methods.RegistrationResult(matrix, rotation, list(matrix[:3, 3]), float(error),
+                                                               int(count)))
+
+    return results
+
+
+def register_fractions(patient, organ, timestamps=TIMESTAMPS, variant=ICP_VARIANT):
+    """Registrations of the organ in the timestamps to the plan organ, computed in one batch."""
+    fractions = [mesh_cache.get_object(patient, organ, t)[0] for t in timestamps]
+    return batch_register(fractions, plan_index.get(patient, organ, "tree"),
+                          plan_index.get(patient, organ, "normals"), variant)
+
+
+def patient_organ_registrations(patient, timestamps=TIMESTAMPS):
+    """
+    Registers every soft-tissue organ of the patient to its plan organ and measures the distances of the centroids
+    which remain after the registration.
+    :param patient: id of the patient
+    :param timestamps: timestamps to register, all of them by default
+    :return: registrations indexed by organ and the position of the timestamp in timestamps, 2d list of distances in
+    order: prostate, bladder, rectum
+    """
+    registrations, distances = {}, []
+    for organ in ORGANS:
+        results = register_fractions(patient, organ, timestamps)
+        plan_center = registration_methods.organ_centroid(patient, organ, "_plan")
+        organ_distances = []
+        for t, result in zip(timestamps, results):
+            center = registration_methods.organ_centroid(patient, organ, t)
+            moved = registration_methods.vertices_transformation(result.matrix, [[[center]]])
+            organ_distances.append(np.linalg.norm(plan_center - np.array(moved)))
+
+        registrations[organ] = results
+        distances.append(organ_distances)
+
+    return registrations, distances
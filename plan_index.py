@@ -0,0 +1,110 @@
+import os
+import pickle
+import threading
+import numpy as np
+import trimesh
+from scipy.spatial import cKDTree
+
+import centroid
+import registration_methods
+from constants import PATIENTS, PLAN_INDEX_DIR
+
+ORGANS = ["bones", "prostate", "bladder", "rectum"]
+
+# stored indexes of an older version are rebuilt, it changes with the set of features
+INDEX_VERSION = 3
+
+# feature holding the centroid of every definition of centroid.py
+CENTROID_FEATURES = {"vertex": "centroid", "area": "area_centroid", "volume": "volume_centroid"}
+
+# indexes loaded by this process
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _sources(patient):
+    """Sizes and modification times of the plan meshes, a changed mesh makes the stored index stale."""
+    sources = {}
+    for organ in ORGANS:
+        stat = os.stat(registration_methods.obj_path(patient, organ, "_plan"))
+        sources[organ] = (stat.st_size, stat.st_mtime_ns)
+
+    return sources
+
+
+def organ_features(patient, organ):
+    """
+    Computes the features of one plan organ. The centroids are computed from the mesh trimesh loads, as the stored
+    distances always were, the KD-tree and the vertex normals from the mesh of import_obj, which the registrations and
+    metrics query.
+    :param patient: id of the patient
+    :param organ: organ or bones
+    :return: dictionary of the features
+    """
+    path = registration_methods.obj_path(patient, organ, "_plan")
+    mesh = trimesh.load_mesh(path)
+    vertices, faces = np.asarray(mesh.vertices, dtype=np.float64), np.asarray(mesh.faces)
+    imported = registration_methods.import_obj([path])[0]
+
+    # principal axes of the vertices as rows, from the largest variance
+    variances, axes = np.linalg.eigh(np.cov(vertices.T))
+
+    return dict(centroid=centroid.centroid(vertices, faces, "vertex"),
+                area_centroid=centroid.centroid(vertices, faces, "area"),
+                volume_centroid=centroid.centroid(vertices, faces, "volume"),
+                bounds=np.array(mesh.bounds),
+                axes=axes.T[::-1],
+                area=float(mesh.area),
+                volume=float(abs(mesh.volume)),
+                tree=cKDTree(np.asarray(imported[0], dtype=np.float64)),
+                normals=np.asarray(trimesh.Trimesh(*imported, process=False).vertex_normals))
+
+
+def build(patient):
+    """Computes the index of all plan organs of the patient and stores it into PLAN_INDEX_DIR."""
+    index = dict(version=INDEX_VERSION, sources=_sources(patient),
+                 organs={organ: organ_features(patient, organ) for organ in ORGANS})
+
+    os.makedirs(PLAN_INDEX_DIR, exist_ok=True)
+    path = os.path.join(PLAN_INDEX_DIR, "{}.pkl".format(patient))
+    temporary = "{}.{}.tmp".format(path, threading.get_ident())
+    with open(temporary, "wb") as index_f:
+        pickle.dump(index, index_f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+    return index
+
+
+def _load(patient):
+    path = os.path.join(PLAN_INDEX_DIR, "{}.pkl".format(patient))
+    try:
+        with open(path, "rb") as index_f:
+            index = pickle.load(index_f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return build(patient)
+
+    if index.get("version") != INDEX_VERSION or index["sources"] != _sources(patient):
+        return build(patient)
+    return index
+
+
+def get(patient, organ, feature):
+    """
+    Feature of the plan organ. The index of the patient is read from its file on the first use in the process and
+    built only if the file is missing or older than the plan meshes.
+    :param patient: id of the patient
+    :param organ: organ or bones
+    :param feature: centroid, area_centroid, volume_centroid, bounds, axes, area, volume, tree or normals
+    :return: value of the feature, arrays must not be changed in place
+    """
+    with _lock:
+        if patient not in _indexes:
+            _indexes[patient] = _load(patient)
+
+    return _indexes[patient]["organs"][organ.lower()][feature]
+
+
+def build_all(patients=PATIENTS):
+    """Builds the indexes of the cohort, e.g. before the application starts."""
+    for patient in patients:
+        build(patient)
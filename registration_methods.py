@@ -1,62 +1,300 @@
+import time
 import numpy as np
 import trimesh.registration
 import pywavefront
+from collections import namedtuple
+from scipy.spatial import cKDTree
 from scipy.spatial.transform import Rotation
-from constants import FILEPATH
+import centroid
+import plan_index
+from constants import FILEPATH, CENTROID, ICP_VARIANT, ICP_VARIANTS, CPD_BETA, CPD_LAMBDA, CPD_OUTLIERS, \
+    CPD_POINTS, CPD_TIME_LIMIT
+
+# everything one ICP run gives: 4x4 matrix, euler angles in degrees (xyz), translation, residual error (mean squared
+# distance of the closest points) and the number of iterations
+RegistrationResult = namedtuple("RegistrationResult", ["matrix", "rotation", "translation", "error", "iterations"])
+
+
+def obj_path(patient, organ, time_or_plan):
+    """Path of the .obj file of the organ in the given timestamp or with the _plan suffix."""
+    return FILEPATH + "{}\\{}\\{}{}.obj".format(patient, organ.lower(), organ.lower(), time_or_plan)
 
 
 def import_obj(files):
-    """Create a list of vertices and faces from the .obj files."""
+    """Create a list of float32 vertices and int32 faces from the .obj files."""
     object_list = []
 
     for name in files:
         organ = pywavefront.Wavefront(name, collect_faces=True)
-        object_list.append([organ.vertices, organ.mesh_list[0].faces])
+        object_list.append([np.asarray(organ.vertices, dtype=np.float32),
+                            np.asarray(organ.mesh_list[0].faces, dtype=np.int32)])
 
     return object_list
 
 
-def icp_transformation_matrix(other, key):
-    """Create transformation matrix using icp algorithm from trimesh library."""
-    matrix, transformed, _ = trimesh.registration.icp(other, key, scale=False)
-    rotation_m = np.array([matrix[0][:3], matrix[1][:3], matrix[2][:3]])
+def icp_registration(other, key, key_tree=None, threshold=1e-5, max_iterations=20):
+    """
+    Registers the points to the key points with the icp algorithm. It is the loop of trimesh.registration.icp, which
+    also reports the number of iterations. The registration runs in float64.
+    :param other: points which are moved
+    :param key: points which stay in place
+    :param key_tree: KD-tree of the key points, built if it is not given
+    :param threshold: the iterations stop when the error decreases less
+    :param max_iterations: maximal number of iterations
+    :return: RegistrationResult
+    """
+    other, key = np.asarray(other, dtype=np.float64), np.asarray(key, dtype=np.float64)
+    key_tree = cKDTree(key) if key_tree is None else key_tree
+    matrix, old_cost, cost, iterations = np.identity(4), np.inf, np.inf, 0
+
+    for iterations in range(1, max_iterations + 1):
+        _, closest = key_tree.query(other)
+        step, other, cost = trimesh.registration.procrustes(other, key[closest], scale=False)
+        matrix = step @ matrix
+        if old_cost - cost < threshold:
+            break
+        old_cost = cost
+
+    rotation = list(Rotation.from_matrix(matrix[:3, :3]).as_euler('xyz', degrees=True))
+    translation = list(matrix[:3, 3])
+
+    return RegistrationResult(matrix, rotation, translation, float(cost), iterations)
+
+
+def icp_point_to_plane(other, key, key_normals, key_tree=None, threshold=1e-5, max_iterations=20):
+    """
+    Registers the points to the key surface by minimizing the distances to the tangent planes of the closest key
+    points. Every iteration solves the least squares of all points at once, linearised for small rotations.
+    The reported error is the mean squared distance of the closest points, as in icp_registration.
+    :param other: points which are moved
+    :param key: points which stay in place
+    :param key_normals: unit normals of the key points
+    :param key_tree: KD-tree of the key points, built if it is not given
+    :param threshold: the iterations stop when the point-to-plane error decreases less
+    :param max_iterations: maximal number of iterations
+    :return: RegistrationResult
+    """
+    other, key = np.asarray(other, dtype=np.float64), np.asarray(key, dtype=np.float64)
+    key_normals = np.asarray(key_normals, dtype=np.float64)
+    key_tree = cKDTree(key) if key_tree is None else key_tree
+    matrix, old_cost, iterations = np.identity(4), np.inf, 0
+
+    for iterations in range(1, max_iterations + 1):
+        _, closest = key_tree.query(other)
+        normals = key_normals[closest]
+        system = np.hstack([np.cross(other, normals), normals])
+        residuals = np.einsum("ij,ij->i", key[closest] - other, normals)
+        solution = np.linalg.lstsq(system, residuals, rcond=None)[0]
+
+        step = np.identity(4)
+        step[:3, :3] = Rotation.from_rotvec(solution[:3]).as_matrix()
+        step[:3, 3] = solution[3:]
+        other = other @ step[:3, :3].T + step[:3, 3]
+        matrix = step @ matrix
+
+        cost = np.mean(np.einsum("ij,ij->i", key[closest] - other, normals) ** 2)
+        if old_cost - cost < threshold:
+            break
+        old_cost = cost
+
+    distances, _ = key_tree.query(other)
+    rotation = list(Rotation.from_matrix(matrix[:3, :3]).as_euler('xyz', degrees=True))
+    translation = list(matrix[:3, 3])
 
-    # translation_m and rotation_m were used and can be used individually, however we currently use only the matrix
-    translation_m = np.array([matrix[0][3], matrix[1][3], matrix[2][3]])
-    rotation_m = list(Rotation.from_matrix(rotation_m).as_euler('xyz', degrees=True))
+    return RegistrationResult(matrix, rotation, translation, float(np.mean(distances ** 2)), iterations)
 
-    return matrix
+
+def register(other, key_tree, key_normals=None, variant=ICP_VARIANT):
+    """
+    Rigid registration of the points to the key points with the selected icp variant.
+    :param other: points which are moved
+    :param key_tree: KD-tree of the key points
+    :param key_normals: unit normals of the key points, needed by point-to-plane
+    :param variant: point-to-point or point-to-plane
+    :return: RegistrationResult
+    """
+    if variant == "point-to-point":
+        return icp_registration(other, key_tree.data, key_tree)
+    if variant == "point-to-plane":
+        return icp_point_to_plane(other, key_tree.data, key_normals, key_tree)
+    raise ValueError("Unknown icp variant {}, expected one of {}".format(variant, ICP_VARIANTS))
+
+
+def _gaussian_kernel(points, centres, beta):
+    squared = np.sum((points[:, np.newaxis, :] - centres[np.newaxis, :, :]) ** 2, axis=2)
+    return np.exp(-squared / (2 * beta ** 2))
+
+
+def _subsample(points, count, rng):
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) <= count:
+        return points
+    return points[np.sort(rng.choice(len(points), count, replace=False))]
+
+
+def cpd_deformable(other, key, beta=CPD_BETA, lam=CPD_LAMBDA, outliers=CPD_OUTLIERS, points=CPD_POINTS,
+                   time_limit=CPD_TIME_LIMIT, threshold=1e-5, max_iterations=100, seed=0):
+    """
+    Non-rigid registration of the points to the key points by coherent point drift. The drift is a sum of gaussian
+    kernels centred in a random subsample of the points and fitted to a subsample of the key points, so one iteration
+    costs O(points^2) regardless of the size of the meshes, and the iterations stop after the time limit.
+    :param other: points which are moved, e.g. the organ in a timestamp
+    :param key: key points, e.g. the plan organ
+    :param beta: width of the kernel in mm, larger values give smoother fields
+    :param lam: regularisation of the drift relative to the unit size of the key points, larger values give smaller
+    displacements
+    :param outliers: expected share of the points without a counterpart, from 0 to 1
+    :param points: number of the subsampled points and key points
+    :param time_limit: the iterations stop after this many seconds
+    :param threshold: the iterations stop when the variance changes less
+    :param max_iterations: maximal number of iterations
+    :param seed: seed of the subsampling, the same seed gives the same field
+    :return: displacement of every point in mm as an array of shape (N, 3)
+    """
+    start = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    key = np.asarray(key, dtype=np.float64)
+
+    # both point sets are moved to the origin and scaled to the unit size of the key points, as the parameters expect
+    mean = key.mean(axis=0)
+    scale = np.sqrt(np.mean(np.sum((key - mean) ** 2, axis=1)))
+    other = (np.asarray(other, dtype=np.float64) - mean) / scale
+    moved = _subsample(other, points, rng)
+    key = _subsample((key - mean) / scale, points, rng)
+    beta = beta / scale
+    m, n, d = len(moved), len(key), 3
+
+    kernel = _gaussian_kernel(moved, moved, beta)
+    weights = np.zeros((m, d))
+    deformed = moved.copy()
+    variance = np.sum((key[np.newaxis, :, :] - moved[:, np.newaxis, :]) ** 2) / (d * m * n)
+
+    for _ in range(max_iterations):
+        # E-step: posterior probabilities of the correspondences, the uniform term absorbs the outliers
+        squared = np.sum((key[np.newaxis, :, :] - deformed[:, np.newaxis, :]) ** 2, axis=2)
+        probabilities = np.exp(-squared / (2 * variance))
+        uniform = (2 * np.pi * variance) ** (d / 2) * outliers / (1 - outliers) * m / n
+        probabilities /= np.sum(probabilities, axis=0) + max(uniform, np.finfo(float).eps)
+        p1, pt1, px = probabilities.sum(axis=1), probabilities.sum(axis=0), probabilities @ key
+
+        # M-step: kernel weights of the drift and the new variance
+        weights = np.linalg.solve(p1[:, np.newaxis] * kernel + lam * variance * np.identity(m),
+                                  px - p1[:, np.newaxis] * moved)
+        deformed = moved + kernel @ weights
+        old_variance = variance
+        variance = (pt1 @ np.sum(key ** 2, axis=1) - 2 * np.sum(px * deformed) +
+                    p1 @ np.sum(deformed ** 2, axis=1)) / (p1.sum() * d)
+        variance = max(variance, 1e-8)
+
+        if abs(old_variance - variance) < threshold or time.perf_counter() - start > time_limit:
+            break
+
+    # the drift is defined everywhere, so it is evaluated in every point of the full mesh in blocks
+    displacements = np.empty_like(other)
+    for i in range(0, len(other), 4096):
+        displacements[i:i + 4096] = _gaussian_kernel(other[i:i + 4096], moved, beta) @ weights
+
+    return displacements * scale
+
+
+def icp_transformation_matrix(other, key):
+    """Create transformation matrix using icp algorithm."""
+    return icp_registration(other, key).matrix
 
 
 def vertices_transformation(matrix, object_list):
-    """Apply transformation matrix to every vertex of the objects vertices."""
+    """
+    Apply transformation matrix to every vertex of the objects vertices. The product is computed in float64,
+    float32 vertices stay float32 afterwards.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+
     for i in range(len(object_list)):
-        transformed_vertices = []
-        vertices = object_list[i][0]
+        vertices = np.asarray(object_list[i][0])
+        dtype = np.float32 if vertices.dtype == np.float32 else np.float64
 
-        for vertex in vertices:
-            transformed_vertex = list(vertex)
-            transformed_vertex.append(1)
-            transformed_vertex = np.matmul(matrix, np.array(transformed_vertex).T)
-            transformed_vertex /= transformed_vertex[-1]
-            transformed_vertices.append(tuple(transformed_vertex[:3]))
-        object_list[i][0] = np.array(transformed_vertices)
+        transformed = vertices.astype(np.float64) @ matrix[:3, :3].T + matrix[:3, 3]
+        transformed /= (vertices.astype(np.float64) @ matrix[3, :3] + matrix[3, 3])[:, np.newaxis]
+        object_list[i][0] = transformed.astype(dtype, copy=False)
 
     return object_list
 
 
-def find_center_of_mass(vertices):
-    """Find the centroid as sum of the vertices divided by their count."""
-    center_x, center_y, center_z = 0, 0, 0
+def decimate(vertices, faces, cell_size):
+    """
+    Simplifies the mesh by vertex clustering: vertices in the same cubic cell are merged into their average and the
+    faces which collapsed are removed.
+    :param vertices: vertices of the mesh
+    :param faces: faces of the mesh
+    :param cell_size: edge of the cell in mm
+    :return: decimated float32 vertices and int32 faces
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    cells = np.floor(vertices / cell_size).astype(np.int64)
+    _, inverse = np.unique(cells, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    counts = np.bincount(inverse)
+    merged = np.column_stack([np.bincount(inverse, weights=vertices[:, axis]) / counts for axis in range(3)])
+
+    faces = inverse[np.asarray(faces)]
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+
+    return merged.astype(np.float32), faces[np.sort(first)].astype(np.int32)
+
+
+def slice_index(mesh, axis):
+    """
+    Interval index of the triangle extents along the axis, built once and kept in the mesh metadata. The extent of
+    the mesh is split into buckets about as wide as the longest triangle extent, and every bucket lists the faces
+    which reach into it, in the CSR layout of bucket offsets and face indices.
+    :param mesh: trimesh.Trimesh
+    :param axis: 0, 1 or 2
+    :return: lower bound and width of the buckets, offsets, face indices and the face extents
+    """
+    indexes = mesh.metadata.setdefault("slice_index", {})
+    if axis in indexes:
+        return indexes[axis]
+
+    coordinates = np.asarray(mesh.vertices)[np.asarray(mesh.faces), axis]
+    lows, highs = coordinates.min(axis=1), coordinates.max(axis=1)
+    lower, extent = lows.min(), highs.max() - lows.min()
+    width = max(float(np.max(highs - lows)), extent / max(len(lows), 1), 1e-9)
+
+    first = ((lows - lower) // width).astype(np.int64)
+    last = ((highs - lower) // width).astype(np.int64)
+    spans = last - first + 1
+    faces = np.repeat(np.arange(len(lows)), spans)
+    buckets = np.repeat(first - np.cumsum(spans) + spans, spans) + np.arange(len(faces))
+    order = np.argsort(buckets, kind="stable")
+    offsets = np.searchsorted(buckets[order], np.arange(last.max(initial=0) + 2))
+
+    indexes[axis] = lower, width, offsets, faces[order], lows, highs
+    return indexes[axis]
+
+
+def slice_faces(mesh, axis, position):
+    """
+    Faces of the mesh which the plane perpendicular to the axis in the position may intersect, read from the bucket of
+    the position, so the cost depends on the number of faces near the plane only.
+    :param mesh: trimesh.Trimesh
+    :param axis: 0, 1 or 2
+    :param position: coordinate of the plane on the axis
+    :return: indices of the faces
+    """
+    lower, width, offsets, faces, lows, highs = slice_index(mesh, axis)
+    bucket = int((position - lower) // width)
+    if bucket < 0 or bucket >= len(offsets) - 1:
+        return np.empty(0, dtype=np.int64)
 
-    for x, y, z in vertices:
-        center_x += x
-        center_y += y
-        center_z += z
+    candidates = faces[offsets[bucket]:offsets[bucket + 1]]
+    return candidates[(lows[candidates] <= position) & (highs[candidates] >= position)]
 
-    center_x /= len(vertices)
-    center_y /= len(vertices)
-    center_z /= len(vertices)
+
+def find_center_of_mass(vertices):
+    """Find the centroid as sum of the vertices divided by their count, see centroid.py for the other definitions."""
+    center_x, center_y, center_z = np.asarray(vertices, dtype=np.float64).mean(axis=0)
 
     return center_x, center_y, center_z
 
@@ -69,33 +307,45 @@ def create_translation_matrix(center, other_point):
             [0, 0, 0, 1]]
 
 
-def compute_distances_after_icp_centroid(patient):
+def organ_centroid(patient, organ, time_or_plan, definition=CENTROID):
+    """
+    Centroid of the organ mesh as loaded by trimesh, the plan ones are read from the plan index.
+    :param definition: vertex, area or volume, see centroid.batch_centroids()
+    """
+    if time_or_plan == "_plan":
+        return plan_index.get(patient, organ, plan_index.CENTROID_FEATURES[definition])
+
+    mesh = trimesh.load_mesh(obj_path(patient, organ, time_or_plan))
+    return centroid.centroid(mesh.vertices, mesh.faces, definition)
+
+
+def compute_distances_after_icp_centroid(patient, registrations=None, definition=CENTROID):
     """
     Compute distances between aligned organs and their equivalent plan organs. Organs were aligned according to the
     icp transformation matrix computed from plan bones and bones in different timestamps.
+    :param registrations: RegistrationResult of every timestamp, the icp runs here if they are not given
+    :param definition: centroid definition: vertex, area or volume
     :return: 2d list of distances in order: prostate, bladder, rectum
     """
-    plan_prostate_center = find_center_of_mass(trimesh.load_mesh(
-        FILEPATH + "{}\\prostate\\prostate_plan.obj".format(patient)).vertices)
-    plan_bladder_center = find_center_of_mass(trimesh.load_mesh(
-        FILEPATH + "{}\\bladder\\bladder_plan.obj".format(patient)).vertices)
-    plan_rectum_center = find_center_of_mass(trimesh.load_mesh(
-        FILEPATH + "{}\\rectum\\rectum_plan.obj".format(patient)).vertices)
+    plan_prostate_center = organ_centroid(patient, "prostate", "_plan", definition)
+    plan_bladder_center = organ_centroid(patient, "bladder", "_plan", definition)
+    plan_rectum_center = organ_centroid(patient, "rectum", "_plan", definition)
 
     distances = [[], [], []]
-    plan_bone = import_obj([FILEPATH + "{}\\bones\\bones_plan.obj".format(patient)])
+    plan_tree = plan_index.get(patient, "bones", "tree") if registrations is None else None
+    plan_normals = plan_index.get(patient, "bones", "normals") if registrations is None else None
     keys = [np.array(plan_prostate_center), np.array(plan_bladder_center), np.array(plan_rectum_center)]
 
     for i in range(1, 14):
-        bone = import_obj([FILEPATH + "{}\\bones\\bones{}.obj".format(patient, i)])
-        transform_matrix = icp_transformation_matrix(bone[0][0], plan_bone[0][0])
-
-        prostate = np.array(find_center_of_mass(trimesh.load_mesh(
-            FILEPATH + "{}\\prostate\\prostate{}.obj".format(patient, i)).vertices))
-        bladder = np.array(find_center_of_mass(trimesh.load_mesh(
-            FILEPATH + "{}\\bladder\\bladder{}.obj".format(patient, i)).vertices))
-        rectum = np.array(find_center_of_mass(trimesh.load_mesh(
-            FILEPATH + "{}\\rectum\\rectum{}.obj".format(patient, i)).vertices))
+        if registrations is None:
+            bone = import_obj([FILEPATH + "{}\\bones\\bones{}.obj".format(patient, i)])
+            transform_matrix = register(bone[0][0], plan_tree, plan_normals).matrix
+        else:
+            transform_matrix = registrations[i - 1].matrix
+
+        prostate = organ_centroid(patient, "prostate", i, definition)
+        bladder = organ_centroid(patient, "bladder", i, definition)
+        rectum = organ_centroid(patient, "rectum", i, definition)
         organs = [prostate, bladder, rectum]
 
         for j in range(3):
@@ -105,33 +355,26 @@ def compute_distances_after_icp_centroid(patient):
     return distances
 
 
-def compute_distances_after_centering_centroid(patient):
+def compute_distances_after_centering_centroid(patient, definition=CENTROID):
     """
     Compute distances between aligned organs and their equivalent plan organs. Organs were aligned according to the
     prostate centring translation matrix computed from plan prostate and prostate in different timestamps.
+    :param definition: centroid definition: vertex, area or volume
     :return: 2d list of distances in order: bones, bladder, rectum
     """
-    plan_prostate_center = find_center_of_mass(trimesh.load_mesh(
-        FILEPATH + "{}\\prostate\\prostate_plan.obj".format(patient)).vertices)
-    plan_bladder_center = find_center_of_mass(trimesh.load_mesh(
-        FILEPATH + "{}\\bladder\\bladder_plan.obj".format(patient)).vertices)
-    plan_rectum_center = find_center_of_mass(trimesh.load_mesh(
-        FILEPATH + "{}\\rectum\\rectum_plan.obj".format(patient)).vertices)
-    plan_bones_center = find_center_of_mass(trimesh.load_mesh(
-        FILEPATH + "{}\\bones\\bones_plan.obj".format(patient)).vertices)
+    plan_prostate_center = organ_centroid(patient, "prostate", "_plan", definition)
+    plan_bladder_center = organ_centroid(patient, "bladder", "_plan", definition)
+    plan_rectum_center = organ_centroid(patient, "rectum", "_plan", definition)
+    plan_bones_center = organ_centroid(patient, "bones", "_plan", definition)
 
     distances = [[], [], []]
     keys = [np.array(plan_bones_center), np.array(plan_bladder_center), np.array(plan_rectum_center)]
 
     for i in range(1, 14):
-        prostate = np.array(find_center_of_mass(trimesh.load_mesh(
-            FILEPATH + "{}\\prostate\\prostate{}.obj".format(patient, i)).vertices))
-        bladder = np.array(find_center_of_mass(trimesh.load_mesh(
-            FILEPATH + "{}\\bladder\\bladder{}.obj".format(patient, i)).vertices))
-        rectum = np.array(find_center_of_mass(trimesh.load_mesh(
-            FILEPATH + "{}\\rectum\\rectum{}.obj".format(patient, i)).vertices))
-        bones = np.array(find_center_of_mass(trimesh.load_mesh(
-            FILEPATH + "{}\\bones\\bones{}.obj".format(patient, i)).vertices))
+        prostate = organ_centroid(patient, "prostate", i, definition)
+        bladder = organ_centroid(patient, "bladder", i, definition)
+        rectum = organ_centroid(patient, "rectum", i, definition)
+        bones = organ_centroid(patient, "bones", i, definition)
 
         organs = [bones, bladder, rectum]
         transform_matrix = create_translation_matrix(plan_prostate_center, prostate)
@@ -143,6 +386,46 @@ def compute_distances_after_centering_centroid(patient):
     return distances
 
 
+def fraction_distances_centroid(patient, timestamp, icp_matrix, definition=CENTROID):
+    """
+    Compute the distances of one timestamp for both RMs, so a newly arrived fraction is computed on its own.
+    :param patient: id of the patient
+    :param timestamp: the new timestamp
+    :param icp_matrix: transformation matrix of the icp RM of the timestamp
+    :param definition: centroid definition: vertex, area or volume
+    :return: icp distances (prostate, bladder, rectum) and prostate centring distances (bones, bladder, rectum)
+    """
+    organs = ["bones", "prostate", "bladder", "rectum"]
+    plan = {organ: organ_centroid(patient, organ, "_plan", definition) for organ in organs}
+    fraction = {organ: organ_centroid(patient, organ, timestamp, definition) for organ in organs}
+    centring_matrix = create_translation_matrix(plan["prostate"], fraction["prostate"])
+
+    icp_distances, center_distances = [], []
+    for icp_organ, center_organ in [("prostate", "bones"), ("bladder", "bladder"), ("rectum", "rectum")]:
+        transformed = vertices_transformation(icp_matrix, [[[fraction[icp_organ]]]])
+        icp_distances.append(np.linalg.norm(plan[icp_organ] - np.array(transformed)))
+        transformed = vertices_transformation(centring_matrix, [[[fraction[center_organ]]]])
+        center_distances.append(np.linalg.norm(plan[center_organ] - np.array(transformed)))
+
+    return icp_distances, center_distances
+
+
+def update_average(average, count, new, old=None):
+    """
+    Updates the running average without the other values.
+    :param average: average of the count values, ignored when count is 0
+    :param count: number of the averaged values including the new one
+    :param new: the new value
+    :param old: the replaced value if the value is not new
+    :return: the updated average
+    """
+    if old is not None:
+        return average + (new - old) / count
+    if count == 1:
+        return new
+    return average + (new - average) / count
+
+
 def compute_average_distances(distances):
     """Compute average distances of patient's organs during the treatment time. The first organ in RM-dependent"""
     prostate_or_bones, bladder, rectum = distances[0], distances[1], distances[2]
@@ -0,0 +1,136 @@
+import os
+import argparse
+import plotly.graph_objects as go
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import constants
+from constants import PATIENTS, TIMESTAMPS
+
+# the snapshots are rendered without the browser, so the figures get a fixed size
+WIDTH, HEIGHT = 1600, 600
+
+
+def write_figure(fig, path, image_format):
+    """
+    Writes the figure as an image. The image is renamed only after it was completely written, so an interrupted run
+    never leaves a file which would be skipped later.
+    :param fig: plotly figure
+    :param path: path of the image without the extension
+    :param image_format: png, pdf, svg or jpeg
+    :return: path of the written image
+    """
+    path = "{}.{}".format(path, image_format)
+    temporary = "{}.tmp.{}".format(path, image_format)
+    fig.write_image(temporary, format=image_format, width=WIDTH, height=HEIGHT)
+    os.replace(temporary, path)
+
+    return path
+
+
+def render_overview(output, image_format, scale):
+    """
+    Renders the graphs of the patients overview section.
+    :param output: directory of the report
+    :param image_format: format of the images
+    :param scale: uniform or individual
+    :return: number of rendered images
+    """
+    import application_dash
+
+    figures = {}
+    for method, name in [("ICP", "heatmap_icp"), ("Prostate Centring", "heatmap_center"),
+                         ("Organ Registration", "heatmap_organ")]:
+        layout = go.Layout(font=dict(size=15, color='darkgrey'), paper_bgcolor='rgba(50,50,50,1)',
+                           margin=dict(t=100, b=70, l=90, r=81), plot_bgcolor='rgba(50,50,50,1)',
+                           title=dict(text="Difference of patients' organ positions after {}".format(
+                               constants.METHOD_TITLES[method]), x=0.5, font=dict(size=20, color='lightgrey')))
+        fig = application_dash.create_heatmap_fig(scale, layout, method)
+        application_dash.create_lines_for_heatmaps(fig)
+        fig.update_yaxes(ticktext=PATIENTS, tickmode="array", tickvals=list(range(len(PATIENTS))))
+        figures[name] = fig
+
+    colors_icp = [[constants.BLUE1] * 13, [constants.BLUE3] * 13, [constants.BLUE4] * 13]
+    colors_center = [[constants.BLUE2] * 13, [constants.BLUE3] * 13, [constants.BLUE4] * 13]
+    sizes = [[0] * 13, [0] * 13, [0] * 13]
+    figures["averages"] = application_dash.finish_averages_figure(
+        application_dash.make_averages_figure(colors_icp, sizes, colors_center, sizes), scale)
+    for organ in constants.ORGANS:
+        figures["cohort_statistics_{}".format(organ.lower())] = application_dash.make_cohort_statistics_figure(organ)
+
+    rendered = 0
+    for name, fig in figures.items():
+        path = os.path.join(output, name)
+        if not os.path.exists("{}.{}".format(path, image_format)):
+            write_figure(fig, path, image_format)
+            rendered += 1
+
+    return rendered
+
+
+def render_patient(patient, output, image_format, scale, methods, organs):
+    """
+    Renders the individual patient graphs and the 3D comparisons of the plan organs with every timestamp. It runs in
+    its own process, so the selected patient can be set as the global variable of the application.
+    :param patient: id of the patient
+    :param output: directory of the report
+    :param image_format: format of the images
+    :param scale: uniform or individual
+    :param methods: RMs of the 3D comparisons
+    :param organs: organs shown in the 3D comparisons
+    :return: patient id and the number of rendered images
+    """
+    import application_dash
+
+    application_dash.patient_id = patient
+    directory = os.path.join(output, patient)
+    os.makedirs(directory, exist_ok=True)
+    rendered = 0
+
+    def render(name, builder):
+        nonlocal rendered
+        path = os.path.join(directory, name)
+        if not os.path.exists("{}.{}".format(path, image_format)):
+            write_figure(builder(), path, image_format)
+            rendered += 1
+
+    colors_icp = [[constants.BLUE1] * 13, [constants.BLUE3] * 13, [constants.BLUE4] * 13]
+    colors_center = [[constants.BLUE2] * 13, [constants.BLUE3] * 13, [constants.BLUE4] * 13]
+    sizes = [[0] * 13, [0] * 13, [0] * 13]
+    render("organ_distances", lambda: application_dash.finish_organ_distances_figure(
+        application_dash.make_organ_distances_figure(colors_icp, sizes, colors_center, sizes), scale))
+
+    render("plan_organs", lambda: application_dash.make_3d_figure(methods[0], organs, "Plan organs", "_plan", "_plan"))
+    for method in methods:
+        for timestamp in TIMESTAMPS:
+            render("3d_{}_{}".format(method.lower().replace(" ", "_"), timestamp),
+                   lambda: application_dash.make_3d_figure(method, organs, "Two timestamps", "_plan", timestamp))
+
+    return patient, rendered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Renders the graphs of the whole cohort into image files. Images "
+                                                 "which already exist are skipped, so an interrupted run can be "
+                                                 "resumed by running the same command again.")
+    parser.add_argument("--output", default="reports", help="directory of the report")
+    parser.add_argument("--format", default="png", choices=["png", "pdf", "svg", "jpeg"], help="format of the images")
+    parser.add_argument("--scale", default="uniform", choices=["uniform", "individual"], help="scale of the graphs")
+    parser.add_argument("--patients", nargs="+", default=PATIENTS, help="ids of the rendered patients")
+    parser.add_argument("--methods", nargs="+", default=constants.METHODS, help="RMs of the 3D comparisons")
+    parser.add_argument("--organs", nargs="+", default=constants.ORGANS, help="organs in the 3D comparisons")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    print("Overview: {} images rendered".format(render_overview(args.output, args.format, args.scale)))
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(render_patient, patient, args.output, args.format, args.scale, args.methods,
+                                   args.organs) for patient in args.patients]
+        for done, future in enumerate(as_completed(futures), start=1):
+            patient, rendered = future.result()
+            print("[{}/{}] patient {}: {} images rendered".format(done, len(futures), patient, rendered))
+
+
+if __name__ == '__main__':
+    main()
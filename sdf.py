@@ -0,0 +1,158 @@
+import os
+import json
+import threading
+import numpy as np
+import trimesh
+from collections import namedtuple
+from scipy.spatial import cKDTree
+
+import registration_methods
+import voxel_overlap
+from constants import PATIENTS, SDF_DIR, SDF_PITCH, SDF_MARGIN
+
+ORGANS = ["bones", "prostate", "bladder", "rectum"]
+
+# stored fields of an older version are rebuilt
+SDF_VERSION = 1
+
+# grid of the signed distances in mm, negative inside the organ; the value of index (i, j, k) belongs to the point
+# origin + (i, j, k) * pitch
+Field = namedtuple("Field", ["origin", "pitch", "values"])
+
+# memory-mapped fields opened by this process
+_fields = {}
+_lock = threading.Lock()
+
+
+def _paths(patient, organ):
+    path = os.path.join(SDF_DIR, "{}_{}".format(patient, organ.lower()))
+    return path + ".npy", path + ".json"
+
+
+def _source(patient, organ):
+    stat = os.stat(registration_methods.obj_path(patient, organ, "_plan"))
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build(patient, organ, pitch=SDF_PITCH, margin=SDF_MARGIN):
+    """
+    Samples the signed distance of the plan organ surface on a regular grid around the organ and stores it as float16.
+    The distances are measured to points sampled on the surface with a quarter of the pitch apart, the sign comes from
+    the filled voxels of voxel_overlap.py on the same lattice.
+    :param patient: id of the patient
+    :param organ: organ or bones
+    :param pitch: spacing of the grid in mm
+    :param margin: distance in mm by which the grid exceeds the bounding box of the organ
+    :return: Field
+    """
+    vertices, faces = registration_methods.import_obj([registration_methods.obj_path(patient, organ, "_plan")])[0]
+    mesh = trimesh.Trimesh(np.asarray(vertices, dtype=np.float64), faces, process=False)
+
+    lower = np.floor((mesh.bounds[0] - margin) / pitch).astype(np.int32)
+    upper = np.ceil((mesh.bounds[1] + margin) / pitch).astype(np.int32)
+    shape = tuple(upper - lower + 1)
+
+    samples, _ = trimesh.sample.sample_surface(mesh, max(int(mesh.area / (pitch / 4) ** 2), len(mesh.vertices)),
+                                               seed=0)
+    tree = cKDTree(np.vstack([mesh.vertices, samples]))
+    axes = [np.arange(lower[i], upper[i] + 1) * pitch for i in range(3)]
+    points = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+    distances = tree.query(points, workers=-1)[0].reshape(shape)
+
+    inside = voxel_overlap.unpack_voxels(voxel_overlap.pack_voxels(voxel_overlap.occupied_voxels(
+        mesh.vertices, mesh.faces, pitch), lower, shape), shape)
+    distances[inside] *= -1
+
+    os.makedirs(SDF_DIR, exist_ok=True)
+    values_path, header_path = _paths(patient, organ)
+    temporary = "{}.{}.tmp.npy".format(values_path, threading.get_ident())
+    np.save(temporary, distances.astype(np.float16))
+    os.replace(temporary, values_path)
+    with open(header_path, "w") as header_f:
+        json.dump(dict(version=SDF_VERSION, source=_source(patient, organ), origin=(lower * pitch).tolist(),
+                       pitch=pitch, margin=margin), header_f)
+
+    return Field(lower * pitch, pitch, np.load(values_path, mmap_mode="r"))
+
+
+def _load(patient, organ):
+    values_path, header_path = _paths(patient, organ)
+    try:
+        with open(header_path, "r") as header_f:
+            header = json.load(header_f)
+        values = np.load(values_path, mmap_mode="r")
+    except (FileNotFoundError, ValueError):
+        return build(patient, organ, SDF_PITCH, SDF_MARGIN)
+
+    if header.get("version") != SDF_VERSION or header["source"] != _source(patient, organ) or \
+            header["pitch"] != SDF_PITCH or header.get("margin") != SDF_MARGIN:
+        return build(patient, organ, SDF_PITCH, SDF_MARGIN)
+    return Field(np.array(header["origin"]), header["pitch"], values)
+
+
+def get(patient, organ):
+    """
+    Signed distance field of the plan organ. It is memory-mapped from its file on the first use in the process, so
+    the processes of the server share its pages, and built only if the file is missing, older than the plan mesh or
+    sampled with another pitch or margin.
+    :param patient: id of the patient
+    :param organ: organ or bones
+    :return: Field, its values must not be changed
+    """
+    key = (patient, organ.lower())
+    with _lock:
+        if key not in _fields:
+            _fields[key] = _load(patient, organ)
+
+    return _fields[key]
+
+
+def query(field, points, block=1 << 20):
+    """
+    Signed distances of the points to the surface by trilinear interpolation of the grid, computed in blocks so
+    millions of points need little memory. The distance of a point outside the grid is the one of the closest grid
+    point increased by their distance, an upper bound which is never less than the true distance.
+    :param field: Field from get()
+    :param points: array of shape (N, 3)
+    :param block: number of points interpolated at once
+    :return: float32 array of N distances in mm, negative inside the organ
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    shape = np.array(field.values.shape)
+    result = np.empty(len(points), dtype=np.float32)
+
+    for start in range(0, len(points), block):
+        position = (points[start:start + block] - field.origin) / field.pitch
+        clamped = np.clip(position, 0, shape - 1)
+        outside = np.linalg.norm(position - clamped, axis=1) * field.pitch
+
+        cell = np.minimum(np.floor(clamped).astype(np.int64), shape - 2)
+        fraction = clamped - cell
+        i, j, k = cell.T
+        x, y, z = fraction.T
+        values = np.zeros(len(position))
+        for di in (0, 1):
+            for dj in (0, 1):
+                for dk in (0, 1):
+                    weight = (x if di else 1 - x) * (y if dj else 1 - y) * (z if dk else 1 - z)
+                    values += weight * field.values[i + di, j + dj, k + dk]
+
+        result[start:start + block] = values + outside
+
+    return result
+
+
+def distances(patient, organ, points):
+    """Signed distances of the points to the plan organ surface of the patient, see query()."""
+    return query(get(patient, organ), points)
+
+
+def build_all(patients=PATIENTS):
+    """Builds the fields of the cohort, e.g. before the application starts."""
+    for patient in patients:
+        for organ in ORGANS:
+            build(patient, organ)
+
+
+if __name__ == '__main__':
+    build_all()
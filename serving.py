@@ -0,0 +1,88 @@
+import gzip
+import time
+import logging
+import plotly.io
+from flask import request, g
+
+from constants import COMPRESS_MIN_SIZE, STATIC_MAX_AGE
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import flask_compress
+except ImportError:
+    flask_compress = None
+
+log = logging.getLogger(__name__)
+
+
+def use_fast_json():
+    """Serializes the figures with orjson if it is installed, numpy arrays are then sent as plotly typed arrays."""
+    if orjson is not None:
+        plotly.io.json.config.default_engine = "orjson"
+
+
+def compression_available():
+    """Responses are compressed by flask-compress through the compress option of Dash, if it is installed."""
+    if flask_compress is None:
+        log.warning("flask-compress is not installed, the responses are sent uncompressed")
+    return flask_compress is not None
+
+
+def enable(app):
+    """
+    Turns on the serving mode: fast json, cache headers of the static assets and logging of the bytes and the time of
+    every callback response. The compression of the responses is turned on when the Dash application is created.
+    :param app: Dash application
+    """
+    use_fast_json()
+    server = app.server
+    # flask-compress reads the minimal size of every response from the configuration
+    server.config["COMPRESS_MIN_SIZE"] = COMPRESS_MIN_SIZE
+
+    @server.before_request
+    def start_timer():
+        g.start = time.perf_counter()
+
+    @server.after_request
+    def finish_response(response):
+        if request.path.startswith(app.config.requests_pathname_prefix + "assets/"):
+            response.headers["Cache-Control"] = "public, max-age={}".format(STATIC_MAX_AGE)
+
+        # the compression runs after this hook, so the logged size is the one of the uncompressed body
+        if request.path.endswith("_dash-update-component") and not response.direct_passthrough:
+            body = request.get_json(silent=True) or {}
+            log.info("%s: %d bytes, %.1f ms", body.get("output"), response.calculate_content_length() or 0,
+                     1000 * (time.perf_counter() - g.start))
+
+        return response
+
+
+def serialization_report(figures):
+    """
+    Measures the serialization time and the size of the figures with the standard and the fast json engine and
+    after compression, used to compare the serving modes.
+    :param figures: dictionary of the figure names and figures
+    :return: dictionary of the figure names and their measurements
+    """
+    report = {}
+    for name, figure in figures.items():
+        measurements = {}
+        for engine in ["json"] + (["orjson"] if orjson is not None else []):
+            start = time.perf_counter()
+            data = plotly.io.to_json(figure, engine=engine).encode()
+            measurements[engine] = dict(seconds=time.perf_counter() - start, bytes=len(data))
+        measurements["gzip"] = len(gzip.compress(data, compresslevel=6))
+        if brotli is not None:
+            measurements["br"] = len(brotli.compress(data, quality=5))
+        report[name] = measurements
+
+    return report
@@ -0,0 +1,62 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+import mesh_cache
+from constants import TIMESTAMPS, METHODS, ORGANS
+
+
+def surface_metrics(fst_distances, snd_distances):
+    """
+    Symmetric surface-distance metrics from the distances of the vertices of one surface to the other one and back.
+    :return: Hausdorff distance, mean surface distance and the 95th percentile Hausdorff distance
+    """
+    hausdorff = max(fst_distances.max(), snd_distances.max())
+    mean = np.concatenate([fst_distances, snd_distances]).mean()
+    percentile = max(np.percentile(fst_distances, 95), np.percentile(snd_distances, 95))
+
+    return [hausdorff, mean, percentile]
+
+
+def fractions_surface_metrics(plan_vertices, fractions, plan_tree=None):
+    """
+    Computes the surface metrics of all fractions of one organ against the plan organ. The plan KD-tree is queried
+    with the vertices of all fractions in one batch.
+    :param plan_vertices: vertices of the plan organ
+    :param fractions: vertices of the aligned organ in every timestamp
+    :param plan_tree: KD-tree of the plan vertices, built if it is not given
+    :return: 2d list of the metrics in order: Hausdorff, mean, 95th percentile, each with the values of all fractions
+    """
+    plan_vertices = np.asarray(plan_vertices, dtype=np.float64)
+    plan_tree = cKDTree(plan_vertices) if plan_tree is None else plan_tree
+
+    fractions = [np.asarray(vertices, dtype=np.float64) for vertices in fractions]
+    to_plan, _ = plan_tree.query(np.vstack(fractions))
+    to_plan = np.split(to_plan, np.cumsum([len(vertices) for vertices in fractions])[:-1])
+
+    metrics = [[], [], []]
+    for vertices, distances in zip(fractions, to_plan):
+        from_plan, _ = cKDTree(vertices).query(plan_vertices)
+        for i, value in enumerate(surface_metrics(distances, from_plan)):
+            metrics[i].append(float(value))
+
+    return metrics
+
+
+def patient_surface_metrics(patient):
+    """
+    Computes the surface metrics of every organ of the patient after every RM. The distances are measured between
+    the vertices of the meshes, which sample their surfaces.
+    :param patient: id of the patient
+    :return: 4d list indexed by RM, metric, organ and timestamp
+    """
+    result = [[[[] for _ in ORGANS] for _ in range(3)] for _ in METHODS]
+
+    for k, organ in enumerate(ORGANS):
+        plan_vertices = mesh_cache.get_object(patient, organ, "_plan")[0]
+        for m, method in enumerate(METHODS):
+            fractions = [mesh_cache.get_aligned_object(patient, organ, t, method)[0] for t in TIMESTAMPS]
+            for i, values in enumerate(fractions_surface_metrics(plan_vertices, fractions,
+                                                                 mesh_cache.get_plan_tree(patient, organ))):
+                result[m][i][k] = values
+
+    return result
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+import trimesh
+
+import centroid
+from constants import CENTROIDS
+
+
+def sample_meshes():
+    meshes = []
+    for i, subdivisions in enumerate([1, 2, 3]):
+        mesh = trimesh.creation.icosphere(subdivisions=subdivisions, radius=10 + i)
+        mesh.vertices = mesh.vertices * [1.3, 1, 0.8] + [20 * i, -5 * i, 3]
+        meshes.append([np.asarray(mesh.vertices, dtype=np.float32), np.asarray(mesh.faces, dtype=np.int32)])
+    return meshes
+
+
+@pytest.mark.parametrize("definition", CENTROIDS)
+def test_groups_match_single_meshes(definition):
+    meshes = sample_meshes()
+    single = np.array([centroid.centroid(vertices, faces, definition) for vertices, faces in meshes])
+
+    np.testing.assert_allclose(centroid.batch_centroids(meshes, definition, block=100), single)
+    np.testing.assert_allclose(centroid.batch_centroids(meshes, definition), single)
+
+
+@pytest.mark.parametrize("definition", CENTROIDS)
+def test_empty_meshes(definition):
+    meshes = sample_meshes()
+    no_faces = [meshes[0][0], np.empty((0, 3), dtype=np.int32)]
+    empty = [np.empty((0, 3), dtype=np.float32), np.empty((0, 3), dtype=np.int32)]
+    expected = centroid.batch_centroids(meshes, definition)
+
+    result = centroid.batch_centroids([empty, meshes[0], no_faces, meshes[1], empty, meshes[2]], definition)
+
+    assert np.all(np.isnan(result[[0, 2, 4]]))
+    np.testing.assert_allclose(result[[1, 3, 5]], expected)
+    assert np.all(np.isnan(centroid.batch_centroids([empty], definition)))
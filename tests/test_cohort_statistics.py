@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import cohort_statistics
+from constants import METHODS
+
+
+def interval(values, resamples=2000, seed=0):
+    return np.nanpercentile(cohort_statistics.bootstrap_means(values, resamples, seed), [2.5, 97.5], axis=0)
+
+
+def test_interval_contains_mean():
+    values = np.random.default_rng(1).gamma(2, 2, (40, 3, 13))
+    low, high = interval(values)
+
+    assert np.all(low <= values.mean(axis=0)) and np.all(values.mean(axis=0) <= high)
+
+
+def test_same_seed_same_means():
+    values = np.random.default_rng(1).normal(5, 2, (30, 4))
+
+    np.testing.assert_array_equal(cohort_statistics.bootstrap_means(values, 500, 7),
+                                  cohort_statistics.bootstrap_means(values, 500, 7))
+
+
+def test_interval_narrows_with_cohort():
+    rng = np.random.default_rng(2)
+    widths = []
+    for patients in [10, 40, 160, 640]:
+        low, high = interval(rng.normal(5, 2, (patients, 1)))
+        widths.append(float(high[0] - low[0]))
+
+    assert all(narrower < wider for narrower, wider in zip(widths[1:], widths))
+    # the width of the interval falls with the square root of the cohort size
+    assert 1.5 < widths[0] / widths[2] < 6
+
+
+@pytest.mark.filterwarnings("ignore:All-NaN slice:RuntimeWarning")
+def test_missing_fractions():
+    values = np.random.default_rng(3).normal(5, 2, (50, 13))
+    values[::3, 4] = np.nan
+    values[:, 7] = np.nan
+    means = cohort_statistics.bootstrap_means(values, 1000)
+    low, high = interval(values)
+
+    assert np.all(np.isnan(means[:, 7]))
+    assert not np.any(np.isnan(np.delete(means, 7, axis=1)))
+    assert low[4] <= np.nanmean(values[:, 4]) <= high[4]
+
+
+def test_single_patient():
+    values = np.array([[1.5, np.nan, 3.0]])
+    means = cohort_statistics.bootstrap_means(values, 100)
+
+    np.testing.assert_array_equal(means[:, 0], 1.5)
+    assert np.all(np.isnan(means[:, 1]))
+    np.testing.assert_array_equal(means[:, 2], 3.0)
+
+
+def test_compute_single_patient_with_missing_fraction():
+    dataset = {key: np.random.default_rng(4).uniform(0, 10, (1, 3, 13))
+               for key in cohort_statistics.DISTANCE_KEYS.values()}
+    dataset["distances_icp"][0, :, 5] = np.nan
+    statistics = cohort_statistics.compute(dataset, resamples=200)
+
+    icp = METHODS.index("ICP")
+    np.testing.assert_allclose(statistics["mean_interval"][0, icp, 1:, 0], dataset["distances_icp"][0, :, 0])
+    np.testing.assert_allclose(statistics["mean_interval"][1, icp, 1:, 0], dataset["distances_icp"][0, :, 0])
+    assert np.all(np.isnan(statistics["mean_interval"][:, icp, :, 5]))
+    # the paired differences exist only for the bladder and the rectum, which both RMs measure
+    assert np.all(statistics["patients"][:, 5] == 0)
+    np.testing.assert_array_equal(statistics["patients"][:, 0], [0, 0, 1, 1])
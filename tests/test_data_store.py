@@ -0,0 +1,35 @@
+import pytest
+
+import data_store
+import ingest
+
+
+def test_data_version_ignores_temporary_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_store, "COMPUTATIONS_DIR", str(tmp_path))
+    (tmp_path / "icp_distances_c.txt").write_text("[]")
+    version = data_store.data_version()
+
+    (tmp_path / "icp_distances_c.txt.tmp").write_text("[[]]")
+    assert data_store.data_version() == version
+
+    (tmp_path / "icp_distances_c.txt").write_text("[[1]]")
+    assert data_store.data_version() != version
+
+
+def test_publishing_files_are_not_loaded(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_store, "COMPUTATIONS_DIR", str(tmp_path))
+    (tmp_path / data_store.PUBLISHING_FILE).write_text("")
+
+    with pytest.raises(ValueError):
+        data_store.load_dataset()
+
+
+def test_publish_replaces_all_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_store, "COMPUTATIONS_DIR", str(tmp_path))
+    (tmp_path / "icp_distances_c.txt").write_text("old")
+
+    ingest.publish({"icp_distances_c.txt": "new", "icp_averages_c.txt": "1.0\n"})
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["icp_averages_c.txt", "icp_distances_c.txt"]
+    assert (tmp_path / "icp_distances_c.txt").read_text() == "new"
+    assert not data_store.publishing()
@@ -0,0 +1,37 @@
+import os
+import plotly.graph_objects as go
+
+import data_store
+import figure_cache
+
+
+def use_cache(tmp_path, monkeypatch, version):
+    monkeypatch.setattr(figure_cache, "FIGURE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(figure_cache, "_size", None)
+    monkeypatch.setattr(data_store, "current", lambda: dict(version=version))
+
+
+def test_clear_keeps_figures_of_new_version(tmp_path, monkeypatch):
+    use_cache(tmp_path, monkeypatch, "old")
+    figure_cache.get_or_create("graph", [1], lambda: go.Figure())
+    use_cache(tmp_path, monkeypatch, "new")
+    figure_cache.get_or_create("graph", [1], lambda: go.Figure())
+
+    figure_cache.clear(dict(version="new"))
+
+    assert [name.startswith(figure_cache._prefix("new")) for name in os.listdir(tmp_path)] == [True]
+
+
+def test_directory_is_scanned_only_over_limit(tmp_path, monkeypatch):
+    use_cache(tmp_path, monkeypatch, "v")
+    scans = []
+    evict = figure_cache.evict
+    monkeypatch.setattr(figure_cache, "evict", lambda: scans.append(1) or evict(max_size=200000))
+    monkeypatch.setattr(figure_cache, "FIGURE_CACHE_SIZE", 200000)
+
+    for i in range(40):
+        figure_cache.get_or_create("graph", [i], lambda: go.Figure(go.Scatter(y=list(range(100)))))
+
+    size = sum(entry.stat().st_size for entry in os.scandir(tmp_path))
+    assert 1 < len(scans) < 20
+    assert size <= 200000 + 20000
@@ -0,0 +1,57 @@
+import os
+import numpy as np
+import pytest
+import trimesh
+
+import centroid
+import computations_file_writer
+import constants
+import data_store
+import registration_methods
+from scipy.spatial.transform import Rotation
+
+
+def rigid_matrix(angles, translation):
+    matrix = np.identity(4)
+    matrix[:3, :3] = Rotation.from_euler("xyz", angles, degrees=True).as_matrix()
+    matrix[:3, 3] = translation
+    return matrix
+
+
+@pytest.mark.skipif(not os.path.exists(registration_methods.obj_path(constants.PATIENTS[0], "bones", "_plan")),
+                    reason="the meshes of the patients are not in FILEPATH")
+@pytest.mark.parametrize("name, icp", [("icp_distances_c.txt", True), ("center_distances_c.txt", False)])
+def test_stored_distances(name, icp):
+    path = os.path.join(data_store.COMPUTATIONS_DIR, name)
+    if not os.path.exists(path):
+        pytest.skip("{} was not computed".format(name))
+
+    assert computations_file_writer.verify_distances_centroid(path, icp) <= constants.DISTANCE_TOLERANCE
+
+
+def test_vertices_transformation_float32():
+    vertices = np.random.default_rng(0).uniform(-150, 150, (1000, 3))
+    matrix = rigid_matrix([3, -7, 12], [4.5, -20, 31])
+
+    single = registration_methods.vertices_transformation(matrix, [[vertices.astype(np.float32), None]])[0][0]
+    double = registration_methods.vertices_transformation(matrix, [[vertices, None]])[0][0]
+
+    assert single.dtype == np.float32 and double.dtype == np.float64
+    np.testing.assert_allclose(double, vertices @ matrix[:3, :3].T + matrix[:3, 3], atol=1e-9)
+    assert np.abs(single - double).max() < 1e-3
+
+
+def test_organ_centroid_float32(tmp_path, monkeypatch):
+    mesh = trimesh.creation.icosphere(subdivisions=3, radius=25)
+    mesh.vertices = (mesh.vertices + [110.3, -42.7, 230.1]).astype(np.float32)
+    monkeypatch.setattr(registration_methods, "FILEPATH", str(tmp_path) + os.sep)
+    mesh.export(registration_methods.obj_path("1", "bladder", 1))
+
+    for definition in constants.CENTROIDS:
+        expected = centroid.centroid(np.asarray(mesh.vertices, dtype=np.float64), mesh.faces, definition)
+        single = centroid.centroid(np.asarray(mesh.vertices, dtype=np.float32), mesh.faces, definition)
+        loaded = registration_methods.organ_centroid("1", "bladder", 1, definition)
+
+        assert np.linalg.norm(single - expected) < constants.DISTANCE_TOLERANCE
+        assert np.linalg.norm(loaded - expected) < constants.DISTANCE_TOLERANCE
+    assert np.linalg.norm(expected - [110.3, -42.7, 230.1]) < 0.01
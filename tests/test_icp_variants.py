@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import trimesh
+from scipy.spatial import cKDTree
+from scipy.spatial.transform import Rotation
+
+import organ_registration
+import registration_methods
+from constants import ICP_VARIANTS
+
+
+def organ_mesh():
+    """Irregular closed surface, so the rigid transformation which aligns it with itself is unique."""
+    mesh = trimesh.creation.icosphere(subdivisions=4, radius=1)
+    directions = mesh.vertices
+    radii = 30 * (1 + 0.25 * np.sin(3 * directions[:, 0] + 0.4) + 0.15 * np.cos(2 * directions[:, 1]))
+    return trimesh.Trimesh(directions * radii[:, np.newaxis] * [1.5, 1, 0.8] + [10, -40, 120], mesh.faces)
+
+
+def moved_vertices(mesh):
+    matrix = np.identity(4)
+    matrix[:3, :3] = Rotation.from_euler("xyz", [3, -2, 3], degrees=True).as_matrix()
+    matrix[:3, 3] = [1.5, -1, 2]
+    return trimesh.transform_points(mesh.vertices, matrix), np.linalg.inv(matrix)
+
+
+@pytest.mark.parametrize("variant", ICP_VARIANTS)
+def test_variants_recover_rigid_motion(variant):
+    key = organ_mesh()
+    other, expected = moved_vertices(key)
+
+    result = registration_methods.register(other, cKDTree(key.vertices), key.vertex_normals, variant)
+
+    np.testing.assert_allclose(result.matrix, expected, atol=1e-3)
+    assert result.error < 1e-6
+
+
+def test_variants_agree():
+    key = organ_mesh()
+    other, _ = moved_vertices(key)
+    tree = cKDTree(key.vertices)
+
+    matrices = [registration_methods.register(other, tree, key.vertex_normals, variant).matrix
+                for variant in ICP_VARIANTS]
+    batches = [organ_registration.batch_register([other], tree, key.vertex_normals, variant)[0].matrix
+               for variant in ICP_VARIANTS]
+
+    np.testing.assert_allclose(matrices[0], matrices[1], atol=1e-3)
+    np.testing.assert_allclose(batches[0], batches[1], atol=1e-3)
+    np.testing.assert_allclose(batches[0], matrices[0], atol=1e-3)
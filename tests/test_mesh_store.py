@@ -0,0 +1,23 @@
+import uuid
+from multiprocessing import shared_memory
+
+import mesh_store
+
+
+def test_missing_data_block_closes_the_header(monkeypatch):
+    name = "test_{}".format(uuid.uuid4().hex[:12])
+    header = shared_memory.SharedMemory(name=name + "_manifest", create=True, size=16)
+    attached = []
+    attach = mesh_store._attach
+    monkeypatch.setattr(mesh_store, "MESH_STORE_NAME", name)
+    monkeypatch.setattr(mesh_store, "_manifest", None)
+    monkeypatch.setattr(mesh_store, "_blocks", [])
+    monkeypatch.setattr(mesh_store, "_attach", lambda block: attached.append(attach(block)) or attached[-1])
+
+    try:
+        assert mesh_store.attach() == {}
+        assert len(attached) == 1 and attached[0].buf is None
+        assert mesh_store._blocks == []
+    finally:
+        header.close()
+        header.unlink()
@@ -0,0 +1,38 @@
+import os
+import numpy as np
+import trimesh
+
+import registration_methods
+import sdf
+
+
+def plan_sphere(tmp_path, monkeypatch):
+    monkeypatch.setattr(registration_methods, "FILEPATH", str(tmp_path) + os.sep)
+    monkeypatch.setattr(sdf, "SDF_DIR", str(tmp_path / "sdf"))
+    monkeypatch.setattr(sdf, "_fields", {})
+    trimesh.creation.icosphere(subdivisions=3, radius=5).export(registration_methods.obj_path("1", "bladder", "_plan"))
+
+
+def test_distances_outside_the_grid_are_upper_bounds(tmp_path, monkeypatch):
+    plan_sphere(tmp_path, monkeypatch)
+    field = sdf.build("1", "bladder", pitch=1, margin=2)
+    points = np.array([[0, 0, 0], [6, 0, 0], [12, 0, 0], [8, 8, 0], [0, -9, 6]], dtype=float)
+
+    true = np.linalg.norm(points, axis=1) - 5
+    distances = sdf.query(field, points)
+
+    np.testing.assert_allclose(distances[:2], true[:2], atol=0.5)
+    assert np.all(distances[2:] >= true[2:] - 0.5)
+
+
+def test_field_is_rebuilt_for_another_margin(tmp_path, monkeypatch):
+    plan_sphere(tmp_path, monkeypatch)
+    monkeypatch.setattr(sdf, "SDF_PITCH", 1)
+    monkeypatch.setattr(sdf, "SDF_MARGIN", 2)
+    narrow = sdf.get("1", "bladder")
+
+    monkeypatch.setattr(sdf, "_fields", {})
+    monkeypatch.setattr(sdf, "SDF_MARGIN", 6)
+    wide = sdf.get("1", "bladder")
+
+    assert np.all(np.array(wide.values.shape) > np.array(narrow.values.shape))
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+import trimesh
+
+import registration_methods
+
+
+def sample_meshes():
+    sphere = trimesh.creation.icosphere(subdivisions=3, radius=40)
+    sphere.vertices = sphere.vertices * [1.4, 1, 0.7] + [12.5, -30, 95]
+    # the vertices of the subdivided box lie on a regular grid, so many planes touch them exactly
+    box = trimesh.creation.box(extents=[20, 30, 40]).subdivide().subdivide()
+    return [sphere, box]
+
+
+def planes(mesh, axis):
+    coordinates = np.unique(mesh.vertices[:, axis])
+    lower, upper = coordinates[0], coordinates[-1]
+    between = np.linspace(lower, upper, 7)[1:-1]
+    return np.concatenate([[lower, upper], coordinates[::max(len(coordinates) // 6, 1)], between,
+                           [lower - 1, upper + 1]])
+
+
+@pytest.mark.parametrize("mesh", sample_meshes(), ids=["ellipsoid", "box"])
+@pytest.mark.parametrize("axis", [0, 1, 2])
+def test_slice_faces_match_mesh_plane(mesh, axis):
+    normal = np.eye(3)[axis]
+    for position in planes(mesh, axis):
+        origin = normal * position
+        lines, faces = trimesh.intersections.mesh_plane(mesh, normal, origin, return_faces=True)
+        candidates = registration_methods.slice_faces(mesh, axis, position)
+        local_lines, local_faces = trimesh.intersections.mesh_plane(mesh, normal, origin, return_faces=True,
+                                                                    local_faces=candidates)
+
+        assert set(faces) <= set(candidates)
+        np.testing.assert_array_equal(np.sort(local_faces), np.sort(faces))
+        np.testing.assert_allclose(local_lines[np.argsort(local_faces)], lines[np.argsort(faces)])
@@ -0,0 +1,106 @@
+import numpy as np
+import trimesh
+from collections import OrderedDict
+
+import mesh_cache
+from constants import TIMESTAMPS, METHODS, VOXEL_PITCH, OVERLAP_ORGANS, PLAN_GRID_CACHE
+
+# number of set bits of every byte value
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# packed occupancy grids of the plan organs, only the most recent ones are kept
+_plan_grids = OrderedDict()
+
+
+def occupied_voxels(vertices, faces, pitch=VOXEL_PITCH):
+    """
+    Rasterizes the mesh surface and fills its inside.
+    :param vertices: vertices of the mesh
+    :param faces: faces of the mesh
+    :param pitch: edge of a voxel in mm
+    :return: integer indices of the occupied voxels on the lattice with the origin in (0, 0, 0)
+    """
+    mesh = trimesh.Trimesh(np.asarray(vertices, dtype=np.float64), faces, process=False)
+    grid = mesh.voxelized(pitch).fill()
+    return np.round(grid.points / pitch).astype(np.int32)
+
+
+def pack_voxels(indices, lower, shape):
+    """
+    Creates the bit-packed occupancy grid, voxels outside the grid are left out.
+    :param indices: lattice indices of the occupied voxels
+    :param lower: lattice index of the first voxel of the grid
+    :param shape: shape of the grid
+    :return: grid packed along the last axis, eight voxels per byte
+    """
+    indices = indices - lower
+    inside = np.all((indices >= 0) & (indices < shape), axis=1)
+    grid = np.zeros(shape, dtype=bool)
+    grid[tuple(indices[inside].T)] = True
+    return np.packbits(grid, axis=-1)
+
+
+def unpack_voxels(packed, shape):
+    """Boolean occupancy grid of the given shape from the packed one."""
+    return np.unpackbits(packed, axis=-1, count=shape[-1]).astype(bool)
+
+
+def count_voxels(packed):
+    """Number of occupied voxels in the packed grid."""
+    return int(POPCOUNT[packed].sum(dtype=np.int64))
+
+
+def plan_grid(patient, organ, pitch=VOXEL_PITCH):
+    """
+    Packed occupancy grid of the plan organ in its own bounding box, computed once per patient and organ.
+    :return: lower lattice index, shape of the grid, packed grid and the voxel count
+    """
+    key = (patient, organ, pitch)
+    if key in _plan_grids:
+        _plan_grids.move_to_end(key)
+        return _plan_grids[key]
+
+    indices = occupied_voxels(*mesh_cache.get_object(patient, organ, "_plan"), pitch)
+    lower = indices.min(axis=0)
+    shape = tuple(indices.max(axis=0) - lower + 1)
+    _plan_grids[key] = lower, shape, pack_voxels(indices, lower, shape), len(indices)
+    if len(_plan_grids) > PLAN_GRID_CACHE:
+        _plan_grids.popitem(last=False)
+
+    return _plan_grids[key]
+
+
+def overlap(plan, indices):
+    """
+    Dice and Jaccard coefficients of the plan grid and the voxels of an aligned organ. The intersection lies inside
+    the plan bounding box, so the organ is packed only into that box.
+    :param plan: plan grid from plan_grid()
+    :param indices: lattice indices of the aligned organ voxels
+    :return: Dice and Jaccard coefficients
+    """
+    lower, shape, plan_packed, plan_count = plan
+    intersection = count_voxels(np.bitwise_and(plan_packed, pack_voxels(indices, lower, shape)))
+    union = plan_count + len(indices) - intersection
+
+    return 2 * intersection / (plan_count + len(indices)), intersection / union
+
+
+def patient_overlap(patient, pitch=VOXEL_PITCH):
+    """
+    Computes the volumetric overlap of the organs after every RM with their plan organs.
+    :param patient: id of the patient
+    :param pitch: edge of a voxel in mm
+    :return: 4d list indexed by RM, metric (Dice, Jaccard), organ and timestamp
+    """
+    result = [[[[] for _ in OVERLAP_ORGANS] for _ in range(2)] for _ in METHODS]
+
+    for k, organ in enumerate(OVERLAP_ORGANS):
+        plan = plan_grid(patient, organ, pitch)
+        for m, method in enumerate(METHODS):
+            for timestamp in TIMESTAMPS:
+                indices = occupied_voxels(*mesh_cache.get_aligned_object(patient, organ, timestamp, method), pitch)
+                dice, jaccard = overlap(plan, indices)
+                result[m][0][k].append(dice)
+                result[m][1][k].append(jaccard)
+
+    return result